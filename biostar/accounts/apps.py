@@ -13,6 +13,13 @@ class AccountsConfig(AppConfig):
 
     def ready(self):
         from . import signals
+        from biostar.utils import identity
+        from .models import Profile, User
+
+        # Hot lookups are served from the identity cache.
+        identity.register(Profile, 'uid', related=('user',))
+        identity.register(User, 'username', related=('profile',))
+
         # Triggered after a migration command.
         post_migrate.connect(init_app, sender=self)
 
@@ -0,0 +1,36 @@
+import logging
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import autodiscover_modules
+
+from biostar.utils import timers
+
+logger = logging.getLogger("engine")
+
+
+class Command(BaseCommand):
+    help = 'Shows the last run of the periodic tasks, or runs them when uwsgi is not used.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--run', action='store_true', default=False,
+                            help="Run the timers of the installed apps in this process.")
+
+    def handle(self, *args, **options):
+
+        if options['run']:
+            # The timers are registered when the task modules are imported.
+            autodiscover_modules('tasks')
+            for name, (secs, func) in timers.REGISTRY.items():
+                logger.info(f"starting timer {name} every {secs} seconds")
+                timers.start(name, secs, func)
+            while True:
+                time.sleep(3600)
+
+        self.stdout.write(f"{'timer':50} {'last run':>20} {'duration':>10} {'errors':>7} {'pid':>8}")
+        for name, data in timers.status().items():
+            if not data:
+                continue
+            last = datetime.fromtimestamp(data['last_run']).strftime('%Y-%m-%d %H:%M:%S')
+            self.stdout.write(f"{name:50} {last:>20} {data['duration']:9.2f}s {data['errors']:7} {data['pid']:8}")
@@ -9,6 +9,7 @@ from django.shortcuts import reverse
 from django.contrib.auth.models import User
 from django.db import models
 from biostar.accounts import util
+from biostar.utils import identity
 
 
 def fixcase(name):
@@ -273,6 +274,7 @@ class Profile(models.Model):
         score += 1 + (settings.LOW_REP_THRESHOLD - self.score)
 
         Profile.objects.filter(id=self.id).update(score=score)
+        identity.forget(self)
 
     @property
     def low_rep(self):
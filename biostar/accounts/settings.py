@@ -56,6 +56,9 @@ ADMIN_UPLOAD_SIZE = 1000
 
 MESSAGES_PER_PAGE = 5
 
+# Messages inserted at a time when notifying many users.
+MESSAGE_BATCH_SIZE = 500
+
 # Set RECAPTCH keys here.
 RECAPTCHA_PUBLIC_KEY = ""
 RECAPTCHA_PRIVATE_KEY = ""
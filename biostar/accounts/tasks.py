@@ -79,9 +79,12 @@ def verification_email(user):
 @spool(pass_arguments=True)
 def create_messages(template, rec_list, sender=None, extra_context={}):
     """
-    Create batch message from sender to a given recipient_list
+    Create batch message from sender to a given recipient_list.
+    The recipients share a single message body, messages are inserted in chunks.
     """
-    from biostar.accounts.models import User, Message, MessageBody
+    from django.db.models import F
+    from biostar.accounts import util
+    from biostar.accounts.models import User, Message, MessageBody, Profile
 
     # Get the sender
     name, email = settings.ADMINS[0]
@@ -94,10 +97,24 @@ def create_messages(template, rec_list, sender=None, extra_context={}):
     body = tmpl.render(context)
     html = mistune.markdown(body, escape=False)
 
+    body = MessageBody.objects.create(body=body, html=html)
+
+    # Each recipient gets one message, in the order given.
+    rec_list = list({rec.pk: rec for rec in rec_list}.values())
+    size = settings.MESSAGE_BATCH_SIZE
+    now = util.now()
+
     msgs = []
-    for rec in rec_list:
-        body = MessageBody.objects.create(body=body, html=html)
-        msg = Message.objects.create(sender=sender, recipient=rec, body=body)
-        msgs.append(msg)
+    for start in range(0, len(rec_list), size):
+        chunk = rec_list[start:start + size]
+
+        batch = [Message(sender=sender, recipient=rec, body=body, uid=util.get_uuid(10), sent_date=now)
+                 for rec in chunk]
+        Message.objects.bulk_create(batch)
+
+        # Bump the unread message counts.
+        Profile.objects.filter(user__in=chunk).update(new_messages=F('new_messages') + 1)
+
+        msgs.extend(batch)
 
     return msgs
@@ -218,6 +218,24 @@ class ProfileTest(TestCase):
 
 
 
+    @override_settings(MESSAGE_BATCH_SIZE=2)
+    def test_bulk_messages(self):
+        "Test that notifications share a body and are inserted in chunks"
+        from biostar.accounts import tasks
+
+        users = [models.User.objects.create(username=f"rec{num}", email=f"rec{num}@l.com") for num in range(5)]
+
+        # One body, then an insert and a counter update per chunk, repeated recipients count once.
+        with self.assertNumQueries(7):
+            tasks.create_messages(template="messages/welcome.md", rec_list=users + users[:2], sender=self.user)
+
+        msgs = models.Message.objects.filter(recipient__in=users, sender=self.user, unread=True)
+        self.assertEqual(msgs.count(), 5)
+        self.assertEqual(msgs.values('body').distinct().count(), 1)
+
+        # The welcome message is counted as well.
+        self.assertEqual(models.Profile.objects.filter(user__in=users, new_messages=2).count(), 5)
+
     def test_banned_user_login(self):
         "Test banned user can not login "
 
@@ -0,0 +1,166 @@
+import logging
+import os
+import threading
+import time
+from django.test import TestCase, override_settings
+from django.conf import settings
+from django.core.cache import caches
+from biostar.accounts.models import User, Profile
+from biostar.utils import executor, timers
+from biostar.utils.decorators import spool_once, task_key
+
+logger = logging.getLogger('engine')
+
+TEST_ROOT = os.path.abspath(os.path.join(settings.BASE_DIR, 'export', 'test'))
+
+# Arguments received by the task below.
+RECEIVED = []
+
+
+def record_task(profile, users, extra_context={}):
+    RECEIVED.append((profile, users, extra_context))
+
+
+@spool_once(key='user_id')
+def record_once(user_id):
+    RECEIVED.append(user_id)
+
+
+class TaskExecutorTest(TestCase):
+
+    def setUp(self):
+        logger.setLevel(logging.WARNING)
+        self.user = User.objects.create(username="executor", email="executor@tested.com")
+        self.profile = self.user.profile
+        self.name = executor.register(record_task)
+        RECEIVED.clear()
+
+    def test_pass_by_id(self):
+        """
+        Test that model arguments are queued by primary key and loaded when the task runs.
+        """
+        args = executor.pack((self.profile, [self.user]))
+        kwargs = executor.pack(dict(extra_context=dict(profile=self.profile)))
+        self.assertEqual(args[0], executor.ModelRef("accounts.Profile", self.profile.pk))
+
+        Profile.objects.filter(pk=self.profile.pk).update(name="Changed")
+
+        pool = executor.Executor(workers=1, size=1, timeout=0)
+        pool.run((self.name, args, kwargs, time.time(), None))
+
+        profile, users, context = RECEIVED[0]
+        self.assertEqual(profile.name, "Changed")
+        self.assertEqual(users, [self.user])
+        self.assertEqual(context['profile'], profile)
+
+    def test_backpressure(self):
+        """
+        Test that a full queue makes the caller run the task.
+        """
+        blocked = threading.Event()
+        pool = executor.Executor(workers=1, size=1, timeout=0.01)
+        pool.start()
+
+        # Keep the worker busy, then fill the queue.
+        pool.put((executor.register(blocked.wait), (), {}, time.time(), None))
+        time.sleep(0.1)
+        pool.put((self.name, (None, []), {}, time.time(), None))
+        pool.put((self.name, ("caller", []), {}, time.time(), None))
+
+        self.assertEqual([profile for profile, users, context in RECEIVED], ["caller"])
+
+        blocked.set()
+        pool.join()
+        self.assertEqual(len(RECEIVED), 2)
+
+    def test_spool_once(self):
+        """
+        Test that a pending task absorbs the submissions with the same key.
+        """
+        pool = executor.Executor(workers=0, size=100, timeout=0)
+        pool.started = True
+        self.addCleanup(setattr, executor, "_executor", executor._executor)
+        executor._executor = pool
+
+        with self.settings(MULTI_THREAD=True):
+            for step in range(10):
+                record_once(user_id=self.user.pk)
+            record_once(user_id=0)
+
+            self.assertEqual(pool.tasks.qsize(), 2)
+
+            # The keys are seen by the process running the task.
+            self.assertTrue(caches['shared'].get(task_key("record_once", self.user.pk)))
+
+            # Running the task lets the next submission in.
+            pool.run(pool.tasks.get())
+            record_once(user_id=self.user.pk)
+            self.assertEqual(pool.tasks.qsize(), 2)
+
+        self.assertEqual(RECEIVED, [self.user.pk])
+
+    def test_durable_queue(self):
+        """
+        Test that the tasks of a process are taken over once its lease expires.
+        """
+        path = os.path.join(TEST_ROOT, "tasks.db")
+        os.makedirs(TEST_ROOT, exist_ok=True)
+        if os.path.isfile(path):
+            os.remove(path)
+
+        store = executor.Store(path, lease=60)
+        self.addCleanup(os.remove, path)
+        rowid = store.add(self.name, executor.pack((self.profile, [])), {})
+
+        # The tasks of a live process are left alone.
+        pool = executor.Executor(workers=1, size=10, timeout=0, path=path)
+        self.assertEqual(pool.store.claim(), [])
+
+        # The process stopped renewing its lease.
+        store.conn.execute("UPDATE tasks SET expires = ? WHERE id = ?", (time.time() - 1, rowid))
+
+        claimed = pool.store.claim()
+        self.assertEqual([row[0] for row in claimed], [rowid])
+        self.assertEqual(store.claim(), [])
+
+        for row in claimed:
+            pool.run((row[1], row[2], row[3], time.time(), row[0]))
+
+        self.assertEqual(RECEIVED[0][0], self.profile)
+        self.assertFalse(store.conn.execute("SELECT id FROM tasks").fetchall())
+
+
+@override_settings(TIMER_LOCK_DIR=os.path.join(TEST_ROOT, "locks"))
+class TimerTest(TestCase):
+
+    def test_single_leader(self):
+        """
+        Test that only one holder of the lock file runs a timer.
+        """
+        leader = timers.acquire("test-timer")
+        self.addCleanup(leader.close)
+
+        self.assertTrue(leader)
+        self.assertIsNone(timers.acquire("test-timer"))
+
+    def test_status(self):
+        """
+        Test that the last run of each timer is reported.
+        """
+        def fail():
+            raise ValueError("failed")
+
+        timers.run("test-ok", func=lambda: time.sleep(0.01))
+        timers.run("test-fail", func=fail)
+
+        # The status is read from the files next to the locks, by any process.
+        self.assertTrue(os.path.isfile(timers.status_path("test-ok")))
+
+        status = timers.status()
+        self.assertGreaterEqual(status["test-ok"]["duration"], 0.01)
+        self.assertEqual(status["test-ok"]["errors"], 0)
+        self.assertEqual(status["test-fail"]["errors"], 1)
+
+        # The loop of a timer is started once per process.
+        self.assertTrue(timers.start("test-loop", 3600, func=fail))
+        self.assertFalse(timers.start("test-loop", 3600, func=fail))
@@ -30,6 +30,7 @@ from .const import *
 from .models import User, Profile, Message, Logger
 from .tokens import account_verification_token
 from .util import now, get_uuid
+from biostar.utils import identity
 
 
 logger = logging.getLogger('engine')
@@ -69,6 +70,8 @@ def edit_profile(request):
                                                      message_prefs=form.cleaned_data["message_prefs"],
                                                      html=markdown(form.cleaned_data["text"]),
                                                      digest_prefs=form.cleaned_data['digest_prefs'])
+            identity.forget(user)
+            identity.forget(user.profile)
 
             return redirect(reverse("user_profile", kwargs=dict(uid=user.profile.uid)))
 
@@ -136,13 +139,15 @@ def message_list(request):
     # Set message count back to 0
     counts["message_count"] = 0
     request.session.update(dict(counts=counts))
+    if user.profile.new_messages:
+        Profile.objects.filter(user=user).update(new_messages=0)
 
     context = dict(tab="messages", all_messages=msgs)
     return render(request, "message_list.html", context)
 
 
 def user_profile(request, uid):
-    profile = Profile.objects.filter(uid=uid).first()
+    profile = identity.get(Profile, uid=uid)
 
     if not profile:
         messages.error(request, "User does not exist")
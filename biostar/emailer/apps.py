@@ -10,9 +10,14 @@ class EmailerConfig(AppConfig):
     name = 'biostar.emailer'
 
     def ready(self):
+        from biostar.emailer import sender
+
         # Triggered upon app initialization.
         post_migrate.connect(init, sender=self)
 
+        # Parse the email templates once at startup.
+        sender.warm_up()
+
 
 def init(sender, **kwargs):
     """
@@ -0,0 +1,329 @@
+"""
+Delivers emails over a pool of open mail connections.
+
+Messages are sent in batches by a few threads, each batch over one connection.
+Sending is rate limited and messages that fail are retried on a new connection
+after an exponential backoff. Each run reports its messages per second and failure rate.
+"""
+import logging
+import queue
+import smtplib
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db import connections
+
+logger = logging.getLogger("biostar")
+
+QUEUE_BACKEND = "mailer.backend.DbBackend"
+
+# Errors worth retrying on a new connection.
+RETRY_ERRORS = (smtplib.SMTPException, OSError)
+
+# Errors caused by the message itself, retrying does not help.
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused)
+
+
+def get_backend():
+    """
+    The backend that delivers the messages, the one behind the queue when django-mailer is used.
+    """
+    backend = settings.EMAIL_BACKEND
+    if backend == QUEUE_BACKEND:
+        backend = getattr(settings, "MAILER_EMAIL_BACKEND", "django.core.mail.backends.smtp.EmailBackend")
+    return backend
+
+
+class Stats(object):
+    """
+    Counts of a delivery run.
+    """
+
+    def __init__(self):
+        self.sent = self.failed = self.retried = 0
+        self.start = time.time()
+        self.lock = threading.Lock()
+
+    def add(self, sent=0, failed=0, retried=0):
+        with self.lock:
+            self.sent += sent
+            self.failed += failed
+            self.retried += retried
+
+    @property
+    def elapsed(self):
+        return time.time() - self.start
+
+    @property
+    def rate(self):
+        return self.sent / max(self.elapsed, 0.001)
+
+    @property
+    def failure_rate(self):
+        total = self.sent + self.failed
+        return self.failed / total if total else 0
+
+    def __str__(self):
+        return (f"sent={self.sent} failed={self.failed} retried={self.retried} rate={self.rate:.1f}/sec "
+                f"failures={self.failure_rate:.1%} time={self.elapsed:.1f}s")
+
+
+class RateLimiter(object):
+    """
+    Spaces out the messages of all threads to at most rate messages per second.
+    """
+
+    def __init__(self, rate=0):
+        self.interval = 1.0 / rate if rate else 0
+        self.next = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next - now
+            self.next = max(self.next, now) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class ConnectionPool(object):
+    """
+    Open mail connections shared by the sending threads.
+    """
+
+    def __init__(self, size=1, backend=None):
+        self.size = size
+        self.backend = backend or get_backend()
+        self.idle = queue.LifoQueue()
+        self.count = 0
+        self.opened = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self.lock:
+            create = self.count < self.size
+            if create:
+                self.count += 1
+
+        if not create:
+            return self.idle.get()
+
+        try:
+            conn = get_connection(backend=self.backend, fail_silently=False)
+            conn.open()
+        except Exception:
+            with self.lock:
+                self.count -= 1
+            raise
+
+        with self.lock:
+            self.opened += 1
+        return conn
+
+    def release(self, conn, broken=False):
+        if not broken:
+            self.idle.put(conn)
+            return
+
+        # The connection may be left in any state.
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self.lock:
+            self.count -= 1
+
+    def close(self):
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            self.release(conn, broken=True)
+
+
+def send_batch(batch, pool, limiter, stats, retries, backoff):
+    """
+    Sends the messages over a single connection, opening a new one after errors.
+    Returns the messages that could not be sent.
+    """
+    failed = []
+    conn = None
+
+    try:
+        for msg in batch:
+            for attempt in range(retries + 1):
+                limiter.wait()
+                try:
+                    conn = conn or pool.acquire()
+                    conn.send_messages([msg])
+                    stats.add(sent=1)
+                    break
+                except MESSAGE_ERRORS as exc:
+                    logger.error(f"message to {msg.to} refused: {exc}")
+                    stats.add(failed=1)
+                    failed.append(msg)
+                    break
+                except RETRY_ERRORS as exc:
+                    if conn:
+                        pool.release(conn, broken=True)
+                        conn = None
+                    if attempt == retries:
+                        logger.error(f"message to {msg.to} failed after {attempt + 1} attempts: {exc}")
+                        stats.add(failed=1)
+                        failed.append(msg)
+                        break
+                    stats.add(retried=1)
+                    time.sleep(backoff * 2 ** attempt)
+    finally:
+        if conn:
+            pool.release(conn)
+
+    return failed
+
+
+def chunked(messages, size):
+    batch = []
+    for msg in messages:
+        batch.append(msg)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def deliver(messages, batch_size=None, workers=None, rate=None, retries=None, backoff=None, backend=None):
+    """
+    Sends an iterable of email messages over a pool of connections.
+    Returns the stats of the run and the messages that could not be sent.
+    """
+    batch_size = batch_size or settings.EMAIL_BATCH_SIZE
+
+    # Queueing is a database insert, it needs neither threads nor rate limits.
+    if (backend or get_backend()) == QUEUE_BACKEND:
+        return enqueue(messages, batch_size=batch_size)
+
+    workers = workers or settings.EMAIL_POOL_SIZE
+    rate = settings.EMAIL_RATE_LIMIT if rate is None else rate
+    retries = settings.EMAIL_RETRIES if retries is None else retries
+    backoff = settings.EMAIL_RETRY_BACKOFF if backoff is None else backoff
+
+    pool = ConnectionPool(size=workers, backend=backend)
+    limiter = RateLimiter(rate=rate)
+    stats = Stats()
+    failed = []
+
+    def send(batch):
+        try:
+            return send_batch(batch, pool=pool, limiter=limiter, stats=stats, retries=retries, backoff=backoff)
+        finally:
+            # Backends may use the database, the connections of the worker threads are not reused.
+            connections.close_all()
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Keep a bounded number of batches in flight.
+            pending = deque()
+            for batch in chunked(messages, batch_size):
+                pending.append(executor.submit(send, batch))
+                if len(pending) >= workers * 2:
+                    failed.extend(pending.popleft().result())
+
+            while pending:
+                failed.extend(pending.popleft().result())
+    finally:
+        pool.close()
+
+    logger.info(f"delivery {stats} connections={pool.opened}")
+
+    return stats, failed
+
+
+def enqueue(messages, batch_size):
+    """
+    Adds the messages to the django-mailer queue, in batches.
+    """
+    conn = get_connection(backend=QUEUE_BACKEND)
+    stats = Stats()
+
+    for batch in chunked(messages, batch_size):
+        stats.add(sent=conn.send_messages(batch))
+
+    logger.info(f"queued {stats}")
+
+    return stats, []
+
+
+def log_messages(rows, emails, result, log_message=""):
+    """
+    Records the delivery attempts in the django-mailer message log.
+    """
+    from mailer.models import MessageLog, email_to_db, get_message_id
+
+    logs = [MessageLog(message_data=email_to_db(emails[row.pk]), message_id=get_message_id(emails[row.pk]),
+                       when_added=row.when_added, priority=row.priority, result=result, log_message=log_message)
+            for row in rows]
+    MessageLog.objects.bulk_create(logs, batch_size=1000)
+
+
+def send_queued(chunk=1000, **kwargs):
+    """
+    Drains the django-mailer queue. Sent messages are deleted, failed messages are deferred.
+    Each attempt is recorded in the message log, as the django-mailer engine does.
+    """
+    from mailer.engine import acquire_lock, release_lock, ensure_message_id
+    from mailer.models import Message, PRIORITY_DEFERRED, RESULT_SUCCESS, RESULT_FAILURE
+
+    acquired, lock = acquire_lock()
+    if not acquired:
+        return None
+
+    total = Stats()
+    kwargs.setdefault('backend', get_backend())
+
+    try:
+        while True:
+            rows = list(Message.objects.non_deferred().order_by('priority', 'when_added')[:chunk])
+            if not rows:
+                break
+
+            emails = {}
+            for row in rows:
+                email = row.email
+                if email is None:
+                    logger.warning(f"message {row.pk} discarded, it could not be read")
+                    continue
+                ensure_message_id(email)
+                emails[row.pk] = email
+
+            stats, failed = deliver(emails.values(), **kwargs)
+            total.add(sent=stats.sent, failed=stats.failed, retried=stats.retried)
+
+            failed = {id(email) for email in failed}
+            failed = {pk for pk, email in emails.items() if id(email) in failed}
+            sent = [row for row in rows if row.pk in emails and row.pk not in failed]
+            log_messages(sent, emails, RESULT_SUCCESS)
+            log_messages([row for row in rows if row.pk in failed], emails, RESULT_FAILURE,
+                         log_message="delivery failed")
+
+            Message.objects.filter(pk__in=failed).update(priority=PRIORITY_DEFERRED)
+            Message.objects.filter(pk__in=[row.pk for row in rows]).exclude(pk__in=failed).delete()
+    finally:
+        release_lock(lock)
+
+    logger.info(f"queue {total}")
+
+    return total
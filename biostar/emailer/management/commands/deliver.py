@@ -0,0 +1,39 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from biostar.emailer import delivery
+
+logger = logging.getLogger("biostar")
+logger.setLevel(logging.INFO)
+
+
+class Command(BaseCommand):
+    help = 'Sends the queued emails over pooled connections.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.EMAIL_POOL_SIZE,
+                            help="Open connections (default=%(default)s).")
+        parser.add_argument('--batch', type=int, default=settings.EMAIL_BATCH_SIZE,
+                            help="Messages sent over a connection at a time (default=%(default)s).")
+        parser.add_argument('--rate', type=float, default=settings.EMAIL_RATE_LIMIT,
+                            help="Messages per second, 0 for no limit (default=%(default)s).")
+        parser.add_argument('--loop', type=int, default=0,
+                            help="Keep draining the queue every few seconds.")
+
+    def handle(self, *args, **options):
+
+        if settings.EMAIL_BACKEND != delivery.QUEUE_BACKEND:
+            logger.error(f"the queue is not used, settings.EMAIL_BACKEND={settings.EMAIL_BACKEND}")
+            return
+
+        while True:
+            stats = delivery.send_queued(workers=options['workers'], batch_size=options['batch'],
+                                         rate=options['rate'])
+            if stats is None:
+                logger.info("the queue is locked by another process")
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
@@ -1,19 +1,32 @@
 import logging
+import os
 import re
 import textwrap
+import threading
 
 from django.core.mail import EmailMultiAlternatives
-from django.core.mail import send_mail, send_mass_mail, get_connection
-from django.template import Context, Template
+from django.core.mail import send_mail, send_mass_mail
+from django.template import Context, Template, TemplateDoesNotExist
 from django.template.loader import get_template
 from django.conf import settings
 
+from biostar.emailer import delivery
+
 logger = logging.getLogger("biostar")
 
 # Pattern to extract named blocks from a django template.
 block_patt = r'{%\s+block\s+(?P<name>(.+?))\s+%}(?P<value>(.+?)){%\s+endblock\s+%}'
 block_regx = re.compile(block_patt)
 
+# The parsed blocks of each email template file, keyed by (path, mtime).
+COMPILED = {}
+
+# The latest (path, mtime) key of each template name.
+LATEST = {}
+
+# Guards the two caches above, notifications are sent from several threads.
+LOCK = threading.Lock()
+
 
 def strip(text):
     return text.strip()
@@ -50,17 +63,56 @@ def first_line(text):
     return first
 
 
+def compile_blocks(name):
+    """
+    Returns the subject, text and html block templates of an email template.
+    Files are parsed once per modification time, and only checked for changes with EMAIL_TEMPLATE_RELOAD.
+    """
+    with LOCK:
+        key = LATEST.get(name)
+        if key and not settings.EMAIL_TEMPLATE_RELOAD:
+            return COMPILED[key]
+
+        path = key[0] if key else get_template(name).origin.name
+        key = (path, os.path.getmtime(path))
+
+        blocks = COMPILED.get(key)
+        if blocks is None:
+            content = open(path).read()
+            blocks = (get_block(content, "subject"), get_block(content, "text"), get_block(content, "html"))
+
+            # Drop the blocks of the earlier versions.
+            for old in [old for old in COMPILED if old[0] == path]:
+                COMPILED.pop(old, None)
+            COMPILED[key] = blocks
+
+        LATEST[name] = key
+
+    return blocks
+
+
+def warm_up(names=None):
+    """
+    Parses the email templates ahead of the first notification.
+    """
+    names = settings.EMAIL_TEMPLATES if names is None else names
+    for name in names:
+        try:
+            compile_blocks(name)
+        except TemplateDoesNotExist:
+            # Sites without the app of the template.
+            continue
+        except Exception as exc:
+            logger.warning(f"email template {name} not loaded: {exc}")
+
+
 class EmailTemplate(object):
     """
     Generates a subject, text and html based email from a single template.
     """
 
     def __init__(self, name):
-        self.template = get_template(name)
-        self.content = open(self.template.origin.name).read()
-        self.subj = get_block(self.content, "subject")
-        self.text = get_block(self.content, "text")
-        self.html = get_block(self.content, 'html')
+        self.subj, self.text, self.html = compile_blocks(name)
 
     def render(self, context):
         subj = safe_render(self.subj, context)
@@ -110,36 +162,37 @@ class EmailTemplate(object):
 
         # Send mass html email
         if len(html) > 10:
-            # Format mass mail
-            datatuple = ((subject, text, from_email, [rec]) for rec in recipient_list)
-            send_mass_mail(datatuple=datatuple, fail_silently=False)
-        else:
             send_mass_html_mail(subject=subject,
                                 message=text,
                                 message_html=html,
                                 from_email=from_email,
                                 recipient_list=recipient_list)
+        else:
+            # Format mass mail
+            datatuple = ((subject, text, from_email, [rec]) for rec in recipient_list)
+            send_mass_mail(datatuple=datatuple, fail_silently=False)
 
 
 def send_mass_html_mail(subject, message, message_html, from_email, recipient_list):
     """
-
+    Sends an HTML email to each recipient, in batches over pooled connections.
     """
-    connection = get_connection(fail_silently=False)
 
     def make_email(rec):
         msg = EmailMultiAlternatives(subject=subject,
                                      body=message,
                                      from_email=from_email,
-                                     to=rec,
-                                     connection=connection).attach_alternative(message_html,
-                                                                         "text/html")
+                                     to=[rec])
+        msg.attach_alternative(message_html, "text/html")
         return msg
 
     # Format mass mail
     messages = map(make_email, recipient_list)
 
-    return connection.send_messages(messages)
+    # Hand the messages to the configured backend, the queue when it is django-mailer.
+    stats, failed = delivery.deliver(messages, backend=settings.EMAIL_BACKEND)
+
+    return stats.sent
 
 
 def send_html_mail(subject, message, message_html, from_email, recipient_list):
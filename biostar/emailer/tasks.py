@@ -3,7 +3,7 @@ import os
 
 from django.conf import settings
 
-from biostar.emailer import sender
+from biostar.emailer import sender, delivery
 
 logger = logging.getLogger("biostar")
 
@@ -18,11 +18,10 @@ def send_all():
         return
 
     # Queued email exists only when the backend is the django-mailer.
-    if settings.EMAIL_BACKEND == "mailer.backend.DbBackend":
+    if settings.EMAIL_BACKEND == delivery.QUEUE_BACKEND:
         try:
-            from mailer import engine
             logger.info(f"sending queued emails")
-            engine.send_all()
+            delivery.send_queued()
         except Exception as exc:
             logger.error(f"send_all() error: {exc}")
 
@@ -1,6 +1,9 @@
 import logging
+import socketserver
+import threading
 from django.core import management
-from biostar.emailer import tasks, auth
+from django.core.mail import EmailMessage
+from biostar.emailer import tasks, auth, delivery
 from django.test import TestCase, override_settings
 from biostar.emailer import models
 
@@ -27,6 +30,26 @@ class SendMailTest(TestCase):
 
         self.assertTrue(successful, "Error sending mail")
 
+    def test_template_cache(self):
+        "Test that email templates are parsed once."
+        from unittest import mock
+        from biostar.emailer import sender
+
+        sender.warm_up(["test_email.html"])
+        with mock.patch("builtins.open") as opened, mock.patch.object(sender, "get_template") as loaded:
+            email = sender.EmailTemplate("test_email.html")
+            subject, text, html = email.render(dict(target_email="2@lvh.me"))
+
+        self.assertFalse(opened.called or loaded.called)
+        self.assertTrue(subject)
+
+        # A changed file is parsed again when reloading is enabled.
+        mtime = sender.LATEST["test_email.html"][1] + 1
+        with self.settings(EMAIL_TEMPLATE_RELOAD=True), mock.patch.object(sender.os.path, "getmtime", return_value=mtime):
+            sender.EmailTemplate("test_email.html")
+
+        self.assertEqual(sender.LATEST["test_email.html"][1], mtime)
+
     def test_add_subs(self):
         "Test adding subscription using auth"
 
@@ -61,3 +84,114 @@ class ModelTests(TestCase):
 
         print(test)
         pass
+
+
+class SMTPSink(socketserver.StreamRequestHandler):
+    """
+    Accepts the messages of a SMTP client and keeps them in memory.
+    """
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+
+        self.reply("220 localhost sink")
+        for line in self.rfile:
+            command = line.decode().strip()
+            verb = command.split(" ")[0].upper()
+
+            if verb == "RCPT" and "<refused" in command:
+                self.reply("550 no such user")
+            elif verb == "DATA":
+                self.reply("354 end data with <CR><LF>.<CR><LF>")
+                data = b"".join(iter(self.rfile.readline, b".\r\n"))
+                with server.lock:
+                    failing = server.failures > 0
+                    server.failures -= failing
+                    if not failing:
+                        server.messages.append(data)
+                self.reply("451 try again" if failing else "250 OK")
+            elif verb == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+@override_settings(EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend", EMAIL_HOST="127.0.0.1")
+class DeliveryTest(TestCase):
+
+    def setUp(self):
+        logger.setLevel(logging.WARNING)
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), SMTPSink)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.messages, self.server.connections, self.server.failures = [], 0, 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.port = self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def deliver(self, emails, **kwargs):
+        messages = [EmailMessage("Subject", "Body", "mailer@lvh.me", [email]) for email in emails]
+        with self.settings(EMAIL_PORT=self.port):
+            return delivery.deliver(messages, backoff=0, **kwargs)
+
+    def sent(self):
+        # Errors logged during the test may email the admins through the sink as well.
+        return [data for data in self.server.messages if b"From: mailer@lvh.me" in data]
+
+    def test_pooled_delivery(self):
+        "Test that batches are sent over a few open connections."
+
+        stats, failed = self.deliver([f"{num}@lvh.me" for num in range(50)], workers=2, batch_size=10)
+
+        self.assertEqual((stats.sent, stats.failed), (50, 0))
+        self.assertEqual(len(self.sent()), 50)
+        self.assertLessEqual(self.server.connections, 2)
+        self.assertGreater(stats.rate, 0)
+
+    def test_retry(self):
+        "Test that failed messages are retried and refused messages are not."
+
+        self.server.failures = 2
+        stats, failed = self.deliver(["1@lvh.me", "refused@lvh.me", "2@lvh.me"], workers=1, retries=2)
+
+        self.assertEqual((stats.sent, stats.failed, stats.retried), (2, 1, 2))
+        self.assertEqual([msg.to for msg in failed], [["refused@lvh.me"]])
+        self.assertEqual(len(self.sent()), 2)
+
+        # Gives up after the last attempt.
+        self.server.failures = 10
+        stats, failed = self.deliver(["3@lvh.me"], workers=1, retries=1)
+        self.assertEqual((stats.sent, stats.failed, stats.retried), (0, 1, 1))
+
+    def test_queue(self):
+        "Test that messages are queued without threads and the queue delivery is logged."
+        from unittest import mock
+        from mailer.models import Message, MessageLog, RESULT_SUCCESS, RESULT_FAILURE
+        from biostar.emailer import sender
+
+        with self.settings(EMAIL_BACKEND=delivery.QUEUE_BACKEND), \
+                mock.patch.object(delivery, "ThreadPoolExecutor") as executor:
+            count = sender.send_mass_html_mail("Subject", "Body", "<p>Body</p>", "mailer@lvh.me",
+                                               ["1@lvh.me", "refused@lvh.me", "2@lvh.me"])
+
+        self.assertFalse(executor.called)
+        self.assertEqual((count, Message.objects.count()), (3, 3))
+
+        with self.settings(EMAIL_PORT=self.port, MAILER_EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend"):
+            stats = delivery.send_queued(workers=1, backoff=0)
+
+        self.assertEqual((stats.sent, stats.failed), (2, 1))
+        self.assertEqual(len(self.sent()), 2)
+        self.assertEqual([msg.to_addresses for msg in Message.objects.deferred()], [["refused@lvh.me"]])
+        self.assertEqual(MessageLog.objects.filter(result=RESULT_SUCCESS).count(), 2)
+        self.assertEqual(MessageLog.objects.get(result=RESULT_FAILURE).to_addresses, ["refused@lvh.me"])
@@ -14,10 +14,13 @@ from django.db.models import Q, Count
 from django.shortcuts import reverse, redirect
 from django.template import loader
 from django.http import JsonResponse
+from django.middleware.csrf import get_token
+from django.views.decorators.cache import never_cache
 
 from whoosh.searching import Results
 
 from biostar.accounts.models import Profile, User
+from biostar.utils import identity
 from . import auth, util, forms, tasks, search, views, const
 from .models import Post, Vote, Subscription
 
@@ -75,9 +78,19 @@ def ajax_test(request):
     return ajax_error(msg=msg)
 
 
+@never_cache
+@ajax_error_wrapper(method="GET", login_required=False)
+def csrf_token(request):
+    """
+    Hands out the CSRF token to pages that were served without the cookie.
+    """
+    token = get_token(request)
+    return ajax_success(msg="CSRF token", token=token)
+
+
 @ajax_error_wrapper(method="GET")
 def user_image(request, username):
-    user = User.objects.filter(username=username).first()
+    user = identity.get(User, username=username)
 
     gravatar_url = auth.gravatar(user=user)
     return redirect(gravatar_url)
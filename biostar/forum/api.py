@@ -1,17 +1,21 @@
 
+import heapq
 import json
-import os
 import logging
-from os.path import join, normpath
 from django.core.cache import cache
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+from django.utils.timezone import make_aware, localtime
 from datetime import datetime, timedelta
 
 from django.http import HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from biostar.accounts.models import Profile, User
+from biostar.utils import metrics as timings
 from . import util
-from .models import Post, Vote, Subscription, PostView
+from .models import Post, Vote, Subscription, PostView, DailyStats, TagMonthlyCount
 
 
 logger = logging.getLogger("engine")
@@ -21,30 +25,6 @@ def api_error(msg="Api Error"):
     return {'error': msg}
 
 
-def stat_file(date, data=None, load=False, dump=False):
-
-    os.makedirs(settings.STATS_DIR, exist_ok=True)
-    file_name = f'{date.year}-{date.month}-{date.day}.json'
-    file_path = normpath(join(settings.STATS_DIR, file_name))
-
-    def load_file():
-        # This will be FileNotFoundError in Python3.
-        if not os.path.isfile(file_path):
-            raise IOError
-        with open(file_path, 'r') as fin:
-            return json.loads(fin.read())
-
-    def dump_into_file():
-        with open(file_path, 'w') as fout:
-            fout.write(json.dumps(data))
-
-    if load:
-        return load_file()
-
-    if dump:
-        return dump_into_file()
-
-
 def get_counts(end):
     questions = Post.objects.filter(type=Post.QUESTION, creation_date__lt=end).count()
     answers = Post.objects.filter(type=Post.ANSWER, creation_date__lt=end).count()
@@ -64,46 +44,279 @@ def get_counts(end):
     return data
 
 
-def compute_stats(date):
+def today():
     """
-    Statistics about this website for the given date.
-    Statistics are stored to a json file for caching purpose.
+    The current day in the site timezone, the days of the statistics are counted in it.
+    """
+    return localtime(util.now()).date()
 
-    Parameters:
-    date -- a `datetime`.
+
+def day_start(day):
+    """
+    The first moment of a day in the site timezone.
     """
+    return make_aware(datetime.combine(day, datetime.min.time()))
 
-    start = date.date()
-    end = start + timedelta(days=1)
 
-    try:
-        return stat_file(date=start, load=True)
-    except Exception as exc:  # This will be FileNotFoundError in Python3.
-        logger.info('No stats file for {}.'.format(start))
+def add_counts(totals, ptype):
+    """
+    Adds a post of the type to the running totals.
+    """
+    if ptype == Post.QUESTION:
+        totals['questions'] += 1
+    elif ptype == Post.ANSWER:
+        totals['answers'] += 1
+    elif ptype == Post.COMMENT:
+        totals['comments'] += 1
 
-    new_users = Profile.objects.filter(date_joined__gte=start,
-                                       date_joined__lt=end).values_list("uid", flat=True)
-    new_posts = Post.objects.filter(creation_date__gte=start,
-                                    creation_date__lt=end).values_list("uid", flat=True)
-    new_votes = Vote.objects.filter(date__gte=start,
-                                    date__lt=end).values_list("uid", flat=True)
+    if ptype in Post.TOP_LEVEL and ptype != Post.BLOG:
+        totals['toplevel'] += 1
 
-    data = {
-        'date': util.datetime_to_iso(start),
-        'timestamp': util.datetime_to_unix(start),
-        'new_users': list(new_users),
-        'new_posts': list(new_posts),
-        'new_votes': list(new_votes),
-    }
 
-    data.update(get_counts(end=end))
+def stats_fields(totals, new_users, new_posts, new_votes):
+    return dict(new_users=json.dumps(new_users), new_posts=json.dumps(new_posts),
+                new_votes=json.dumps(new_votes), **totals)
+
+
+def add_day(day):
+    """
+    Stores the statistics for a day, from the totals of the previous day
+    and the users, posts and votes created during the day.
+    """
+    start, end = day_start(day), day_start(day + timedelta(days=1))
+
+    previous = DailyStats.objects.filter(date=day - timedelta(days=1)).first()
+    if previous:
+        totals = {field: getattr(previous, field) for field in DailyStats.TOTALS}
+    else:
+        # Gaps in the table start from full counts.
+        totals = get_counts(end=start)
+
+    new_users = list(Profile.objects.filter(date_joined__gte=start, date_joined__lt=end).values_list("uid", flat=True))
+    new_posts = Post.objects.filter(creation_date__gte=start, creation_date__lt=end).values_list("uid", "type")
+    new_votes = list(Vote.objects.filter(date__gte=start, date__lt=end).values_list("uid", flat=True))
+
+    for uid, ptype in new_posts:
+        add_counts(totals, ptype)
+
+    totals['votes'] += len(new_votes)
+    totals['users'] += len(new_users)
+
+    fields = stats_fields(totals, new_users, [uid for uid, ptype in new_posts], new_votes)
+    stats, created = DailyStats.objects.update_or_create(date=day, defaults=fields)
+
+    return stats
+
+
+def update_stats():
+    """
+    Adds the days missing since the last stored day, up to yesterday.
+    Rebuilds every day when days are missing before the last stored day.
+    """
+    yesterday = today() - timedelta(days=1)
+    last = DailyStats.objects.filter(date__lte=yesterday).order_by('-date').first()
+
+    if not last or missing_days(end=last.date):
+        return backfill()
+
+    day, count = last.date + timedelta(days=1), 0
+    while day <= yesterday:
+        add_day(day)
+        day += timedelta(days=1)
+        count += 1
+
+    return count
+
+
+def missing_days(end):
+    """
+    Returns True when days with posts up to the end date have no statistics.
+    """
+    first = Post.objects.order_by('creation_date').only('creation_date').first()
+    if not first:
+        return False
+
+    start = localtime(first.creation_date).date()
+    stored = DailyStats.objects.filter(date__gte=start, date__lte=end).count()
+
+    return stored < (end - start).days + 1
+
+
+def backfill(batch=1000):
+    """
+    Rebuilds the statistics of every day up to yesterday.
+    Users, posts and votes are each read in a single query ordered by date.
+    """
+    first = Post.objects.order_by('creation_date').only('creation_date').first()
+    if not first:
+        return 0
+
+    start = localtime(first.creation_date).date()
+    yesterday = today() - timedelta(days=1)
+    end = day_start(yesterday + timedelta(days=1))
+
+    # Created objects ordered by date as (date, kind, uid, post type)
+    users = Profile.objects.filter(date_joined__lt=end).order_by('date_joined').values_list('date_joined', 'uid')
+    posts = Post.objects.filter(creation_date__lt=end).order_by('creation_date').values_list('creation_date', 'uid', 'type')
+    votes = Vote.objects.filter(date__lt=end).order_by('date').values_list('date', 'uid')
+
+    stream = heapq.merge(
+        ((date, 'user', uid, None) for date, uid in users.iterator()),
+        ((date, 'post', uid, ptype) for date, uid, ptype in posts.iterator()),
+        ((date, 'vote', uid, None) for date, uid in votes.iterator()),
+        key=lambda item: item[0]
+    )
+
+    totals = dict.fromkeys(DailyStats.TOTALS, 0)
+    created = {'user': [], 'post': [], 'vote': []}
+    day, rows, count = None, [], 0
+
+    def close(day):
+        # Users and votes before the first post only add to the totals.
+        if day >= start:
+            fields = stats_fields(totals, created['user'], created['post'], created['vote'])
+            rows.append(DailyStats(date=day, **fields))
+        for values in created.values():
+            values.clear()
+
+    # Concurrent runs and the days added by the api skip the rows already stored.
+    with transaction.atomic():
+        DailyStats.objects.all().delete()
+
+        for date, kind, uid, ptype in stream:
+            current = localtime(date).date()
+
+            # Close the days up to the current one.
+            while day is not None and day < current:
+                close(day)
+                day += timedelta(days=1)
 
-    if not settings.DEBUG:
-        stat_file(dump=True, date=start, data=data)
+            day = day or current
+
+            created[kind].append(uid)
+            if kind == 'post':
+                add_counts(totals, ptype)
+            else:
+                totals[f"{kind}s"] += 1
+
+            if len(rows) >= batch:
+                DailyStats.objects.bulk_create(rows, ignore_conflicts=True)
+                count, rows = count + len(rows), []
+
+        # Close the remaining days up to yesterday.
+        while day is not None and day <= yesterday:
+            close(day)
+            day += timedelta(days=1)
+
+        DailyStats.objects.bulk_create(rows, ignore_conflicts=True)
+
+    return count + len(rows)
+
+
+def empty_counts(names):
+    return {name: dict(total=0, answer_count=0, comment_count=0) for name in names}
+
+
+def add_tag_counts(counts, ptype, count):
+    counts['total'] += count
+    if ptype == Post.ANSWER:
+        counts['answer_count'] += count
+    elif ptype == Post.COMMENT:
+        counts['comment_count'] += count
+
+
+def count_tags(names, since, size=5000):
+    """
+    Post counts for each tag over the posts edited since the date.
+    Grouped by tag and post type, one query for every few thousand tags.
+    """
+    data = empty_counts(names)
+
+    for start in range(0, len(names), size):
+        query = Post.objects.filter(lastedit_date__gt=since, tags__name__in=names[start:start + size])
+        query = query.values('tags__name', 'type').annotate(count=Count('id', distinct=True))
+        for row in query:
+            counts = data.setdefault(row['tags__name'].lower(), dict(total=0, answer_count=0, comment_count=0))
+            add_tag_counts(counts, ptype=row['type'], count=row['count'])
 
     return data
 
 
+def count_tags_monthly(names, since, size=5000):
+    """
+    Post counts for each tag, summed from the monthly tag counts starting with the month of the date.
+    """
+    data = empty_counts(names)
+    month = localtime(since).date().replace(day=1)
+
+    for start in range(0, len(names), size):
+        query = TagMonthlyCount.objects.filter(month__gte=month, name__in=names[start:start + size])
+        query = query.values('name').annotate(total=Sum('total'), answer_count=Sum('answer_count'),
+                                              comment_count=Sum('comment_count'))
+        for row in query:
+            data[row.pop('name')].update(row)
+
+    return data
+
+
+def month_start(months=0):
+    """
+    The first day of the month, a number of months ago.
+    """
+    day = localtime(util.now()).date().replace(day=1)
+    for step in range(months):
+        day = (day - timedelta(days=1)).replace(day=1)
+    return day
+
+
+def rollup_tags(months=2):
+    """
+    Recomputes the monthly tag counts of the last months, of all months when months is None.
+    Posts are counted in the month they were created in, edits do not move them to another month.
+    """
+    first = month_start(months - 1) if months else None
+
+    query = Post.objects.exclude(tags=None)
+    if first:
+        query = query.filter(creation_date__gte=day_start(first))
+    query = query.annotate(month=TruncMonth('creation_date'))
+    query = query.values('tags__name', 'month', 'type').annotate(count=Count('id', distinct=True))
+
+    # Tag names differing only in case are counted together.
+    rows = {}
+    for row in query.iterator():
+        key = (row['tags__name'].lower(), localtime(row['month']).date())
+        counts = rows.setdefault(key, dict(total=0, answer_count=0, comment_count=0))
+        add_tag_counts(counts, ptype=row['type'], count=row['count'])
+
+    with transaction.atomic():
+        stale = TagMonthlyCount.objects.all()
+        if first:
+            stale = stale.filter(month__gte=first)
+        stale.delete()
+
+        objs = [TagMonthlyCount(name=name, month=month, **counts) for (name, month), counts in rows.items()]
+        TagMonthlyCount.objects.bulk_create(objs, batch_size=1000)
+
+    return len(objs)
+
+
+def compute_stats(date):
+    """
+    Statistics about this website for the given date.
+    Statistics are read from the daily stats table, missing days are added to it.
+
+    Parameters:
+    date -- a `datetime`.
+    """
+
+    day = date.date()
+
+    stats = DailyStats.objects.filter(date=day).first() or add_day(day)
+
+    return stats.as_dict()
+
+
 def json_response(f):
     """
     Converts any functions which returns a dictionary to a proper HttpResponse with json content.
@@ -150,7 +363,7 @@ def daily_stats_on_day(request, day):
     date = day_zero + timedelta(days=int(day))
 
     # We don't provide stats for today or the future.
-    if not date or date.date() >= datetime.today().date():
+    if not date or date.date() >= today():
         return {}
 
     return compute_stats(date)
@@ -168,12 +381,22 @@ def daily_stats_on_date(request, year, month, day):
     """
     date = datetime(int(year), int(month), int(day))
     # We don't provide stats for today or the future.
-    if date.date() >= datetime.today().date():
+    if date.date() >= today():
         return {}
 
     return compute_stats(date)
 
 
+def metrics(request):
+    """
+    Request timings per view in the Prometheus text format, for staff only.
+    """
+    if not request.user.is_staff:
+        return HttpResponse("Staff only", status=403, content_type="text/plain")
+
+    return HttpResponse(timings.prometheus(), content_type="text/plain; version=0.0.4")
+
+
 @json_response
 def traffic(request):
     """
@@ -290,6 +513,8 @@ def vote_details(request, uid):
 def tags_list(request):
     """
     Given a file of tags, return the post count for each.
+    Send rollup=1 to sum the monthly tag counts instead, the window then starts on the first of the month
+    and counts the posts created in it.
     """
     # Get a file with all the tags.
     tags = request.FILES.get('tags')
@@ -297,7 +522,7 @@ def tags_list(request):
     # How many months prior to look back
     months = request.POST.get('months', '6')
     try:
-        months = int(months) if months.isalmun() else float(months)
+        months = float(months)
     except Exception as exc:
         logger.error(exc)
         months = 6
@@ -306,24 +531,13 @@ def tags_list(request):
     weeks = months * 4
 
     delta = util.now() - timedelta(weeks=weeks)
-    query = Post.objects.filter(lastedit_date__gt=delta)
 
-    # Iterate over tags and collect counts.
+    # Collect the tags, keeping the order of the file.
     lines = tags.readlines() if tags else []
+    names = [line.decode().lower().strip() for line in lines]
+    names = list(dict.fromkeys(name for name in names if name))
 
-    data = {}
-
-    for line in lines:
-        tag = line.decode().lower().strip()
-        if not tag:
-            continue
+    if request.POST.get('rollup') in ('1', 'true'):
+        return count_tags_monthly(names=names, since=delta)
 
-        posts = query.filter(tags__name=tag)
-        answer_count = posts.filter(type=Post.ANSWER).count()
-        comment_count = posts.filter(type=Post.COMMENT).count()
-        total = posts.count()
-
-        val = dict(total=total, answer_count=answer_count, comment_count=comment_count)
-        data.setdefault(tag, {}).update(val)
-
-    return data
+    return count_tags(names=names, since=delta)
@@ -11,6 +11,12 @@ class ForumConfig(AppConfig):
 
     def ready(self):
         from . import signals
+        from biostar.utils import identity
+        from .models import Post
+
+        # Hot lookups are served from the identity cache.
+        identity.register(Post, 'uid', related=('root', 'author__profile', 'lastedit_user__profile'))
+
         # Triggered upon app initialization.
         post_migrate.connect(init_awards, sender=self)
 
@@ -17,7 +17,9 @@ from django.core.cache import cache
 from django.core.paginator import Paginator
 from django.shortcuts import reverse
 from biostar.accounts.models import Profile, Logger
-from . import util
+from biostar.utils import identity
+from taggit.models import Tag
+from . import util, awards, effects
 from .const import *
 from .models import Post, Vote, PostView, Subscription
 
@@ -237,6 +239,26 @@ def create_post(author, title, content, root=None, parent=None, ptype=Post.QUEST
     return post
 
 
+def get_tags(names):
+    """
+    Returns the tags with the names, creating the missing ones together.
+    """
+    names = list(dict.fromkeys(names))
+    found = Tag.objects.in_bulk(names, field_name='name')
+
+    missing = [Tag(name=name, slug=Tag().slugify(name)) for name in names if name not in found]
+    if missing:
+        Tag.objects.bulk_create(missing, ignore_conflicts=True)
+        found.update(Tag.objects.in_bulk([tag.name for tag in missing], field_name='name'))
+
+    # Names whose slug is taken get a numbered slug.
+    for name in names:
+        if name not in found:
+            found[name] = Tag.objects.get_or_create(name=name)[0]
+
+    return [found[name] for name in names]
+
+
 def create_subscription(post, user, sub_type=None, update=False):
     """
     Creates subscription to a post. Returns a list of subscriptions.
@@ -267,7 +289,10 @@ def create_subscription(post, user, sub_type=None, update=False):
     subs_count = Subscription.objects.filter(post=post.root).exclude(type=Subscription.NO_MESSAGES).count()
 
     # Update root subscription counts.
-    Post.objects.filter(pk=post.root.pk).update(subs_count=subs_count)
+    effects.update(Post, post.root.pk, subs_count=subs_count)
+
+    # Queue the awards for followed posts.
+    awards.enqueue(users=[post.root.author_id], event=awards.FOLLOWED)
 
 
 def is_suspended(user):
@@ -353,9 +378,22 @@ def update_post_views(post, request, minutes=settings.POST_VIEW_MINUTES):
         # Update the last time
         PostView.objects.create(ip=ip, post=post, date=now)
         Post.objects.filter(pk=post.pk).update(view_count=F('view_count') + 1)
+
+        # Concurrent views may increment the count past a milestone between the reads.
+        count = post.view_count
+        post.view_count = Post.objects.filter(pk=post.pk).values_list('view_count', flat=True).first() or 0
+
+        # Queue the view awards when the post goes past a milestone.
+        if any(count < limit <= post.view_count for limit in awards.VIEW_MILESTONES):
+            awards.enqueue(users=[post.author_id], event=awards.VIEWS)
+
     return post
 
 
+# The award events sent by the vote types, besides receiving a vote.
+VOTE_EVENTS = {Vote.BOOKMARK: awards.BOOKMARKED, Vote.ACCEPT: awards.ACCEPTED}
+
+
 @transaction.atomic
 def apply_vote(post, user, vote_type):
     vote = Vote.objects.filter(author=user, post=post, type=vote_type).first()
@@ -369,6 +407,13 @@ def apply_vote(post, user, vote_type):
         vote = Vote.objects.create(author=user, post=post, type=vote_type)
         msg = f"{vote.get_type_display()} added"
 
+        # Queue the awards that depend on this vote.
+        awards.enqueue(users=[user.id], event=awards.VOTED)
+        if post.author != user:
+            awards.enqueue(users=[post.author_id], event=awards.VOTE_RECEIVED)
+            if vote_type in VOTE_EVENTS:
+                awards.enqueue(users=[post.author_id], event=VOTE_EVENTS[vote_type])
+
     if post.author == user:
         # Author making the change
         change = 0
@@ -376,6 +421,8 @@ def apply_vote(post, user, vote_type):
 
     # Fetch update the user score.
     Profile.objects.filter(user=post.author).update(score=F('score') + change)
+    identity.forget(post.author)
+    identity.forget(post.author.profile)
 
     # Calculate counts for the current post
     votes = list(Vote.objects.filter(post=post).exclude(author=post.author))
@@ -1,10 +1,14 @@
 import logging
+from collections import Counter
 
+from django.db.models import Count
+from django.db.models.functions import Length
 from django.utils.timezone import utc
 from datetime import datetime, timedelta
 
-from biostar.accounts.models import User
-from biostar.forum.models import Post, Vote, Badge, Award
+from biostar.accounts.models import Profile
+from biostar.forum import util
+from biostar.forum.models import Post, Vote, Badge, Award, AwardCheck
 
 logger = logging.getLogger("engine")
 
@@ -13,16 +17,67 @@ def now():
     return datetime.utcnow().replace(tzinfo=utc)
 
 
-def wrap_qs(cond, klass, pk):
+def post_rule(**cond):
+    """
+    Targets the posts matching the conditions, awarded to their authors.
+    """
 
-    return klass.objects.filter(pk=pk) if cond else klass.objects.none()
+    def targets(users=None):
+        query = Post.objects.filter(**cond)
+        if users is not None:
+            query = query.filter(author_id__in=users)
+        return query.order_by('pk').values_list('author_id', 'id')
+
+    return targets
+
+
+def count_rule(model, field, minimum, **cond):
+    """
+    Targets the users with more than minimum rows of the model, grouped by the user field.
+    """
+
+    def targets(users=None):
+        query = model.objects.filter(**cond)
+        if users is not None:
+            query = query.filter(**{f"{field}__in": users})
+        query = query.values(field).annotate(total=Count('id')).filter(total__gt=minimum)
+        return [(user_id, None) for user_id in query.values_list(field, flat=True)]
+
+    return targets
+
+
+def autobio(users=None):
+    query = Profile.objects.annotate(length=Length('text')).filter(length__gt=110, score__gt=1)
+    if users is not None:
+        query = query.filter(user_id__in=users)
+    return [(user_id, None) for user_id in query.values_list('user_id', flat=True)]
+
+
+def rising_star(users=None):
+    # The user joined no more than three months ago
+    since = now() - timedelta(weeks=15)
+    return count_rule(Post, 'author_id', 50, author__profile__date_joined__gt=since)(users=users)
+
+
+# Events that may earn awards.
+VOTED, VOTE_RECEIVED, POST_CREATED, VIEWS, ACCEPTED, BOOKMARKED, FOLLOWED, PROFILE = (
+    "voted", "vote_received", "post_created", "views", "accepted", "bookmarked", "followed", "profile")
+
+# Posts with more views than these earn the view awards.
+POPULAR_VIEWS, GREAT_VIEWS, EPIC_VIEWS = 1000, 5000, 10000
+
+# View counts that first earn the view awards.
+VIEW_MILESTONES = tuple(limit + 1 for limit in (POPULAR_VIEWS, GREAT_VIEWS, EPIC_VIEWS))
 
 
 class AwardDef(object):
-    def __init__(self, name, desc, func, icon, max=None, type=Badge.BRONZE):
+    def __init__(self, name, desc, targets, icon, events=(), max=None, type=Badge.BRONZE):
         self.name = name
         self.desc = desc
-        self.fun = func
+        # Returns the (user id, post id) pairs that earn the award, the post id is None for user awards.
+        self.targets = targets
+        # The events after which the award is checked.
+        self.events = events
         self.icon = icon
         self.template = ""
         self.type = type
@@ -30,24 +85,6 @@ class AwardDef(object):
         # No limit if left empty.
         self.max = max
 
-    def validate(self, *args, **kwargs):
-
-        user = args[0]
-        try:
-            value = self.fun(*args, **kwargs).order_by("pk")
-        except Exception as exc:
-            logger.error("validator error %s" % exc)
-            return []
-
-        # Award user has won at this point.
-        awarded = Award.objects.filter(badge__name=self.name, user=user)
-
-        # Ensure users does not get over rewarded.
-        if self.max and len(awarded) >= self.max:
-            return []
-
-        return value
-
     def __hash__(self):
         return hash(self.name)
 
@@ -59,7 +96,8 @@ class AwardDef(object):
 AUTOBIO = AwardDef(
     name="Autobiographer",
     desc="has more than 110 characters in the information field of the user's profile",
-    func=lambda user: wrap_qs(len(user.profile.text) > 110 and user.profile.score > 1, User, user.id),
+    targets=autobio,
+    events=(PROFILE, VOTE_RECEIVED),
     max=1,
     icon="bullhorn icon"
 )
@@ -67,7 +105,8 @@ AUTOBIO = AwardDef(
 GOOD_QUESTION = AwardDef(
     name="Good Question",
     desc="asked a question that was upvoted at least 5 times",
-    func=lambda user: Post.objects.filter(vote_count__gte=5, author=user, type=Post.QUESTION),
+    targets=post_rule(vote_count__gte=5, type=Post.QUESTION),
+    events=(VOTE_RECEIVED,),
     max=1,
     icon="question icon"
 )
@@ -75,7 +114,8 @@ GOOD_QUESTION = AwardDef(
 GOOD_ANSWER = AwardDef(
     name="Good Answer",
     desc="created an answer that was upvoted at least 5 times",
-    func=lambda user: Post.objects.filter(vote_count__gt=5, author=user, type=Post.ANSWER),
+    targets=post_rule(vote_count__gt=5, type=Post.ANSWER),
+    events=(VOTE_RECEIVED,),
     max=1,
     icon="edit outline icon"
 )
@@ -83,7 +123,8 @@ GOOD_ANSWER = AwardDef(
 STUDENT = AwardDef(
     name="Student",
     desc="asked a question with at least 3 up-votes",
-    func=lambda user: Post.objects.filter(vote_count__gt=2, author=user, type=Post.QUESTION),
+    targets=post_rule(vote_count__gt=2, type=Post.QUESTION),
+    events=(VOTE_RECEIVED,),
     max=1,
     icon="certificate icon"
 )
@@ -91,7 +132,8 @@ STUDENT = AwardDef(
 TEACHER = AwardDef(
     name="Teacher",
     desc="created an answer with at least 3 up-votes",
-    func=lambda user: Post.objects.filter(vote_count__gt=2, author=user, type=Post.ANSWER),
+    targets=post_rule(vote_count__gt=2, type=Post.ANSWER),
+    events=(VOTE_RECEIVED,),
     max=1,
     icon="smile outline icon"
 )
@@ -99,7 +141,8 @@ TEACHER = AwardDef(
 COMMENTATOR = AwardDef(
     name="Commentator",
     desc="created a comment with at least 3 up-votes",
-    func=lambda user: Post.objects.filter(vote_count__gt=2, author=user, type=Post.COMMENT),
+    targets=post_rule(vote_count__gt=2, type=Post.COMMENT),
+    events=(VOTE_RECEIVED,),
     max=1,
     icon="comment icon"
 )
@@ -107,7 +150,8 @@ COMMENTATOR = AwardDef(
 CENTURION = AwardDef(
     name="Centurion",
     desc="created 100 posts",
-    func=lambda user: wrap_qs(Post.objects.filter(author=user).count() > 100, User, user.id),
+    targets=count_rule(Post, 'author_id', 100),
+    events=(POST_CREATED,),
     max=1,
     icon="bolt icon",
     type=Badge.SILVER,
@@ -116,7 +160,8 @@ CENTURION = AwardDef(
 EPIC_QUESTION = AwardDef(
     name="Epic Question",
     desc="created a question with more than 10,000 views",
-    func=lambda user: Post.objects.filter(author=user, view_count__gt=10000),
+    targets=post_rule(view_count__gt=EPIC_VIEWS),
+    events=(VIEWS,),
     max=1,
     icon="bullseye icon",
     type=Badge.GOLD,
@@ -125,7 +170,8 @@ EPIC_QUESTION = AwardDef(
 POPULAR = AwardDef(
     name="Popular Question",
     desc="created a question with more than 1,000 views",
-    func=lambda user: Post.objects.filter(author=user, view_count__gt=1000),
+    targets=post_rule(view_count__gt=POPULAR_VIEWS),
+    events=(VIEWS,),
     max=1,
     icon="eye icon",
     type=Badge.GOLD,
@@ -134,7 +180,8 @@ POPULAR = AwardDef(
 ORACLE = AwardDef(
     name="Oracle",
     desc="created more than 1,000 posts (questions + answers + comments)",
-    func=lambda user: wrap_qs(Post.objects.filter(author=user).count() > 1000, User, user.id),
+    targets=count_rule(Post, 'author_id', 1000),
+    events=(POST_CREATED,),
     max=1,
     icon="sun icon",
     type=Badge.GOLD,
@@ -143,7 +190,8 @@ ORACLE = AwardDef(
 PUNDIT = AwardDef(
     name="Pundit",
     desc="created a comment with more than 10 votes",
-    func=lambda user: Post.objects.filter(author=user, type=Post.COMMENT, vote_count__gt=10),
+    targets=post_rule(type=Post.COMMENT, vote_count__gt=10),
+    events=(VOTE_RECEIVED,),
     max=1,
     icon="comments icon",
     type=Badge.SILVER,
@@ -152,7 +200,8 @@ PUNDIT = AwardDef(
 GURU = AwardDef(
     name="Guru",
     desc="received more than 100 upvotes",
-    func=lambda user: wrap_qs(Vote.objects.filter(post__author=user).count() > 100, User, user.id),
+    targets=count_rule(Vote, 'post__author_id', 100),
+    events=(VOTE_RECEIVED,),
     max=1,
     icon="beer icon",
     type=Badge.SILVER,
@@ -161,7 +210,8 @@ GURU = AwardDef(
 CYLON = AwardDef(
     name="Cylon",
     desc="received 1,000 up votes",
-    func=lambda user: wrap_qs(Vote.objects.filter(post__author=user).count() > 1000, User, user.id),
+    targets=count_rule(Vote, 'post__author_id', 1000),
+    events=(VOTE_RECEIVED,),
     max=1,
     icon="rocket icon",
     type=Badge.GOLD,
@@ -170,7 +220,8 @@ CYLON = AwardDef(
 VOTER = AwardDef(
     name="Voter",
     desc="voted more than 100 times",
-    func=lambda user: wrap_qs(Vote.objects.filter(author=user).count() > 100, User, user.id),
+    targets=count_rule(Vote, 'author_id', 100),
+    events=(VOTED,),
     max=1,
     icon="thumbs up outline icon"
 )
@@ -178,7 +229,8 @@ VOTER = AwardDef(
 SUPPORTER = AwardDef(
     name="Supporter",
     desc="voted at least 25 times",
-    func=lambda user: wrap_qs(Vote.objects.filter(author=user).count() > 25, User, user.id),
+    targets=count_rule(Vote, 'author_id', 25),
+    events=(VOTED,),
     max=1,
     icon="thumbs up icon",
     type=Badge.SILVER,
@@ -187,7 +239,8 @@ SUPPORTER = AwardDef(
 SCHOLAR = AwardDef(
     name="Scholar",
     desc="created an answer that has been accepted",
-    func=lambda user: Post.objects.filter(author=user, type=Post.ANSWER, accept_count__gt=0),
+    targets=post_rule(type=Post.ANSWER, accept_count__gt=0),
+    events=(ACCEPTED,),
     max=1,
     icon="check circle outline icon"
 )
@@ -195,7 +248,8 @@ SCHOLAR = AwardDef(
 PROPHET = AwardDef(
     name="Prophet",
     desc="created a post with more than 20 followers",
-    func=lambda user: Post.objects.filter(author=user, type__in=Post.TOP_LEVEL, subs_count__gt=20),
+    targets=post_rule(type__in=Post.TOP_LEVEL, subs_count__gt=20),
+    events=(FOLLOWED,),
     max=1,
     icon="leaf icon"
 )
@@ -203,23 +257,18 @@ PROPHET = AwardDef(
 LIBRARIAN = AwardDef(
     name="Librarian",
     desc="created a post with more than 10 bookmarks",
-    func=lambda user: Post.objects.filter(author=user, type__in=Post.TOP_LEVEL, book_count__gt=10),
+    targets=post_rule(type__in=Post.TOP_LEVEL, book_count__gt=10),
+    events=(BOOKMARKED,),
     max=1,
     icon="bookmark outline icon"
 )
 
 
-def rising_star(user):
-    # The user joined no more than three months ago
-    cond = now() < user.profile.date_joined + timedelta(weeks=15)
-    cond = cond and Post.objects.filter(author=user).count() > 50
-    return wrap_qs(cond, User, user.id)
-
-
 RISING_STAR = AwardDef(
     name="Rising Star",
     desc="created 50 posts within first three months of joining",
-    func=rising_star,
+    targets=rising_star,
+    events=(POST_CREATED,),
     icon="star icon",
     max=1,
     type=Badge.GOLD,
@@ -229,7 +278,8 @@ RISING_STAR = AwardDef(
 GREAT_QUESTION = AwardDef(
     name="Great Question",
     desc="created a question with more than 5,000 views",
-    func=lambda user: Post.objects.filter(author=user, view_count__gt=5000),
+    targets=post_rule(view_count__gt=GREAT_VIEWS),
+    events=(VIEWS,),
     icon="fire icon",
     type=Badge.SILVER,
 )
@@ -237,7 +287,8 @@ GREAT_QUESTION = AwardDef(
 GOLD_STANDARD = AwardDef(
     name="Gold Standard",
     desc="created a post with more than 25 bookmarks",
-    func=lambda user: Post.objects.filter(author=user, book_count__gt=25),
+    targets=post_rule(book_count__gt=25),
+    events=(BOOKMARKED,),
     icon="bookmark icon",
     type=Badge.GOLD,
 )
@@ -245,7 +296,8 @@ GOLD_STANDARD = AwardDef(
 APPRECIATED = AwardDef(
     name="Appreciated",
     desc="created a post with more than 5 votes",
-    func=lambda user: Post.objects.filter(author=user, vote_count__gt=5),
+    targets=post_rule(vote_count__gt=5),
+    events=(VOTE_RECEIVED,),
     icon="heart icon",
     type=Badge.SILVER,
 )
@@ -278,3 +330,121 @@ ALL_AWARDS = [
     GOLD_STANDARD,
     APPRECIATED,
 ]
+
+# The award rules checked after each event.
+EVENT_AWARDS = {}
+for award in ALL_AWARDS:
+    for event in award.events:
+        EVENT_AWARDS.setdefault(event, []).append(award)
+
+
+def give_awards(users=None, rules=None):
+    """
+    Creates the awards earned by the users, all users when None.
+    Each rule is a single query over all users, the targets are compared
+    in memory with the awards already given.
+    Returns the new awards.
+    """
+    from biostar.forum import tasks
+
+    rules = ALL_AWARDS if rules is None else rules
+    badges = {b.name: b for b in Badge.objects.filter(name__in=[rule.name for rule in rules])}
+
+    # The awards already given.
+    given = Award.objects.filter(badge__in=list(badges.values()))
+    if users is not None:
+        given = given.filter(user_id__in=users)
+    given = list(given.values_list('user_id', 'badge_id', 'post_id'))
+    counts = Counter((user_id, badge_id) for user_id, badge_id, post_id in given)
+    given = set(given)
+
+    awards = []
+    for rule in rules:
+        badge = badges.get(rule.name)
+        if not badge:
+            continue
+
+        for user_id, post_id in rule.targets(users=users):
+            key = (user_id, badge.id, post_id)
+
+            # Do not award a target multiple times.
+            if key in given:
+                continue
+
+            # Ensure users does not get over rewarded.
+            if rule.max and counts[(user_id, badge.id)] >= rule.max:
+                continue
+
+            given.add(key)
+            counts[(user_id, badge.id)] += 1
+            awards.append(Award(user_id=user_id, badge=badge, post_id=post_id))
+
+    if not awards:
+        return []
+
+    # Awards are dated by the last login of the user.
+    profiles = {}
+    user_ids = list({award.user_id for award in awards})
+    for start in range(0, len(user_ids), 1000):
+        query = Profile.objects.filter(user_id__in=user_ids[start:start + 1000]).select_related('user')
+        profiles.update((p.user_id, p) for p in query)
+
+    for award in awards:
+        profile = profiles[award.user_id]
+        award.user = profile.user
+        award.date = profile.last_login or now()
+        award.uid = util.get_uuid(limit=16)
+
+    Award.objects.bulk_create(awards, batch_size=1000)
+
+    # Bulk creation skips the save signals, send the award messages here.
+    # Awards of the same badge and post share a message.
+    groups = {}
+    for award in awards:
+        groups.setdefault((award.badge_id, award.post_id), []).append(award)
+
+    for group in groups.values():
+        tasks.create_messages(template="messages/awards_created.md", extra_context=dict(award=group[0]),
+                              rec_list=[award.user for award in group])
+
+    return awards
+
+
+def enqueue(users, event):
+    """
+    Queues the award rules that depend on the event for the users.
+    """
+    rules = EVENT_AWARDS.get(event, [])
+    checks = [AwardCheck(user_id=user_id, rule=rule.name) for user_id in set(users) for rule in rules]
+
+    # Checks already waiting in the queue are kept.
+    AwardCheck.objects.bulk_create(checks, ignore_conflicts=True)
+
+
+def process_queue(users=None, limit=1000):
+    """
+    Checks a batch of queued award rules, a single pass for all the users waiting on the same rule.
+    Returns the new awards.
+    """
+    checks = AwardCheck.objects.order_by('pk')
+    if users is not None:
+        checks = checks.filter(user_id__in=users)
+    checks = list(checks.values_list('pk', 'user_id', 'rule')[:limit])
+
+    if not checks:
+        return []
+
+    AwardCheck.objects.filter(pk__in=[pk for pk, user_id, rule in checks]).delete()
+
+    # Group the users by the rules to check.
+    waiting = {}
+    for pk, user_id, rule in checks:
+        waiting.setdefault(rule, set()).add(user_id)
+
+    rules = {award.name: award for award in ALL_AWARDS}
+    awards = []
+    for name, user_ids in waiting.items():
+        if name in rules:
+            awards.extend(give_awards(users=list(user_ids), rules=[rules[name]]))
+
+    return awards
@@ -34,6 +34,12 @@ SIMILAR_CACHE_KEY = "SIMILAR"
 USERS_CACHE_KEY = "MENTIONED_USERS"
 
 USERS_LIST_KEY = "USERS_LIST"
+
+# The rendered sidebar activity feed.
+FEED_CACHE_KEY = "DEFAULT_FEED"
+
+# Prefix for the rendered rows of the post list.
+POST_ROW_CACHE_KEY = "POST_ROW"
 # The name of the session count data.
 COUNT_DATA_KEY = "COUNT_DATA"
 
@@ -48,3 +54,13 @@ JOBS, TOOLS, TUTORIALS, FORUM, PLANET = ["jobs", "tools", "tutorials", "forum",
 BOOKMARKS, MESSAGE = ["bookmarks", "message"]
 
 MENTIONED, COMMUNITY, LATEST = ["mentioned", "community", "latest"]
+
+# The html rendered from markdown.
+HTML_CACHE_KEY = "MARKDOWN_HTML"
+
+# Visits counted for banning and the DNS verification of crawlers.
+VISITS_CACHE_KEY = "VISITS"
+CRAWLER_CACHE_KEY = "CRAWLER"
+
+# Post snippets rendered for the digests.
+DIGEST_CACHE_KEY = "DIGEST"
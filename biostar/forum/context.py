@@ -8,7 +8,8 @@ def forum(request):
     '''
 
     #print(request.session.get('res'), 'res', request.COOKIES)
-    res = request.COOKIES.get('resolution', 'x')
+    # Anonymous pages may not depend on cookies, they are cached by the front proxy.
+    res = request.COOKIES.get('resolution', 'x') if request.user.is_authenticated else 'x'
     width, height = res.split('x')
 
     params = dict(user=request.user, width=width, height=height,
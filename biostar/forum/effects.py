@@ -0,0 +1,90 @@
+"""
+Collects the side effects of saving a post and runs them together.
+
+The updates of the same row are merged into a single UPDATE when the outermost batch ends.
+Tasks are spooled once per name and post after the transaction commits, so that
+they see the saved data. Outside of a batch the effects run right away.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.db import transaction
+
+_local = threading.local()
+
+
+class Batch(object):
+    """
+    The updates and tasks collected while saving a post.
+    """
+
+    def __init__(self):
+        self.updates = {}
+        self.tasks = {}
+
+    def update(self, model, pk, **fields):
+        # The last value of a field wins.
+        self.updates.setdefault((model, pk), {}).update(fields)
+
+    def spool(self, task, **kwargs):
+        # The calls of a task for the same post are merged, a flag set by any call is kept.
+        key = kwargs['post_id'] if 'post_id' in kwargs else repr(sorted(kwargs.items()))
+        task, merged = self.tasks.setdefault((task, key), (task, {}))
+        for name, value in kwargs.items():
+            merged[name] = merged.get(name) or value
+
+    def flush(self):
+        for (model, pk), fields in self.updates.items():
+            model.objects.filter(pk=pk).update(**fields)
+        self.updates = {}
+
+    def run(self):
+        for task, kwargs in self.tasks.values():
+            task.spool(**kwargs)
+        self.tasks = {}
+
+
+def current():
+    return getattr(_local, 'batch', None)
+
+
+@contextmanager
+def collect():
+    """
+    Collects the effects of the enclosed code, nested calls join the outermost batch.
+    """
+    batch = current()
+    if batch:
+        yield batch
+        return
+
+    batch = _local.batch = Batch()
+    try:
+        with transaction.atomic():
+            yield batch
+            batch.flush()
+            transaction.on_commit(batch.run)
+    finally:
+        _local.batch = None
+
+
+def update(model, pk, **fields):
+    """
+    Updates the fields of a row.
+    """
+    batch = current()
+    if batch:
+        batch.update(model, pk, **fields)
+    else:
+        model.objects.filter(pk=pk).update(**fields)
+
+
+def spool(task, **kwargs):
+    """
+    Spools a task once the transaction commits.
+    """
+    batch = current()
+    if batch:
+        batch.spool(task, **kwargs)
+    else:
+        transaction.on_commit(lambda: task.spool(**kwargs))
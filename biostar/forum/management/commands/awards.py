@@ -1,54 +1,37 @@
 import logging
-from datetime import timedelta
-from django.utils import timezone
 from django.core.management.base import BaseCommand
 
-from biostar.accounts.models import User
-from biostar.forum.models import Award, Badge, Post
-from biostar.forum.awards import ALL_AWARDS
+from biostar.forum.models import Award, AwardCheck
+from biostar.forum.awards import give_awards, process_queue
 
 
 logger = logging.getLogger('engine')
 
 
-def give_award(user):
-
-    for award in ALL_AWARDS:
-        # Valid award targets the user has earned
-        targets = award.validate(user)
-
-        for target in targets:
-            date = user.profile.last_login
-            post = target if isinstance(target, Post) else None
-            badge = Badge.objects.filter(name=award.name).first()
-
-            # Do not award a post multiple times.
-            already_awarded = Award.objects.filter(user=user, badge=badge, post=post).exists()
-            if post and already_awarded:
-                continue
-
-            # Create an award for each target.
-            Award.objects.create(user=user, badge=badge, date=date, post=post)
-
-            logger.info(f"award {badge.name} created for {user.email}" )
-
-
 def create_user_awards(clear=False):
 
     # Clear all awards.
     if clear:
         Award.objects.all().delete()
 
-    # GGet users active within the last day.
-    past_day = timezone.now() - timedelta(days=1)
+    # Check every rule for all users at once.
+    awards = give_awards()
+
+    logger.info(f"Created {len(awards)} awards.")
+
+    return awards
 
-    users = User.objects.filter(profile__last_login__gte=past_day)
-    logger.info(f"Checking awards for {users.count()} users.")
 
-    for user in users:
-        give_award(user)
+def check_queue():
 
-    return
+    # Check the award rules queued by user events, in batches.
+    awards = []
+    while AwardCheck.objects.exists():
+        awards.extend(process_queue())
+
+    logger.info(f"Created {len(awards)} awards from the queue.")
+
+    return awards
 
 
 class Command(BaseCommand):
@@ -60,6 +43,8 @@ class Command(BaseCommand):
                             help="Hand out awards to users.")
         parser.add_argument('-c', '--clear', action='store_true', default=False,
                             help="Clear current awards")
+        parser.add_argument('-q', '--queue', action='store_true', default=False,
+                            help="Check the awards queued by user events.")
 
     def handle(self, *args, **options):
 
@@ -68,3 +53,6 @@ class Command(BaseCommand):
 
         if give_awards:
             create_user_awards(clear=clear)
+
+        if options['queue']:
+            check_queue()
@@ -1,75 +1,154 @@
+import logging
+import textwrap
 from datetime import timedelta
-from django.template import loader
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMultiAlternatives, get_connection
 from django.core.management.base import BaseCommand
-from taggit.models import Tag
+from django.template import loader
+from biostar.forum import const
 from biostar.forum.models import Post
-from biostar.emailer.tasks import send_email
+from biostar.emailer import sender
 from biostar.accounts import util, models
 
+logger = logging.getLogger('engine')
+
+# Digest preference of each period in days.
+PREFS_MAP = {1: models.Profile.DAILY_DIGEST, 7: models.Profile.WEEKLY_DIGEST, 30: models.Profile.MONTHLY_DIGEST}
+
+
+def parse_tags(*values):
+    return {tag.strip().lower() for value in values for tag in value.split(",") if tag.strip()}
+
+
+def get_context():
+    """
+    Context shared by every digest email.
+    """
+    port = f":{settings.HTTP_PORT}" if settings.HTTP_PORT else ""
+    return dict(domain=settings.SITE_DOMAIN, protocol=settings.PROTOCOL, port=port, name=settings.SITE_NAME)
+
+
+def snippet_key(post):
+    # Votes and answers are shown in the snippet.
+    return f"{const.DIGEST_CACHE_KEY}-{post.uid}-{post.lastedit_date.timestamp()}-{post.vote_count}-{post.answer_count}"
 
-def send_digests(days=1, subject=""):
-    '''
-    Send digest emails to users
-    '''
-    prefs_map = {1: models.Profile.DAILY_DIGEST, 7: models.Profile.WEEKLY_DIGEST, 30: models.Profile.MONTHLY_DIGEST}
-    # Send digests for posts within the last x days.
-    delta = util.now() - timedelta(days=days)
 
-    # Get users with the appropriate digest prefs.
-    digest_prefs = prefs_map.get(days, models.Profile.DAILY_DIGEST)
-    users = models.User.objects.filter(profile__digest_prefs=digest_prefs)
+def top_posts(days, size=None):
+    """
+    Picks the most voted top level posts of the period and renders their snippets.
+    Returns a list of (tags, snippet) in order.
+    """
+    size = size or settings.DIGEST_POOL_SIZE
+    since = util.now() - timedelta(days=days)
 
-    # Fetch posts within the last x amount of days
-    posts = Post.objects.filter(lastedit_date__gt=delta)
+    posts = Post.objects.valid_posts(type__in=Post.TOP_LEVEL, lastedit_date__gt=since)
+    posts = posts.select_related('author__profile').prefetch_related('tags')
+    posts = posts.order_by('-vote_count', '-lastedit_date')[:size]
 
-    email_template = loader.get_template("messages/digest.html")
-    context = dict(subject=subject, posts=posts)
+    posts = {snippet_key(post): post for post in posts}
+    cached = cache.get_many(list(posts))
 
-    # Queue and send digest emails.
-    emails = users.values_list('email', flat=True)
-    send_email(template_name=email_template, extra_context=context, recipient_list=emails)
+    template = loader.get_template("messages/digest_post.html")
+    context = get_context()
 
-    return
+    data, missing = [], {}
+    for key, post in posts.items():
+        tags = [tag.name.lower() for tag in post.tags.all()]
+        snippet = cached.get(key)
+        if snippet is None:
+            url = f"{context['protocol']}://{context['domain']}{context['port']}{post.get_absolute_url()}"
+            html = template.render(dict(context, post=post, tags=tags))
+            snippet = missing[key] = dict(html=html, text=f"{post.title} - {url}")
+        data.append((set(tags), snippet))
 
+    cache.set_many(missing, settings.DIGEST_CACHE_SECONDS)
 
-def send_watched_tags():
-    '''
-    Get watched tags from the last week and send email to users.
-    '''
+    return data
 
-    # Get users with watched tags.
-    users = models.User.objects.exclude(profile__watched_tags='')
 
-    # Get posts made in the last week
-    delta = util.now() - timedelta(days=7)
+def get_recipients(prefs=None, size=None):
+    """
+    Streams the (email, watched_tags, my_tags) of the valid users with the digest preference.
+    Users watching tags are returned when there is no preference.
+    """
+    users = models.User.objects.filter(is_active=True, profile__state__in=[models.Profile.NEW, models.Profile.TRUSTED])
+    users = users.exclude(email='')
 
-    posts = Post.objects.filter(lastedit_date__lte=delta)
+    if prefs is None:
+        users = users.exclude(profile__watched_tags='')
+    else:
+        users = users.filter(profile__digest_prefs=prefs)
 
-    tags = Tag.objects.filter(post__lastedit_date__gt=delta, post__type__in=Post.TOP_LEVEL)
-    tags = tags.values_list('name', flat=True)
+    users = users.order_by('pk').values_list('email', 'profile__watched_tags', 'profile__my_tags')
 
-    # Fetch users with the watched tags
-    #TODO: this will probably need to be done in a for loop.
-    users = users.filter(watched_tags__icontains=tags)
+    return users.iterator(chunk_size=size or settings.DIGEST_BATCH_SIZE)
 
-    print(users)
 
-    return
+def pick_posts(posts, tags, limit):
+    """
+    Splits the snippets into the posts in the tags of the user and the remaining top posts.
+    """
+    watched = [snippet for post_tags, snippet in posts if post_tags & tags][:limit] if tags else []
+    others = [snippet for post_tags, snippet in posts if snippet not in watched][:limit]
+    return watched, others
 
 
-def test():
-    # Testing the cron tasks
-    print("in main")
+def deliver(connection, batch):
+    """
+    Hands a batch of emails to the mail backend, the queue when it is django-mailer.
+    """
+    if not batch:
+        return 0
+    sent = connection.send_messages(batch) or 0
+    logger.info(f"Sent {sent} digest emails")
+    return sent
 
-    print("TESTING")
 
-    import os
-    test = os.path.abspath(os.path.join(os.path.dirname(__file__), 'tmp'))
-    print(test)
+def send_digests(days=1, subject="", prefs=None, tags_only=False, size=None, limit=None):
+    """
+    Send digest emails to users, each listing the posts in the tags of the user first.
+    Emails with tags_only=True only list the posts in the tags of the user.
+    """
+    size = size or settings.DIGEST_BATCH_SIZE
+    limit = limit or settings.DIGEST_POST_LIMIT
 
-    open(test, 'w').write('TESTING this cron')
+    if not settings.SEND_MAIL or settings.DATA_MIGRATION:
+        return 0
 
-    return
+    # The top posts are picked and rendered once.
+    posts = top_posts(days=days)
+    if not posts:
+        return 0
+
+    email = sender.EmailTemplate("messages/digest.html")
+    context = dict(get_context(), subject=subject)
+    from_email = settings.FROM_EMAIL_PATTERN % (settings.SITE_NAME, settings.DEFAULT_NOREPLY_EMAIL)
+
+    connection = get_connection()
+    batch, count = [], 0
+
+    for address, watched_tags, my_tags in get_recipients(prefs=prefs, size=size):
+
+        watched, others = pick_posts(posts, tags=parse_tags(watched_tags, my_tags), limit=limit)
+        if tags_only:
+            others = []
+        if not (watched or others):
+            continue
+
+        subj, text, html = email.render(dict(context, watched=watched, posts=others))
+        msg = EmailMultiAlternatives(subj, textwrap.dedent(text), from_email, [address], connection=connection)
+        msg.attach_alternative(html, "text/html")
+        batch.append(msg)
+
+        if len(batch) >= size:
+            count += deliver(connection, batch)
+            batch = []
+
+    count += deliver(connection, batch)
+
+    return count
 
 
 class Command(BaseCommand):
@@ -88,12 +167,14 @@ class Command(BaseCommand):
         weekly = options['weekly']
         daily = options['daily']
 
-        # Index all un-indexed posts that have a root.
+        count = 0
         if daily:
-            send_digests(days=1, subject="Daily digest")
+            count = send_digests(days=1, subject="Daily digest", prefs=PREFS_MAP[1])
         elif weekly:
-            send_digests(days=7, subject="Weekly digest")
+            count = send_digests(days=7, subject="Weekly digest", prefs=PREFS_MAP[7])
         elif monthly:
-            send_digests(days=30, subject="Monthly digest")
+            count = send_digests(days=30, subject="Monthly digest", prefs=PREFS_MAP[30])
         elif tags:
-            send_watched_tags()
+            count = send_digests(days=7, subject="Watched tags", tags_only=True)
+
+        logger.info(f"Sent {count} digest emails.")
@@ -0,0 +1,139 @@
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+
+import django
+from django.core.management.base import BaseCommand
+from django.utils.timezone import make_aware
+from biostar.forum.models import Post
+
+logger = logging.getLogger('engine')
+
+
+def render(rows):
+    """
+    Renders the content of (pk, content) pairs into html.
+    Runs in the worker processes. The cached html may come from an older renderer.
+    """
+    from biostar.forum import markdown
+
+    return [(pk, markdown.parse(content, clean=True, escape=False, use_cache=False)) for pk, content in rows]
+
+
+def read_checkpoint(fname):
+    """
+    Returns the last primary key stored in the checkpoint file.
+    """
+    if not os.path.isfile(fname):
+        return 0
+    with open(fname) as fp:
+        return int(fp.read().strip() or 0)
+
+
+def write_checkpoint(fname, pk):
+    # Write then rename so that an interrupted run keeps the previous checkpoint.
+    tmp = f"{fname}.tmp"
+    with open(tmp, 'w') as fp:
+        fp.write(str(pk))
+    os.replace(tmp, fname)
+
+
+def get_chunks(query, start, size):
+    """
+    Generates the posts as lists of (pk, content, html) in primary key order.
+    """
+    last = start
+    while True:
+        rows = list(query.filter(pk__gt=last).order_by('pk').values_list('pk', 'content', 'html')[:size])
+        if not rows:
+            return
+        last = rows[-1][0]
+        yield rows
+
+
+def rerender(workers=1, size=1000, since=None, checkpoint=None, resume=False):
+    """
+    Renders the html of the posts again and stores the html that changed.
+    Saves are bypassed, no signals are fired.
+    """
+    start = read_checkpoint(checkpoint) if (checkpoint and resume) else 0
+    if start:
+        logger.info(f"Resuming after post pk={start}")
+
+    query = Post.objects.all()
+    if since:
+        query = query.filter(lastedit_date__gte=since)
+
+    total = query.filter(pk__gt=start).count()
+    count = changed = 0
+    begin = time.time()
+
+    def store(rows, results):
+        nonlocal count, changed
+
+        # Only write the html that has changed.
+        current = {pk: html for pk, content, html in rows}
+        posts = [Post(pk=pk, html=html) for pk, html in results if current[pk] != html]
+        Post.objects.bulk_update(posts, ['html'], batch_size=size)
+
+        count += len(rows)
+        changed += len(posts)
+
+        # The chunks are stored in order, all posts up to this one are done.
+        if checkpoint:
+            write_checkpoint(checkpoint, rows[-1][0])
+
+        rate = count / max(time.time() - begin, 0.001)
+        eta = (total - count) / rate
+        logger.info(f"Rendered {count}/{total} posts, {changed} changed, {rate:.0f} posts/sec, eta {eta:.0f} seconds")
+
+    chunks = get_chunks(query=query, start=start, size=size)
+
+    if workers < 2:
+        for rows in chunks:
+            store(rows, render([(pk, content) for pk, content, html in rows]))
+        return count, changed
+
+    # New processes set up django themselves instead of inheriting the database connections.
+    context = get_context('spawn')
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=django.setup) as pool:
+        # Keep a bounded number of chunks in flight and store them in order.
+        pending = deque()
+        for rows in chunks:
+            pending.append((rows, pool.submit(render, [(pk, content) for pk, content, html in rows])))
+            if len(pending) >= workers * 2:
+                rows, future = pending.popleft()
+                store(rows, future.result())
+
+        while pending:
+            rows, future = pending.popleft()
+            store(rows, future.result())
+
+    return count, changed
+
+
+class Command(BaseCommand):
+    help = 'Renders the html of the posts again without saving the posts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Number of rendering processes.")
+        parser.add_argument('--batch', type=int, default=1000, help="Posts rendered and stored at a time.")
+        parser.add_argument('--since', type=str, default='', help="Only posts edited since the date: YYYY-MM-DD")
+        parser.add_argument('--checkpoint', type=str, default='rerender.checkpoint',
+                            help="File that stores the progress.")
+        parser.add_argument('--resume', action='store_true', default=False,
+                            help="Continue after the last post stored in the checkpoint.")
+
+    def handle(self, *args, **options):
+        since = options['since']
+        since = make_aware(datetime.strptime(since, '%Y-%m-%d')) if since else None
+
+        count, changed = rerender(workers=options['workers'], size=options['batch'], since=since,
+                                  checkpoint=options['checkpoint'], resume=options['resume'])
+
+        logger.info(f"Rendered {count} posts, {changed} changed")
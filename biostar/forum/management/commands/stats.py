@@ -0,0 +1,32 @@
+import logging
+from django.core.management.base import BaseCommand
+from biostar.forum import api
+
+logger = logging.getLogger('engine')
+
+
+class Command(BaseCommand):
+    help = 'Stores the daily site statistics served by the stats api.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backfill', action='store_true', default=False,
+                            help="Rebuild the statistics of every day.")
+        parser.add_argument('--tags', action='store_true', default=False,
+                            help="Rebuild the monthly tag counts.")
+        parser.add_argument('--months', type=int, default=0,
+                            help="Only rebuild the tag counts of the last months, all months by default.")
+
+    def handle(self, *args, **options):
+
+        if options['tags']:
+            count = api.rollup_tags(months=options['months'] or None)
+            logger.info(f"Stored {count} monthly tag counts.")
+            return
+
+        if options['backfill']:
+            count = api.backfill()
+        else:
+            # Adds the days since the last run, run it nightly.
+            count = api.update_stats()
+
+        logger.info(f"Stored statistics for {count} days.")
@@ -19,6 +19,10 @@ class Command(BaseCommand):
         parser.add_argument('--user', type=str, default="www", help="Postgres user.")
         parser.add_argument('--password', type=str, default="", help="Postgres password.")
         parser.add_argument('--batch', type=int, default=10, help="How many posts to load for the given date range.")
+        parser.add_argument('--chunk', type=int, default=settings.SYNC_CHUNK_SIZE,
+                            help="How many threads to read and store at a time.")
+        parser.add_argument('--parallel', type=int, default=0,
+                            help="Number of processes retrieving the shards of the date range.")
         parser.add_argument('--start', type=str, default="",
                             help="""Start syncing from this date; ISO format. <year>-<month>-<date> eg: 2013-02-14""")
         parser.add_argument('--update', action='store_true', default=True,
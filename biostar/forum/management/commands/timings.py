@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from biostar.utils import metrics
+
+
+class Command(BaseCommand):
+    help = 'Prints the request time percentiles for each view.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sort', type=str, default='p95',
+                            choices=['view', 'count', 'p50', 'p95', 'p99', 'queries', 'db', 'wait', 'errors'],
+                            help="Column to sort the views by.")
+
+    def handle(self, *args, **options):
+
+        rows = []
+        for view, counts in metrics.collect().items():
+            total = counts['count'] or 1
+            rows.append(dict(
+                view=view,
+                count=counts['count'],
+                p50=metrics.percentile(counts, 0.50),
+                p95=metrics.percentile(counts, 0.95),
+                p99=metrics.percentile(counts, 0.99),
+                queries=counts['queries'] / total,
+                db=counts['db_time'] / total / 1000,
+                wait=counts['wait'] / total / 1000,
+                errors=counts['errors'],
+            ))
+
+        key = options['sort']
+        rows.sort(key=lambda row: row[key], reverse=key != 'view')
+
+        self.stdout.write(f"{'view':40} {'count':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'queries':>8} {'db':>8} "
+                          f"{'wait':>8} {'errors':>8}")
+        for row in rows:
+            self.stdout.write(f"{row['view']:40} {row['count']:8} {row['p50']:7.0f}ms {row['p95']:7.0f}ms "
+                              f"{row['p99']:7.0f}ms {row['queries']:8.1f} {row['db']:6.1f}ms "
+                              f"{row['wait']:6.1f}ms {row['errors']:8}")
@@ -2,7 +2,9 @@
 Markdown parser to render the Biostar style markdown.
 """
 import re
+import hashlib
 import inspect
+import threading
 from functools import partial
 import mistune
 import requests
@@ -14,12 +16,14 @@ from bleach.linkifier import Linker
 from bleach.linkifier import LinkifyFilter
 import html2text
 from django.conf import settings
+from django.core.cache import cache
 from mistune import Renderer, InlineLexer, InlineGrammar
 from mistune import escape as escape_text
 from bleach.sanitizer import Cleaner
-from biostar.forum import auth
-from biostar.forum.models import Post, Subscription
+from biostar.forum import const, util
+from biostar.forum.models import Post, Subscription, EmbedCache
 from biostar.accounts.models import Profile, User
+from biostar.utils import metrics
 
 # Test input.
 TEST_INPUT = '''
@@ -68,6 +72,15 @@ POST_ANCHOR = rec(fr"^http(s)?://{SITE_URL}/p/\w+/\#(?P<uid>(\w+))(/)?")
 # These characters are allowed in handles: _  .  -
 MENTINONED_USERS = rec(r"(\@(?P<handle>[\w_.'-]+))")
 
+# Code blocks and spans, where mentions are shown as written.
+FENCED_CODE = rec(r"^ {0,3}(`{3,}|~{3,}).*?(^ {0,3}\1[ \t]*$|\Z)", re.MULTILINE | re.DOTALL)
+INDENTED_CODE = rec(r"(\A|\n[ \t]*\n)((?: {4}|\t)[^\n]*(\n|\Z))+")
+INLINE_CODE = rec(r"(`+).+?(?<!`)\1(?!`)", re.DOTALL)
+
+# Unanchored patterns used to collect the link targets before parsing.
+POST_TARGETS = rec(fr"http(s)?://{SITE_URL}/p/(?P<uid>\w+)(/)?(\#(?P<anchor>\w+))?")
+USER_TARGETS = rec(fr"http(s)?://{SITE_URL}/accounts/profile/(?P<uid>[\w_.-]+)")
+
 ALLOWED_ATTRIBUTES = {
     '*': ['class', 'style'],
     'a': ['href', 'rel'],
@@ -102,22 +115,48 @@ GIST_HTML = '<script src="https://gist.github.com/%s.js"></script>'
 TWITTER_PATTERN = rec(r"http(s)?://(www)?.?twitter.com/\w+/status(es)?/(?P<uid>([\d]+))")
 
 
-def get_tweet(tweet_id):
+# Stands in for the embedded html until it is fetched.
+EMBED_PLACEHOLDER = '<a href="{url}" data-embed="{url}">{url}</a>'
+EMBED_PENDING = rec(r'data-embed="(?P<url>[^"]+)"')
+
+
+def get_embed(url):
+    """
+    Returns the stored oEmbed html for a link, a placeholder when it still needs to be fetched.
+    Does not touch the network, the html is fetched out of band with fetch_embed().
+    """
+    embed = EmbedCache.objects.filter(url=url).first()
+
+    if embed and embed.is_fresh:
+        # Links that failed to fetch are shown as links.
+        return embed.html or f'<a href="{url}">{url}</a>'
+
+    return EMBED_PLACEHOLDER.format(url=url)
+
+
+def pending_embeds(html):
+    """
+    Returns the links waiting to be embedded in the html.
+    """
+    return sorted(set(EMBED_PENDING.findall(html)))
+
+
+def fetch_embed(url):
     """
-    Get the HTML code with the embedded tweet.
-    It requires an API call at https://api.twitter.com/1/statuses/oembed.json as documented here:
-    https://dev.twitter.com/docs/embedded-tweets - section "Embedded Tweets for Developers"
-    https://dev.twitter.com/docs/api/1/get/statuses/oembed
-    Params:
-    tweet_id -- a tweet's numeric id like 2311234267 for the tweet at
-    https://twitter.com/Linux/status/2311234267
+    Fetches the oEmbed html for a tweet and stores it.
+    Failures are stored as well, to avoid retrying them on every render.
+    Documented at https://developer.twitter.com/en/docs/twitter-for-websites/oembed-api
     """
     try:
-        response = requests.get("https://api.twitter.com/1/statuses/oembed.json?id={}".format(
-            tweet_id))
-        return response.json()['html']
-    except:
-        return ''
+        response = requests.get(settings.TWITTER_OEMBED_URL, params=dict(url=url), timeout=settings.EMBED_TIMEOUT)
+        response.raise_for_status()
+        html = response.json()['html']
+    except Exception:
+        html = ''
+
+    EmbedCache.objects.update_or_create(url=url, defaults=dict(html=html, date=util.now()))
+
+    return html
 
 
 class MonkeyPatch(InlineLexer):
@@ -194,6 +233,9 @@ class BiostarInlineLexer(MonkeyPatch):
         self.root = root
         self.allow_rewrite = allow_rewrite
 
+        # Link targets resolved ahead of parsing, see resolve_targets()
+        self.posts, self.profiles, self.users = {}, {}, {}
+
         super(BiostarInlineLexer, self).__init__(*args, **kwargs)
         self.enable_all()
 
@@ -236,14 +278,10 @@ class BiostarInlineLexer(MonkeyPatch):
 
         handle = m.group("handle")
         # Query user and get the link
-        user = User.objects.filter(username=handle).first()
+        user = self.users.get(handle)
         if user:
             profile = reverse("user_profile", kwargs=dict(uid=user.profile.uid))
             link = f'<a href="{profile}">{user.profile.name}</a>'
-            # Subscribe mentioned users to post.
-            if self.root:
-                # Create user subscription if it does not already exist.
-                auth.create_subscription(post=self.root, user=user, update=True)
         else:
             link = m.group(0)
 
@@ -251,7 +289,7 @@ class BiostarInlineLexer(MonkeyPatch):
 
     def output_post_link(self, m):
         uid = m.group("uid")
-        post = Post.objects.filter(uid=uid).first() or Post(title=f"Invalid post uid: {uid}")
+        post = self.posts.get(uid) or Post(title=f"Invalid post uid: {uid}")
         link = m.group(0)
         return f'<a href="{link}">{post.title}</a>'
 
@@ -262,7 +300,7 @@ class BiostarInlineLexer(MonkeyPatch):
     def output_anchor_link(self, m):
         uid = m.group("uid")
         alt, link = f"{uid}", m.group(0)
-        post = Post.objects.filter(uid=uid).first()
+        post = self.posts.get(uid)
         title = post.title if post else "Post not found"
         return f'<a href="{link}">{title}</a>'
 
@@ -273,7 +311,7 @@ class BiostarInlineLexer(MonkeyPatch):
     def output_user_link(self, m):
         uid = m.group("uid")
         link = m.group(0)
-        profile = Profile.objects.filter(uid=uid).first()
+        profile = self.profiles.get(uid)
         name = profile.name if profile else f"Invalid user uid: {uid}"
         return f'<a href="{link}">USER: {name}</a>'
 
@@ -348,18 +386,17 @@ def embedder(attrs, new, embed=None):
 
     # Try embedding patterns
     targets = [
-        (GIST_PATTERN, lambda x: GIST_HTML % x),
-        (YOUTUBE_PATTERN1, lambda x: YOUTUBE_HTML % x),
-        (YOUTUBE_PATTERN2, lambda x: YOUTUBE_HTML % x),
-        (YOUTUBE_PATTERN3, lambda x: YOUTUBE_HTML % x),
-        (TWITTER_PATTERN, get_tweet),
+        (GIST_PATTERN, lambda m: GIST_HTML % m.group("uid")),
+        (YOUTUBE_PATTERN1, lambda m: YOUTUBE_HTML % m.group("uid")),
+        (YOUTUBE_PATTERN2, lambda m: YOUTUBE_HTML % m.group("uid")),
+        (YOUTUBE_PATTERN3, lambda m: YOUTUBE_HTML % m.group("uid")),
+        (TWITTER_PATTERN, lambda m: get_embed(m.group())),
     ]
 
     for regex, get_text in targets:
         patt = regex.search(href)
         if patt:
-            uid = patt.group("uid")
-            obj = get_text(uid)
+            obj = get_text(patt)
             embed.append((patt.group(), obj))
             attrs['_text'] = patt.group()
             if 'rel' in attrs:
@@ -398,7 +435,103 @@ def safe(callable, *args, **kwargs):
         return errmsg
 
 
-def parse(text, post=None, clean=True, escape=True, allow_rewrite=False):
+def resolve_targets(text):
+    """
+    Returns the posts, profiles and users linked or mentioned in the text.
+    Uses a single query per model no matter how many links the text contains.
+    """
+    post_uids, profile_uids = set(), set()
+
+    for m in POST_TARGETS.finditer(text):
+        post_uids.update(filter(None, m.group('uid', 'anchor')))
+
+    for m in USER_TARGETS.finditer(text):
+        profile_uids.add(m.group('uid'))
+
+    handles = {m.group('handle') for m in MENTINONED_USERS.finditer(text)}
+
+    posts, profiles, users = {}, {}, {}
+
+    if post_uids:
+        posts = {p.uid: p for p in Post.objects.filter(uid__in=post_uids).only('uid', 'title')}
+
+    if profile_uids:
+        profiles = {p.uid: p for p in Profile.objects.filter(uid__in=profile_uids).only('uid', 'name')}
+
+    if handles:
+        users = {u.username: u for u in User.objects.filter(username__in=handles).select_related('profile')}
+
+    return posts, profiles, users
+
+
+def mentioned_users(text):
+    """
+    Returns the users mentioned in the text, outside of the code.
+    """
+    for pattern in (FENCED_CODE, INDENTED_CODE, INLINE_CODE):
+        text = pattern.sub("\n\n", text)
+
+    handles = {m.group('handle') for m in MENTINONED_USERS.finditer(text)}
+    return User.objects.filter(username__in=handles).select_related('profile') if handles else []
+
+
+# Each thread reuses the parsers it has already built.
+_local = threading.local()
+
+
+def get_parser(escape, allow_rewrite):
+    """
+    Returns the markdown parser for the given options.
+    """
+    parsers = getattr(_local, 'parsers', None)
+    if parsers is None:
+        parsers = _local.parsers = {}
+
+    key = (escape, allow_rewrite)
+    if key not in parsers:
+        renderer = BiostarRenderer(escape=escape)
+        inline = BiostarInlineLexer(renderer=renderer, allow_rewrite=allow_rewrite)
+        parsers[key] = mistune.Markdown(hard_wrap=True, renderer=renderer, inline=inline)
+
+    return parsers[key]
+
+
+def markdown(text, root=None, targets=({}, {}, {}), escape=True, allow_rewrite=False):
+    """
+    Renders the text with the parser of the current thread.
+    """
+    parser = get_parser(escape=escape, allow_rewrite=allow_rewrite)
+    parser.inline.root = root
+    parser.inline.posts, parser.inline.profiles, parser.inline.users = targets
+
+    try:
+        return parser(text)
+    except Exception:
+        # A failed parse may leave the parser in a partial state.
+        _local.parsers.pop((escape, allow_rewrite), None)
+        raise
+    finally:
+        parser.inline.root = None
+        parser.inline.posts, parser.inline.profiles, parser.inline.users = {}, {}, {}
+
+
+def html_key(text, root, targets, **options):
+    """
+    The cache key for the html of a text.
+    Changes when the text, the options or what the links point to change.
+    """
+    posts, profiles, users = targets
+    state = [
+        text, sorted(options.items()), root.pk if root else None,
+        sorted((p.uid, p.title) for p in posts.values()),
+        sorted((p.uid, p.name) for p in profiles.values()),
+        sorted((u.username, u.profile.uid, u.profile.name) for u in users.values()),
+    ]
+    digest = hashlib.md5(repr(state).encode('utf-8')).hexdigest()
+    return f"{const.HTML_CACHE_KEY}-{digest}"
+
+
+def parse(text, post=None, clean=True, escape=True, allow_rewrite=False, use_cache=True):
     """
     Parses markdown into html.
     Expands certain patterns into HTML.
@@ -408,20 +541,25 @@ def parse(text, post=None, clean=True, escape=True, allow_rewrite=False):
     escape  : Escape html originally found in the markdown text.
     allow_rewrite : Serve images with relative url paths from the static directory.
                   eg. images/foo.png -> /static/images/foo.png
+    use_cache : Return the html cached for the text. Otherwise renders the text
+                again and replaces the cached html.
     """
 
     # Resolve the root if exists.
     root = post.parent.root if (post and post.parent) else None
 
-    # Initialize the renderer
-    renderer = BiostarRenderer(escape=escape)
-
-    # Initialize the lexer
-    inline = BiostarInlineLexer(renderer=renderer, root=root, allow_rewrite=allow_rewrite)
+    # Resolve all posts and users the text links to.
+    targets = resolve_targets(text)
 
-    markdown = mistune.Markdown(hard_wrap=True, renderer=renderer, inline=inline)
+    # Text rendered before is not parsed again.
+    key = html_key(text, root, targets, clean=clean, escape=escape, allow_rewrite=allow_rewrite)
+    if use_cache:
+        html = cache.get(key)
+        metrics.record_cache(hit=html is not None)
+        if html is not None:
+            return html
 
-    html = safe(markdown, text=text)
+    html = safe(markdown, text=text, root=root, targets=targets, escape=escape, allow_rewrite=allow_rewrite)
 
     # Bleach clean the html.
     if clean:
@@ -433,6 +571,10 @@ def parse(text, post=None, clean=True, escape=True, allow_rewrite=False):
     # Embed sensitive links into html
     html = safe(linkify, text=html)
 
+    # Html waiting for embeds is rendered again once they are fetched.
+    if not pending_embeds(html):
+        cache.set(key, html, settings.MARKDOWN_CACHE_SECONDS)
+
     return html
 
 
@@ -1,14 +1,19 @@
+import atexit
 import logging
+import threading
 import time
 
 from socket import gethostbyaddr, gethostbyname
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import logout
-from django.core.cache import cache
+from django.core.cache import cache, caches
+from django.db import connection
 from django.shortcuts import redirect
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from biostar.accounts.models import Profile, Message
 from biostar.accounts.tasks import detect_location
+from biostar.utils import metrics
 
 from . import auth, tasks, const, util
 from .models import Vote
@@ -29,22 +34,31 @@ def get_ip(request):
 
 def benchmark(get_response):
     """
-    Prints the time needed to perform a request.
+    Records the time, database queries and cache lookups needed to perform a request.
     """
 
     def middleware(request):
 
         # Start timer.
         start = time.time()
+        metrics.start()
 
         # Performs the request
-        response = get_response(request)
+        with connection.execute_wrapper(metrics.record_query):
+            response = get_response(request)
 
         # Elapsed time.
-        delta = int((time.time() - start) * 1000)
+        elapsed = time.time() - start
+        counts = metrics.stop()
+
+        # Requests are grouped by the view that handled them.
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unresolved'
+        metrics.observe(view=view, elapsed=elapsed, **counts)
 
         # Generate timing message.
-        msg = f'time={delta}ms for path={request.path}'
+        delta = int(elapsed * 1000)
+        msg = f'time={delta}ms queries={counts["queries"]} db={counts["db_time"] // 1000}ms view={view} path={request.path}'
 
         if delta > 1000:
             logger.warning(f"\n***\n*** SLOW: {msg}\n***\a")
@@ -56,6 +70,49 @@ def benchmark(get_response):
     return middleware
 
 
+def anon_cache(get_response):
+    """
+    Marks the anonymous responses of public pages as cacheable by a front proxy.
+    Must be the first middleware so that it sees the final response headers.
+    """
+
+    def is_public(request):
+
+        # Only the pages listed in the settings may be shared.
+        match = getattr(request, 'resolver_match', None)
+        url_name = match.url_name if match else None
+        if url_name not in settings.ANON_CACHE_VIEWS:
+            return False
+
+        user = getattr(request, 'user', None)
+        return bool(user and user.is_anonymous)
+
+    def middleware(request):
+
+        response = get_response(request)
+
+        if not (settings.ANON_CACHE_SECONDS and is_public(request)):
+            return response
+
+        # The token is fetched over ajax when a form is opened.
+        if settings.CSRF_COOKIE_NAME in response.cookies:
+            del response.cookies[settings.CSRF_COOKIE_NAME]
+
+        # Responses that set cookies (session, messages) are specific to a client.
+        valid = request.method in ('GET', 'HEAD') and response.status_code == 200
+        if valid and not response.cookies:
+            patch_cache_control(response, public=True, max_age=settings.ANON_CACHE_SECONDS)
+        else:
+            patch_cache_control(response, private=True)
+
+        # Logged in users carry a session cookie and must not get the shared copy.
+        patch_vary_headers(response, ('Cookie',))
+
+        return response
+
+    return middleware
+
+
 def update_status(user):
     # Update a new user into trusted after a threshold score is reached.
     if (user.profile.state == Profile.NEW) and (user.profile.score > 50):
@@ -67,16 +124,96 @@ def update_status(user):
 
 
 def domain_is_whitelisted(ip):
+    """
+    Blocking reverse and forward DNS lookup, use is_crawler() in requests.
+    """
     try:
         host = gethostbyaddr(ip)[0]
-        return host.endswith(settings.WHITE_LIST_DOMAIN) and (ip == gethostbyname(host))
+        return host.endswith(tuple(settings.WHITE_LIST_DOMAIN)) and (ip == gethostbyname(host))
     except:
         return False
 
 
-def ban_ip(get_response):
+def is_crawler(ip):
+    """
+    Returns the cached DNS verification of the ip, the lookup itself runs in a task.
+    Clients count as unverified until the lookup succeeds. The verdict is kept in the
+    shared cache, where the process running the task stores it.
+    """
+    shared = caches['shared']
+    key = f"{const.CRAWLER_CACHE_KEY}-{ip}"
+    verified = shared.get(key)
+
+    # The pending key is removed by the task once the lookup completes.
+    if verified is None and shared.add(f"{key}-PENDING", 1, settings.CRAWLER_RETRY_SECONDS):
+        tasks.verify_crawler.spool(ip=ip)
+        verified = shared.get(key)
+
+    return bool(verified)
+
+
+def count_visit(ip):
+    """
+    Counts a visit from the ip and returns the visits over the last TIME_PERIOD seconds.
+    The sliding window is estimated from the counts of the current and the previous window.
+    """
+    period = settings.TIME_PERIOD
+    window, offset = divmod(time.time(), period)
+    key = f"{const.VISITS_CACHE_KEY}-{ip}-{int(window)}"
+
+    # Both operations are atomic in the cache.
+    cache.add(key, 0, 2 * period)
+    try:
+        current = cache.incr(key)
+    except ValueError:
+        # Evicted between the add and the increment.
+        current = 1
+        cache.set(key, current, 2 * period)
+
+    previous = cache.get(f"{const.VISITS_CACHE_KEY}-{ip}-{int(window) - 1}", 0)
+
+    return current + previous * (1 - offset / period)
+
+
+class BufferedAppender:
     """
+    Appends lines to a file in batches.
+    The buffer is written when full, when it gets too old and at exit.
+    """
+
+    def __init__(self, fname, size=100, secs=10):
+        self.fname, self.size, self.secs = fname, size, secs
+        self.lines = []
+        self.lock = threading.Lock()
+        self.written = time.time()
+        atexit.register(self.flush)
+
+    def write(self, line):
+        with self.lock:
+            self.lines.append(line)
+            due = len(self.lines) >= self.size or time.time() - self.written >= self.secs
+        if due:
+            self.flush()
 
+    def flush(self):
+        with self.lock:
+            lines, self.lines = self.lines, []
+            self.written = time.time()
+        if not lines:
+            return
+        try:
+            with open(self.fname, "a") as fp:
+                fp.writelines(lines)
+        except OSError as exc:
+            logger.error(f"unable to write {self.fname}: {exc}")
+
+
+banlog = BufferedAppender(settings.BANNED_IPS, size=settings.BAN_LOG_SIZE, secs=settings.BAN_LOG_SECONDS)
+
+
+def ban_ip(get_response):
+    """
+    Bans anonymous users from a /24 network that visit too often, except verified crawlers.
     """
     def middleware(request):
         user = request.user
@@ -92,24 +229,12 @@ def ban_ip(get_response):
             if ip in settings.IP_WHITELIST:
                 return get_response(request)
 
-            if ip not in cache:
-                cache.set(ip, 0, settings.TIME_PERIOD)
-
-            value = cache.get(ip)
-            if value >= settings.MAX_VISITS:
-                # Raise redirect exception
-                if domain_is_whitelisted(oip):
-                    cache.set(ip, 0)
-                else:
-                    now = util.now()
-                    message = f"{now}\tbanned\t{ip}\t{oip}\n"
-                    logger.error(message)
-                    fp = open(settings.BANNED_IPS, "a")
-                    fp.write(message)
-                    fp.close()
-                    return redirect('/static/message.txt')
-            else:
-                cache.incr(ip)
+            if count_visit(ip) > settings.MAX_VISITS and not is_crawler(oip):
+                now = util.now()
+                message = f"{now}\tbanned\t{ip}\t{oip}\n"
+                logger.error(message)
+                banlog.write(message)
+                return redirect('/static/message.txt')
 
         return get_response(request)
 
@@ -0,0 +1,22 @@
+# Generated by Django 3.1 on 2026-10-19 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0010_vote_date'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmbedCache',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.CharField(max_length=256, unique=True)),
+                ('html', models.TextField(blank=True, default='')),
+                ('date', models.DateTimeField()),
+            ],
+        ),
+    ]
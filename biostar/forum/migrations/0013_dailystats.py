@@ -0,0 +1,29 @@
+# Generated by Django 3.1 on 2026-10-19 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0012_awardcheck'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('questions', models.IntegerField(default=0)),
+                ('answers', models.IntegerField(default=0)),
+                ('toplevel', models.IntegerField(default=0)),
+                ('comments', models.IntegerField(default=0)),
+                ('votes', models.IntegerField(default=0)),
+                ('users', models.IntegerField(default=0)),
+                ('new_users', models.TextField(default='[]')),
+                ('new_posts', models.TextField(default='[]')),
+                ('new_votes', models.TextField(default='[]')),
+            ],
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.1 on 2026-10-19 15:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0013_dailystats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagMonthlyCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(db_index=True, max_length=256)),
+                ('month', models.DateField(db_index=True)),
+                ('total', models.IntegerField(default=0)),
+                ('answer_count', models.IntegerField(default=0)),
+                ('comment_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('name', 'month')},
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.1 on 2026-10-19 09:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0015_notification'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sync',
+            name='end',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='sync',
+            name='last_id',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='sync',
+            name='start',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
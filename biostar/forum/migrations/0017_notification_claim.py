@@ -0,0 +1,23 @@
+# Generated by Django 3.1 on 2026-10-19 10:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0016_sync_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='claim',
+            field=models.CharField(db_index=True, default='', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='claimed',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1 on 2026-10-19 10:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0017_notification_claim'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sync',
+            name='done',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
@@ -1,3 +1,4 @@
+import json
 import logging
 
 import bleach
@@ -8,7 +9,7 @@ from django.db.models import Q
 from django.shortcuts import reverse
 from taggit.managers import TaggableManager
 from biostar.accounts.models import Profile
-from . import util
+from . import util, effects
 from django.contrib.auth.models import User
 
 # The maximum length in characters for a typical name and text field.
@@ -69,6 +70,82 @@ class Sync(models.Model):
 
     last_synced = models.DateTimeField(null=True)
 
+    # The date range being synced and the id of the last thread synced in it.
+    start = models.DateTimeField(null=True)
+    end = models.DateTimeField(null=True)
+    last_id = models.IntegerField(default=0)
+
+    # The parallel sync has stored the shards of the range up to this date.
+    done = models.DateTimeField(null=True)
+
+
+class DailyStats(models.Model):
+    """
+    Site statistics for a day, the counts are the totals at the end of the day.
+    """
+    date = models.DateField(unique=True)
+
+    questions = models.IntegerField(default=0)
+    answers = models.IntegerField(default=0)
+    toplevel = models.IntegerField(default=0)
+    comments = models.IntegerField(default=0)
+    votes = models.IntegerField(default=0)
+    users = models.IntegerField(default=0)
+
+    # Json lists of the uids created during the day.
+    new_users = models.TextField(default='[]')
+    new_posts = models.TextField(default='[]')
+    new_votes = models.TextField(default='[]')
+
+    # The running totals.
+    TOTALS = ('questions', 'answers', 'toplevel', 'comments', 'votes', 'users')
+
+    def as_dict(self):
+        data = {
+            'date': util.datetime_to_iso(self.date),
+            'timestamp': util.datetime_to_unix(self.date),
+            'new_users': json.loads(self.new_users),
+            'new_posts': json.loads(self.new_posts),
+            'new_votes': json.loads(self.new_votes),
+        }
+        data.update({field: getattr(self, field) for field in self.TOTALS})
+        return data
+
+
+class TagMonthlyCount(models.Model):
+    """
+    Post counts for a tag over the posts created in a month.
+    """
+    name = models.CharField(max_length=MAX_NAME_LEN, db_index=True)
+
+    # The first day of the month.
+    month = models.DateField(db_index=True)
+
+    total = models.IntegerField(default=0)
+    answer_count = models.IntegerField(default=0)
+    comment_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('name', 'month')
+
+
+class EmbedCache(models.Model):
+    """
+    The oEmbed html fetched for a link.
+    An empty html records a failed fetch.
+    """
+    url = models.CharField(max_length=MAX_NAME_LEN, unique=True)
+
+    html = models.TextField(default='', blank=True)
+
+    # When the html was fetched.
+    date = models.DateTimeField()
+
+    @property
+    def is_fresh(self):
+        ttl = settings.EMBED_CACHE_SECONDS if self.html else settings.EMBED_RETRY_SECONDS
+        return (util.now() - self.date).total_seconds() < ttl
+
 
 class Post(models.Model):
     "Represents a post in a forum"
@@ -353,15 +430,16 @@ class Post(models.Model):
         comment_count = descendants.filter(type=Post.COMMENT).count()
         reply_count = descendants.count()
         # Update the root reply, answer, and comment counts.
-        Post.objects.filter(pk=self.root.pk).update(reply_count=reply_count, answer_count=answer_count,
-                                                    comment_count=comment_count)
+        effects.update(Post, self.root.pk, reply_count=reply_count, answer_count=answer_count,
+                       comment_count=comment_count)
 
         children = Post.objects.filter(parent=self.parent).exclude(pk=self.parent.pk)
         com_count = children.filter(type=Post.COMMENT).count()
 
         # Update parent reply, answer, and comment counts.
-        Post.objects.filter(pk=self.parent.pk, is_toplevel=False).update(comment_count=com_count, answer_count=0,
-                                                                         reply_count=children.count())
+        if not self.parent.is_toplevel:
+            effects.update(Post, self.parent.pk, comment_count=com_count, answer_count=0,
+                           reply_count=children.count())
 
     @property
     def css(self):
@@ -510,3 +588,38 @@ class Award(models.Model):
         # Set the date to current time if missing.
         self.uid = self.uid or util.get_uuid(limit=16)
         super(Award, self).save(*args, **kwargs)
+
+
+class AwardCheck(models.Model):
+    """
+    An award rule waiting to be checked for a user.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+
+    # The name of the award rule.
+    rule = models.CharField(max_length=50)
+
+    class Meta:
+        unique_together = ('user', 'rule')
+
+
+class Notification(models.Model):
+    """
+    A new post waiting to be sent to a follower of the thread.
+    The posts of a thread are sent together once the oldest one has waited long enough.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    root = models.ForeignKey(Post, related_name="notified", on_delete=models.CASCADE)
+    post = models.ForeignKey(Post, on_delete=models.CASCADE)
+
+    # The follower gets an email as well.
+    email = models.BooleanField(default=False)
+
+    date = models.DateTimeField(db_index=True)
+
+    # The flush sending the post and when it took it.
+    claim = models.CharField(max_length=32, default='', db_index=True)
+    claimed = models.DateTimeField(null=True)
+
+    class Meta:
+        unique_together = ('user', 'post')
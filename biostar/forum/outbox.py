@@ -0,0 +1,114 @@
+"""
+Coalesces the notifications sent to the followers of a thread.
+
+New posts are queued per follower and thread. Once the oldest post of a thread
+has waited for the window, the follower gets a single message and email listing
+all the new posts. Followers waiting on the same posts share the rendering.
+"""
+import logging
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+
+from biostar.accounts.models import Profile
+from biostar.accounts.tasks import create_messages
+from biostar.emailer.tasks import send_email
+from biostar.forum import util
+from biostar.forum.models import Post, Subscription, Notification
+
+logger = logging.getLogger('engine')
+
+
+def enqueue(subs, post):
+    """
+    Queues the post for the subscribed users.
+    """
+    subs = subs.values_list('user_id', 'type', 'user__profile__digest_prefs')
+
+    # Mailing list users get the post by email already.
+    now = util.now()
+    entries = [Notification(user_id=user_id, root_id=post.root_id, post=post, date=now,
+                            email=stype == Subscription.EMAIL_MESSAGE and prefs != Profile.ALL_MESSAGES)
+               for user_id, stype, prefs in subs]
+
+    Notification.objects.bulk_create(entries, batch_size=1000, ignore_conflicts=True)
+
+    return len(entries)
+
+
+def flush(window=None, limit=5000):
+    """
+    Sends the queued posts of the threads whose oldest post waited longer than the window.
+    The posts are claimed first, so that flushes running at the same time send each post once.
+    Returns the number of posts sent.
+    """
+    window = settings.NOTIFY_WINDOW_SECONDS if window is None else window
+    now = util.now()
+    cutoff = now - timedelta(seconds=window)
+
+    # Posts not claimed yet, or claimed by a flush that did not finish.
+    free = Q(claim='') | Q(claimed__lt=now - timedelta(seconds=settings.NOTIFY_CLAIM_SECONDS))
+
+    due = Notification.objects.filter(free, date__lte=cutoff).values_list('user_id', 'root_id').distinct()
+    due = set(due[:limit])
+    if not due:
+        return 0
+
+    # Claim all queued posts of the due threads, the posts claimed in the meantime are skipped.
+    queued = Notification.objects.filter(free, root_id__in={root_id for user_id, root_id in due})
+    queued = [pk for pk, user_id, root_id in queued.values_list('pk', 'user_id', 'root_id') if (user_id, root_id) in due]
+
+    claim = uuid.uuid4().hex
+    Notification.objects.filter(free, pk__in=queued).update(claim=claim, claimed=now)
+
+    entries = Notification.objects.filter(claim=claim)
+    entries = list(entries.select_related('user', 'post', 'post__author__profile', 'root').order_by('pk'))
+
+    # The posts and the email preference of each follower of a thread.
+    threads = {}
+    for entry in entries:
+        user, posts, email = threads.get((entry.user_id, entry.root_id), (entry.user, [], False))
+        posts.append(entry.post)
+        threads[(entry.user_id, entry.root_id)] = (user, posts, email or entry.email)
+
+    # Followers waiting on the same posts get the same message.
+    groups = {}
+    for user, posts, email in threads.values():
+        key = tuple(post.pk for post in posts)
+        local, emails, posts = groups.setdefault(key, ([], [], posts))
+        local.append(user)
+        if email:
+            emails.append(user.email)
+
+    for local, emails, posts in groups.values():
+        send(posts=posts, users=local, emails=emails)
+
+    Notification.objects.filter(pk__in=[entry.pk for entry in entries]).delete()
+
+    return len(entries)
+
+
+def send(posts, users, emails):
+    """
+    Sends one message and email about the new posts of a thread.
+    """
+    post = posts[-1]
+    author = post.author if len({p.author_id for p in posts}) == 1 else None
+
+    if len(posts) == 1:
+        local_template, email_template = "messages/subscription_message.md", "messages/subscription_email.html"
+    else:
+        local_template, email_template = "messages/subscription_summary.md", "messages/subscription_summary.html"
+
+    context = dict(post=post, root=post.root, posts=posts)
+
+    create_messages(template=local_template, extra_context=context, rec_list=users, sender=author)
+
+    if not emails:
+        return
+
+    name = author.profile.name if author else settings.SITE_NAME
+    send_email(template_name=email_template, extra_context=context, name=name,
+               from_email=settings.DEFAULT_NOREPLY_EMAIL, recipient_list=emails, mass=True)
@@ -48,6 +48,14 @@ REQUIRED_TAGS_URL = "/"
 
 BANNED_IPS = os.path.join(BASE_DIR, 'export', 'logs', 'banned.txt')
 
+# Bans are written to the log in batches of lines or after a number of seconds.
+BAN_LOG_SIZE = 100
+BAN_LOG_SECONDS = 10
+
+# How long the DNS verification of crawlers is cached, and how long failed verifications are, in seconds.
+CRAWLER_CACHE_SECONDS = 24 * 3600
+CRAWLER_RETRY_SECONDS = 3600
+
 
 # Posts cut off when applying a filtre
 CUTOFF = 1000
@@ -73,6 +81,28 @@ CLASSIFY_SPAM = True
 
 ENABLE_DIGESTS = False
 
+# Top posts of the period considered for the digests, and the posts listed in each section of an email.
+DIGEST_POOL_SIZE = 200
+DIGEST_POST_LIMIT = 10
+
+# New posts of a thread are sent to its followers together, after the oldest waited this long.
+NOTIFY_WINDOW_SECONDS = 300
+
+# Posts claimed by a flush that did not finish are sent by another one after this long.
+NOTIFY_CLAIM_SECONDS = 600
+
+# Users read and emails handed to the mail backend at a time.
+DIGEST_BATCH_SIZE = 500
+
+# How long the rendered post snippets are reused between digests.
+DIGEST_CACHE_SECONDS = 3600
+
+# Threads read from the remote database and stored at a time when syncing.
+SYNC_CHUNK_SIZE = 1000
+
+# Date range shards retrieved by each process when syncing in parallel.
+SYNC_SHARDS_PER_WORKER = 4
+
 # Disable all asynchronous tasks
 DISABLE_TASKS = False
 
@@ -105,8 +135,27 @@ LOCATION_FEED_COUNT = 5
 AWARDS_FEED_COUNT = 10
 REPLIES_FEED_COUNT = 15
 
+# How long the sidebar activity feed is cached, in seconds.
+FEED_CACHE_SECONDS = 60
+
 SIMILAR_FEED_COUNT = 30
 
+# How long the rendered rows of the post list are cached, in seconds.
+POST_ROW_CACHE_SECONDS = 600
+
+# How long the html rendered from markdown is cached, in seconds.
+MARKDOWN_CACHE_SECONDS = 3600
+
+# The oEmbed endpoint used to embed tweets.
+TWITTER_OEMBED_URL = "https://publish.twitter.com/oembed"
+
+# Seconds to wait for an oEmbed endpoint to respond.
+EMBED_TIMEOUT = 5
+
+# How long fetched embeds are kept, and how long to wait before retrying failed ones, in seconds.
+EMBED_CACHE_SECONDS = 30 * 24 * 3600
+EMBED_RETRY_SECONDS = 3600
+
 SESSION_UPDATE_SECONDS = 40
 
 # Search index name
@@ -139,6 +188,19 @@ MIDDLEWARE += [
     'biostar.forum.middleware.benchmark',
 ]
 
+# Sees the final response, needs to be the outermost middleware.
+MIDDLEWARE.insert(0, 'biostar.forum.middleware.anon_cache')
+
+# How long a front proxy may cache pages served to anonymous users, in seconds.
+# Zero turns off the cookie-less anonymous pages.
+ANON_CACHE_SECONDS = 60
+
+# The url names of the pages that anonymous users get without cookies.
+ANON_CACHE_VIEWS = [
+    'post_list', 'post_view', 'tags_list',
+    'latest_feed', 'tag_feed', 'user_feed', 'post_feed', 'post_type',
+]
+
 # Remap the post type display to a more human friendly one.
 REMAP_TYPE_DISPLAY = False
 
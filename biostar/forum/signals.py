@@ -1,11 +1,10 @@
 import logging
 from django.db.models.signals import post_save
 from django.dispatch import receiver
-from taggit.models import Tag
 from django.db.models import F, Q
-from biostar.accounts.models import Profile, Message, User
+from biostar.accounts.models import Profile, Message
 from biostar.forum.models import Post, Award, Subscription
-from biostar.forum import tasks, auth, util, spam
+from biostar.forum import tasks, auth, util, spam, markdown, awards, effects
 
 
 logger = logging.getLogger("biostar")
@@ -59,17 +58,20 @@ def ban_user(sender, instance, created, **kwargs):
 @receiver(post_save, sender=Post)
 def finalize_post(sender, instance, created, **kwargs):
 
+    # The updates are merged and the tasks spooled once the post is saved.
+    with effects.collect():
+        update_post(instance=instance, created=created)
+
+
+def update_post(instance, created):
+
     # Determine the root of the post.
     root = instance.root if instance.root is not None else instance
 
     # Update last contributor, last editor, and last edit date to the thread
-    Post.objects.filter(uid=root.uid).update(lastedit_user=instance.lastedit_user,
-                                             last_contributor=instance.last_contributor,
-                                             lastedit_date=instance.lastedit_date)
+    effects.update(Post, root.pk, lastedit_user=instance.lastedit_user,
+                   last_contributor=instance.last_contributor, lastedit_date=instance.lastedit_date)
 
-    # Get newly created subscriptions since the last edit date.
-    subs = Subscription.objects.filter(date__gte=instance.lastedit_date, post=instance.root)
-    extra_context = dict(post=instance)
     if created:
         # Make the Uid user friendly
         instance.uid = instance.uid or f"p{instance.pk}"
@@ -90,8 +92,7 @@ def finalize_post(sender, instance, created, **kwargs):
 
         if instance.is_toplevel:
             # Add tags for top level posts.
-            tags = [Tag.objects.get_or_create(name=name)[0] for name in instance.parse_tags()]
-            instance.tags.remove()
+            tags = auth.get_tags(instance.parse_tags())
             instance.tags.add(*tags)
         else:
             # Title is inherited from top level.
@@ -105,39 +106,48 @@ def finalize_post(sender, instance, created, **kwargs):
         # Update this post rank on create and not every edit.
         instance.rank = instance.lastedit_date.timestamp()
 
-        # Save the instance.
-        instance.save()
+        # Save the instance, the nested save does not notify the followers.
+        instance.creating = True
+        try:
+            instance.save()
+        finally:
+            instance.creating = False
         instance.update_parent_counts()
 
         # Bump the root rank when a new answer is added.
         if instance.is_answer:
-            Post.objects.filter(uid=instance.root.uid).update(rank=util.now().timestamp())
+            effects.update(Post, instance.root.pk, rank=util.now().timestamp())
 
         # Create subscription to the root.
         auth.create_subscription(post=instance.root, user=instance.author)
 
-        # Get all subscribed users when a new post is created
-        subs = Subscription.objects.filter(post=instance.root)
+        # Queue the awards for creating posts.
+        awards.enqueue(users=[instance.author_id], event=awards.POST_CREATED)
 
         # Notify users who are watching tags in this post
-        tasks.notify_watched_tags.spool(post=instance, extra_context=extra_context)
+        effects.spool(tasks.notify_watched_tags, post_id=instance.pk)
 
         # Give it a spam score.
-        tasks.spam_scoring.spool(post=instance)
-
-        mailing_list = User.objects.filter(profile__digest_prefs=Profile.ALL_MESSAGES)
+        effects.spool(tasks.spam_scoring, post_id=instance.pk)
 
         # Send out mailing list when post is created.
-        tasks.mailing_list.spool(users=mailing_list, extra_context=extra_context, post=instance)
+        effects.spool(tasks.mailing_list, post_id=instance.pk)
 
     # Add this post to the spam index if it's spam.
-    tasks.update_spam_index.spool(post=instance)
+    # Tasks are passed the post id, a pending task absorbs the repeated edits.
+    effects.spool(tasks.update_spam_index, post_id=instance.pk)
 
     # Ensure posts get re-indexed after being edited.
-    Post.objects.filter(uid=instance.uid).update(indexed=False)
+    effects.update(Post, instance.pk, indexed=False)
+
+    # Subscribe mentioned users to the thread, the html may come from the cache.
+    for user in markdown.mentioned_users(instance.content):
+        auth.create_subscription(post=instance.root, user=user, update=True)
 
-    # Exclude current authors from receiving messages from themselves
-    subs = subs.exclude(Q(type=Subscription.NO_MESSAGES) | Q(user=instance.author))
+    # Notify subscribers, all of them when a new post is created.
+    if not getattr(instance, 'creating', False):
+        effects.spool(tasks.notify_followers, post_id=instance.pk, created=created)
 
-    # Notify subscribers
-    tasks.notify_followers.spool(subs=subs, author=instance.author, extra_context=extra_context)
\ No newline at end of file
+    # Embedded content is fetched outside of the request.
+    if markdown.pending_embeds(instance.html):
+        effects.spool(tasks.resolve_embeds, post_id=instance.pk)
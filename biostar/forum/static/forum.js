@@ -50,6 +50,33 @@ function apply_vote(vote_elem) {
     });
 }
 
+function fetch_csrf(callback) {
+    // Anonymous pages are served without a CSRF cookie, request the token when needed.
+    if (csrftoken) {
+        callback(csrftoken);
+        return
+    }
+    $.ajax("/ajax/csrf/", {
+        type: 'GET',
+        dataType: 'json',
+        success: function (data) {
+            csrftoken = data.token;
+            callback(csrftoken);
+        }
+    });
+}
+
+function fill_csrf(form, callback) {
+    // Replaces the form token with one that matches the current cookie.
+    fetch_csrf(function (token) {
+        form.find("input[name='csrfmiddlewaretoken']").val(token);
+        form.data('csrf', true);
+        if (callback) {
+            callback()
+        }
+    });
+}
+
 function remove_trigger() {
     // Makes site messages dissapear.
     $('.remove').delay(2000).slideUp(800, function () {
@@ -307,6 +334,24 @@ function highligh_preview(form, text) {
 
 $(document).ready(function () {
 
+    // Fetch the CSRF token once a form is opened.
+    var post_forms = "form[method='post'], form[method='POST']";
+
+    $(document).on('focusin', post_forms, function () {
+        fill_csrf($(this));
+    });
+
+    $(document).on('submit', post_forms, function (event) {
+        var form = $(this);
+        if (form.data('csrf')) {
+            return
+        }
+        event.preventDefault();
+        fill_csrf(form, function () {
+            form.get(0).submit();
+        });
+    });
+
     $('.spam').dropdown({on: 'hover'});
     $('.spam .mark.item').click(function (event) {
         var post = $(this).closest('.post');
@@ -1,14 +1,17 @@
 import logging
+import multiprocessing
+import pickle
+import shutil
+import tempfile
 import time
 import os
 from datetime import timedelta, datetime
-from functools import partial
 from django.conf import settings
-from django.db.models import Q
+from django.db import connections, transaction
+from django.utils import timezone
 from biostar.forum.models import Post, Vote, Sync, Subscription
-from biostar.accounts.models import Profile, User, Logger
-from biostar.forum import util, auth
-from django.core.cache import cache
+from biostar.accounts.models import Profile, User
+from biostar.forum import util
 
 try:
     import psycopg2
@@ -57,36 +60,33 @@ def column_list(cursor):
     return colnames
 
 
-def select_related(posts, cursor, fr='posts_vote', where='posts_vote.post_id'):
-    cols = {k: i for i, k in enumerate(column_list(cursor))}
-
-    # Get author and last edit user ids into a set.
-    post_ids = {p[cols['id']] for p in posts if p}
-    post_ids = tuple(post_ids)
-
+def select_related(ids, cursor, fr='posts_vote', where='posts_vote.post_id'):
+    """
+    Select the rows related to the ids in a single parameterized query.
+    """
     cursor.execute(f"""
                     SELECT *
                     FROM {fr}
-                    WHERE {where} IN {post_ids}
-                    """)
+                    WHERE {where} = ANY(%s)
+                    """, [list(ids)])
 
     objs = cursor.fetchall()
     return objs
 
 
-def select_related_votes(posts, cursor):
+def select_related_votes(ids, cursor):
     """
     Select votes that been made recently.
     """
     from_q = 'posts_vote'
     where_q = 'posts_vote.post_id'
-    return select_related(posts=posts, cursor=cursor, fr=from_q, where=where_q)
+    return select_related(ids=ids, cursor=cursor, fr=from_q, where=where_q)
 
 
-def select_related_subs(posts, cursor):
+def select_related_subs(ids, cursor):
     from_q = 'posts_subscription'
     where_q = 'posts_subscription.post_id'
-    return select_related(posts=posts, cursor=cursor, fr=from_q, where=where_q)
+    return select_related(ids=ids, cursor=cursor, fr=from_q, where=where_q)
 
 
 def select_related_users(user_ids, cursor):
@@ -94,24 +94,24 @@ def select_related_users(user_ids, cursor):
     Select all author and last edit users found in list of posts.
     """
     # Get author and last edit user ids into a set.
-    user_ids = {str(x) for y in user_ids for x in y}
-    user_ids = tuple(user_ids)
+    user_ids = {x for y in user_ids for x in y if x is not None}
 
     # Joins the user profile as well.
     cursor.execute(f"""
                     SELECT *
                     FROM users_user
                     RIGHT JOIN users_profile ON (users_user.id = users_profile.user_id)
-                    WHERE users_user.id IN {user_ids}
-                    """)
+                    WHERE users_user.id = ANY(%s)
+                    """, [list(user_ids)])
 
     users = cursor.fetchall()
     return users
 
 
-def posts_query_str(start, end, batch=None):
+def posts_query_str(batch=None):
     # Prefetch the thread associated with each post
     # Order by id so the roots and parents always come before children.
+    # Threads after last_id are selected to resume an interrupted sync.
     q = f"""SELECT DISTINCT ON (thread.id) thread.id, thread.root_id, thread.parent_id, 
                                            thread.author_id, thread.lastedit_user_id, 
                                            thread.rank, thread.status, thread.type, 
@@ -123,12 +123,13 @@ def posts_query_str(start, end, batch=None):
                                            thread.thread_score
             FROM posts_post post
             INNER JOIN posts_post thread ON (post.root_id = thread.root_id)
-            WHERE post.lastedit_date between '{start}'::timestamp and '{end}'::timestamp 
-            OR post.creation_date between '{start}'::timestamp and '{end}'::timestamp  
+            WHERE (post.lastedit_date BETWEEN %(start)s AND %(end)s 
+                   OR post.creation_date BETWEEN %(start)s AND %(end)s)
+            AND thread.id > %(last_id)s
             ORDER BY thread.id ASC
          """
     if batch:
-        q += f" LIMIT '{batch}'"
+        q += " LIMIT %(batch)s"
 
     return q
 
@@ -159,33 +160,62 @@ def get_start(days, cursor):
 
     if days < 0:
         recent = Sync.objects.filter(pk=1).first()
-        recent = recent.last_synced if recent else most_recent(cursor=cursor)
+        recent = recent.last_synced if recent and recent.last_synced else most_recent(cursor=cursor)
         recent = recent + timedelta(days=2)
     else:
         # Get the most recently created post on the remote server.
         recent = Post.objects.old().order_by('-creation_date').first()
         recent = recent.creation_date if recent else None
-        recent = recent - timedelta(days=2)
+        recent = recent - timedelta(days=2) if recent else None
 
     start = recent or util.now()
 
     return start
 
 
+def aware(date):
+    return timezone.make_aware(date) if timezone.is_naive(date) else date
+
+
+def get_range(start, days, cursor):
+    """
+    Return the date range to sync and the id of the last thread synced in it.
+    An interrupted sync is resumed when no start date is given or the range is the same.
+    """
+    state = Sync.objects.filter(pk=1).first()
+    unfinished = state and (state.last_id or state.done) and state.start and state.end
+
+    if unfinished and not start:
+        return state.start, state.end, state.last_id
+
+    start = aware(start or get_start(days=days, cursor=cursor))
+    end = start + timedelta(days=days)
+    start, end = sorted([start, end])
+
+    if unfinished and (start, end) == (state.start, state.end):
+        return start, end, state.last_id
+
+    Sync.objects.update_or_create(pk=1, defaults=dict(start=start, end=end, last_id=0, done=None))
+
+    return start, end, 0
+
+
+def store_checkpoint(last_id):
+    """
+    Store the id of the last thread synced in the date range.
+    """
+    Sync.objects.filter(pk=1).update(last_id=last_id)
+
+
 def store_synced_date(date):
     """
     Stored when syncing backwards.
     """
-    recent = Sync.objects.filter(pk=1).first()
-
     # Go back 12 hours from this date to ensure nothing is missed.
     date = date + timedelta(hours=12)
 
-    # Update the existing sync date
-    if recent:
-        Sync.objects.filter(pk=1).update(last_synced=date)
-    else:
-        Sync.objects.create(last_synced=date)
+    # The date range has been synced.
+    Sync.objects.update_or_create(pk=1, defaults=dict(last_synced=date, last_id=0, done=None))
 
 
 def split_rows(rows):
@@ -193,14 +223,10 @@ def split_rows(rows):
     Split incoming row into what is to be updated/created.
     """
 
-    posts = set(Post.objects.all().values_list('uid', flat=True))
+    posts = set(Post.objects.filter(uid__in=[str(r[0]) for r in rows]).values_list('uid', flat=True))
     update = list(filter(lambda r: str(r[0]) in posts, rows))
     create = list(filter(lambda r: str(r[0]) not in posts, rows))
-    threads = list(filter(lambda r: (str(r[0]) not in posts) and r[0] == r[1], rows))
 
-    logger.info(f"Number being of posts created\t{len(create)}")
-    logger.info(f"Number being of threads created\t{len(threads)}")
-    logger.info(f"Number being of posts updated\t{len(update)}")
     return create, update
 
 
@@ -208,8 +234,14 @@ def bulk_create_posts(rows, column, users, relations=dict()):
     for row in rows:
         # Map column names to row.
         row = {col: val for col, val in zip(column, row)}
-        post = Post(lastedit_user=users[row['lastedit_user_id']],
-                    author=users[row['author_id']],
+        author = users.get(row['author_id'])
+
+        # Skip posts whose author could not be synced.
+        if not author:
+            continue
+
+        post = Post(lastedit_user=users.get(row['lastedit_user_id'], author),
+                    author=author,
                     uid=row['id'],
                     view_count=row['view_count'],
                     vote_count=row['vote_count'],
@@ -229,14 +261,19 @@ def bulk_create_posts(rows, column, users, relations=dict()):
         yield post
 
 
+def related_uids(relations):
+    # The roots and parents may have been synced with an earlier chunk.
+    return set(relations) | {uid for pair in relations.values() for uid in pair}
+
+
 def bulk_relations(relations):
-    posts = {post.uid: post for post in Post.objects.filter(uid__in=relations.keys())}
+    posts = {post.uid: post for post in Post.objects.filter(uid__in=related_uids(relations))}
     for pid in relations:
         root_uid, parent_uid = relations[pid][0], relations[pid][1]
-        post = posts[pid]
+        post = posts.get(pid)
         root = posts.get(root_uid)
         parent = posts.get(parent_uid)
-        if not (root and parent):
+        if not (post and root and parent):
             continue
         post.root = root
         post.parent = parent
@@ -251,7 +288,7 @@ def bulk_counts(relations):
     posts = {post: (descendants(post).filter(type=Post.ANSWER).count(),
                     descendants(post).filter(type=Post.COMMENT).count())
 
-             for post in Post.objects.filter(uid__in=relations.keys())}
+             for post in Post.objects.filter(uid__in=related_uids(relations))}
 
     for post in posts:
         answer_count, comment_count = posts[post][0], posts[post][1]
@@ -264,8 +301,8 @@ def bulk_counts(relations):
 def bulk_create_votes(rows, column, pdict, udict):
     for row in rows:
         row = {col: val for col, val in zip(column, row)}
-        post = pdict[str(row['post_id'])]
-        author = udict[row['author_id']]
+        post = pdict.get(str(row['post_id']))
+        author = udict.get(row['author_id'])
         vtype = row['type']
         # Skip incomplete post/author information.
         if not (post and author) or not post.root:
@@ -322,7 +359,6 @@ def clean_subs(rows, column):
             sub.delete()
 
 
-@timer
 def sync_votes(votes, users):
     rows = votes.get('rows', [])
     column = votes.get('column', [])
@@ -342,7 +378,6 @@ def sync_votes(votes, users):
     Vote.objects.bulk_create(objs=generator, batch_size=500)
 
 
-@timer
 def sync_subs(subs, users):
     rows = subs.get('rows', [])
     column = subs.get('column', [])
@@ -376,70 +411,61 @@ def get_user_ids(rows, column, is_posts=False, is_subs=False):
     return user_ids
 
 
-@timer
-def retrieve(cursor, start, days, batch=None):
+def retrieve(conn, start, end, last_id=0, size=None):
     """
-    Retrieve relevant data between a given date range.
+    Stream the threads changed in the date range in chunks, with their votes, subscriptions and users.
+    A server side cursor keeps a single chunk in memory.
     """
-    # The calculated end date
-    end = start + timedelta(days=days)
-    start, end = sorted([start, end])
-    query = posts_query_str(start=start, end=end, batch=batch)
+    size = size or settings.SYNC_CHUNK_SIZE
 
-    # Execute query and return posts.
-    cursor.execute(query)
-    posts = cursor.fetchall()
+    threads = conn.cursor(name="sync_threads")
+    threads.itersize = size
+    threads.execute(posts_query_str(), dict(start=start, end=end, last_id=last_id))
 
-    # No posts exist for the given date range
-    if not posts:
-        logger.info(f"No posts found for start={start.date()} end={end.date()}")
-        return dict()
+    # The related rows are selected with a second cursor.
+    cursor = conn.cursor()
 
-    # Retrieve column names from cursor to later map to rows
-    post_cols = column_list(cursor=cursor)
+    try:
+        while True:
+            posts = threads.fetchmany(size)
+            if not posts:
+                break
 
-    # Get the user ids involved with this post.
-    user_ids = get_user_ids(rows=posts, is_posts=True, column=post_cols)
+            # Retrieve column names from cursor to later map to rows
+            post_cols = column_list(cursor=threads)
+            ids = [row[0] for row in posts]
 
-    # Preform a select_related query for the users and votes.
-    votes = select_related_votes(posts=posts, cursor=cursor)
-    votes_cols = column_list(cursor=cursor)
+            # Get the user ids involved with this post.
+            user_ids = get_user_ids(rows=posts, is_posts=True, column=post_cols)
 
-    # Add user id's involved with votes after the 'cursor' has been altered.
-    user_ids += get_user_ids(rows=votes, column=votes_cols)
+            votes = select_related_votes(ids=ids, cursor=cursor)
+            votes_cols = column_list(cursor=cursor)
 
-    # Preform a select_related query for the users and votes.
-    subs = select_related_subs(posts=posts, cursor=cursor)
-    subs_cols = column_list(cursor=cursor)
+            # Add user id's involved with votes after the 'cursor' has been altered.
+            user_ids += get_user_ids(rows=votes, column=votes_cols)
 
-    user_ids += get_user_ids(rows=subs, is_subs=True, column=subs_cols)
+            subs = select_related_subs(ids=ids, cursor=cursor)
+            subs_cols = column_list(cursor=cursor)
 
-    # Select all related users found in votes and subs
-    users = select_related_users(user_ids=user_ids, cursor=cursor)
-    user_cols = column_list(cursor=cursor)
+            user_ids += get_user_ids(rows=subs, is_subs=True, column=subs_cols)
 
-    # Store the last synced date into the database.
-    store_synced_date(start)
+            # Select all related users found in votes and subs
+            users = select_related_users(user_ids=user_ids, cursor=cursor)
+            user_cols = column_list(cursor=cursor)
 
-    # Collapse results into a single dict
-    context = dict(threads=dict(column=post_cols, rows=posts),
-                   users=dict(column=user_cols, rows=users),
-                   votes=dict(column=votes_cols, rows=votes),
-                   subs=dict(column=subs_cols, rows=subs))
+            yield dict(threads=dict(column=post_cols, rows=posts),
+                       users=dict(column=user_cols, rows=users),
+                       votes=dict(column=votes_cols, rows=votes),
+                       subs=dict(column=subs_cols, rows=subs))
+    finally:
+        threads.close()
+        cursor.close()
 
-    threads = [r for r in posts if r[0] == r[1]]
-    logger.info(f"Start\t{start.date()}")
-    logger.info(f"End\t{end.date()}")
-    logger.info(f"Number of total posts \t{len(posts)}")
-    logger.info(f"Number of threads \t{len(threads)}")
-    logger.info(f"Number of votes \t{len(votes)}")
-    logger.info(f"Number of subscriptions \t{len(subs)}")
-    logger.info(f"Number of users \t{len(users)}")
 
-    return context
+def count_rows(data):
+    return sum(len(data.get(key, {}).get('rows', [])) for key in ('threads', 'users', 'votes', 'subs'))
 
 
-@timer
 def sync_posts(threads, users, update=True):
     """
     Update local database with posts in 'threads'.
@@ -461,7 +487,7 @@ def sync_posts(threads, users, update=True):
         # Post.objects.bulk_update(objs=updator, batch_size=500)
         pass
     else:
-        logger.info("Skipped updates.")
+        logger.debug("Skipped updates.")
 
     # Update the root, parent relationships in the queried posts
     Post.objects.bulk_update(objs=bulk_relations(relations=relations),
@@ -473,107 +499,276 @@ def sync_posts(threads, users, update=True):
                              batch_size=1000)
 
 
-@timer
 def sync_users(users):
     """
-    Sync users one at a time instead of bulk creating.
+    Create the missing users and their profiles in bulk.
+    Users synced before get their score and last login updated.
+    Returns the local users by remote user id.
     """
     # Get the column names
-    column = users.get('column')
-    rows = users.get('rows', [])
-    added = dict()
-    # Check if this user already exists.
+    column = users.get('column', [])
+    rows = [{col: val for col, val in zip(column, row)} for row in users.get('rows', [])]
+
+    # Remote users sharing an email map to a single local user, created from the first of them.
+    emails = {}
     for row in rows:
+        emails.setdefault(row['email'], row)
 
-        # Map column names to row.
-        row = {col: val for col, val in zip(column, row)}
-        # Skip if user exists.
-        user = User.objects.filter(email=row['email']).first()
-        if user:
-            added[row['user_id']] = user
-            continue
+    found = {user.email: user for user in User.objects.filter(email__in=emails).select_related('profile')}
 
-        # Create the user
-        username = f"{row['name'].replace(' ', '-')}-{row['user_id']}"
-        user = User.objects.create(username=username, email=row['email'],
-                                   password=row['password'], is_active=row['is_active'],
+    # Create the users, then the profiles.
+    missing = [row for email, row in emails.items() if email not in found]
+    User.objects.bulk_create([User(username=f"{row['name'].replace(' ', '-')}-{row['user_id']}",
+                                   email=row['email'], password=row['password'], is_active=row['is_active'],
                                    is_staff=row['is_staff'], is_superuser=row['is_admin'])
+                              for row in missing], batch_size=500, ignore_conflicts=True)
+
+    created = User.objects.filter(email__in=[row['email'] for row in missing])
+    created = {user.email: user for user in created}
+
+    profiles = []
+    for email, user in created.items():
+        row = emails[email]
         text = util.strip_tags(row['info'])
-        # Update the Profile
-        Profile.objects.filter(user=user).update(digest_prefs=row['digest_prefs'],
-                                                 watched_tags=row['watched_tags'],
-                                                 twitter=row['twitter_id'],
-                                                 uid=row['user_id'], name=row['name'],
-                                                 message_prefs=row['message_prefs'],
-                                                 role=row['type'], last_login=row['last_login'],
-                                                 html=row['info'], date_joined=row['date_joined'],
-                                                 location=row['location'], website=row['website'],
-                                                 scholar=row['scholar'], text=text,
-                                                 score=row['score'], my_tags=row['my_tags'],
-                                                 new_messages=row['new_messages'])
-        added[row['user_id']] = user
-
-    logger.info(f"Updated {len(rows)} users.")
+        profiles.append(Profile(user=user, digest_prefs=row['digest_prefs'], watched_tags=row['watched_tags'],
+                                twitter=row['twitter_id'], uid=row['user_id'], name=row['name'],
+                                message_prefs=row['message_prefs'], role=row['type'], last_login=row['last_login'],
+                                html=row['info'], date_joined=row['date_joined'], location=row['location'],
+                                website=row['website'], scholar=row['scholar'], text=text, score=row['score'],
+                                my_tags=row['my_tags'], new_messages=row['new_messages']))
+
+    Profile.objects.bulk_create(profiles, batch_size=500, ignore_conflicts=True)
+
+    # Update the users synced in an earlier run.
+    synced = []
+    for row in rows:
+        user = found.get(row['email'])
+        profile = getattr(user, 'profile', None)
+        if profile and profile.uid == str(row['user_id']):
+            profile.score, profile.last_login = row['score'], row['last_login']
+            synced.append(profile)
+
+    Profile.objects.bulk_update(synced, fields=['score', 'last_login'], batch_size=500)
+
+    found.update(created)
+    added = {row['user_id']: found[row['email']] for row in rows if row['email'] in found}
+
     return added
 
 
-@psycopg_required
-@timer
-def sync_db(start=None, days=1, options=dict()):
-    # Create initial connection to database
-    conn = psycopg2.connect(dbname=options['dbname'],
+def sync_chunk(data, update=True):
+    """
+    Sync a chunk of retrieved rows, users fist.
+    """
+    users = sync_users(users=data.get('users', {}))
+
+    # Then sync posts, votes, and subscriptions.
+    sync_posts(data.get('threads', {}), users=users, update=update)
+
+    sync_votes(data.get('votes', {}), users=users)
+
+    sync_subs(data.get('subs', {}), users=users)
+
+
+def connect(options):
+    return psycopg2.connect(dbname=options['dbname'],
                             host=options['host'],
                             user=options['user'],
                             password=options['password'],
                             port=options['port'],
                             sslmode='require')
-    # Get the cursor.
-    cur = conn.cursor()
 
-    # Get the start date from input or cache.
-    # If none are provided, now() is returned.
-    start = start or get_start(days=days, cursor=cur)
 
-    update = options['update']
+def split_range(start, end, parts):
+    """
+    Split the date range into consecutive shards.
+    """
+    step = (end - start) / parts
+    return [(start + step * index, start + step * (index + 1)) for index in range(parts)]
 
-    # Get all relevant data within a given timespan
-    # data is a dict with threads, users, etc.
-    data = retrieve(cursor=cur, start=start, days=days)
 
-    users = data.get('users', {})
-    threads = data.get('threads', {})
-    votes = data.get('votes', {})
-    subs = data.get('subs', {})
+def fetch_shard(args):
+    """
+    Retrieve the chunks of a shard on its own connection and write them to a spool file.
+    Runs in a worker process, returns the path of the file.
+    """
+    options, start, end, size, path = args
+    conn = connect(options)
+    try:
+        with open(path, 'wb') as fp:
+            for data in retrieve(conn=conn, start=start, end=end, size=size):
+                pickle.dump(data, fp, protocol=pickle.HIGHEST_PROTOCOL)
+    finally:
+        conn.close()
 
-    # Sync users fist
-    synced_users = sync_users(users=users)
+    return path
 
-    # Then sync posts, votes, and subscriptions, and awards.
-    sync_posts(threads, users=synced_users, update=update)
 
-    sync_votes(votes, users=synced_users)
+def read_spool(path):
+    """
+    Yield the chunks of a spool file one at a time.
+    """
+    with open(path, 'rb') as fp:
+        while True:
+            try:
+                yield pickle.load(fp)
+            except EOFError:
+                return
 
-    sync_subs(subs, users=synced_users)
 
-    return
+def merge(shards, seen=None):
+    """
+    Yield the chunks of the shards in order, without the threads found in earlier shards.
+    A thread changed in several shards is retrieved by each of them, with all of its posts.
+    """
+    seen = set() if seen is None else seen
+    for chunks in shards:
+        for data in chunks:
+            threads, votes, subs = data['threads'], data['votes'], data['subs']
+
+            rows = [row for row in threads['rows'] if row[0] not in seen]
+            if not rows:
+                continue
+
+            ids = {row[0] for row in rows}
+            seen.update(ids)
+
+            vote_post = votes['column'].index('post_id') if votes['rows'] else 0
+            sub_post = subs['column'].index('post_id') if subs['rows'] else 0
+
+            yield dict(data, threads=dict(threads, rows=rows),
+                       votes=dict(votes, rows=[row for row in votes['rows'] if row[vote_post] in ids]),
+                       subs=dict(subs, rows=[row for row in subs['rows'] if row[sub_post] in ids]))
+
+
+def store_shard(end):
+    """
+    Store the date up to which the shards of the range are synced.
+    """
+    Sync.objects.filter(pk=1).update(done=end)
+
+
+@timer
+def sync_parallel(start=None, days=1, options=dict()):
+    """
+    Retrieve the shards of the date range in a pool of processes, then store them in order.
+    Roots and parents are stored before their children, as each shard holds whole threads.
+    The workers spool the shards to files, the chunks are read back one at a time.
+    """
+    workers = options['parallel']
+    size = options.get('chunk') or settings.SYNC_CHUNK_SIZE
+
+    conn = connect(options)
+    try:
+        start, end, last_id = get_range(start=start, days=days, cursor=conn.cursor())
+    finally:
+        conn.close()
+
+    # The shards stored by an interrupted run are skipped.
+    done = Sync.objects.get(pk=1).done
+    if done:
+        logger.info(f"Resuming after {done}")
+
+    shards = split_range(done or start, end, parts=workers * settings.SYNC_SHARDS_PER_WORKER)
+    logger.info(f"Syncing {start.date()} to {end.date()} in {len(shards)} shards with {workers} processes")
+
+    # The worker processes must not share the database connections.
+    connections.close_all()
+
+    spool = tempfile.mkdtemp(prefix="sync-")
+    begin = time.time()
+    total = 0
+    seen = set()
+
+    try:
+        with multiprocessing.Pool(processes=workers) as pool:
+            args = [(options, first, last, size, os.path.join(spool, f"shard-{index}"))
+                    for index, (first, last) in enumerate(shards)]
+            paths = pool.imap(fetch_shard, args)
+
+            for (first, last), path in zip(shards, paths):
+                for data in merge([read_spool(path)], seen=seen):
+                    with transaction.atomic():
+                        sync_chunk(data, update=options['update'])
+
+                    total += count_rows(data)
+                    rate = total / max(time.time() - begin, 0.001)
+                    logger.info(f"Synced up to thread {data['threads']['rows'][-1][0]}, "
+                                f"{total} rows, {rate:.0f} rows/sec")
+
+                store_shard(last)
+                os.remove(path)
+    finally:
+        shutil.rmtree(spool, ignore_errors=True)
+
+    # Store the last synced date into the database.
+    store_synced_date(start)
+
+    return total
+
+
+@psycopg_required
+@timer
+def sync_db(start=None, days=1, options=dict()):
+
+    # Retrieve the shards of the range in parallel.
+    if options.get('parallel', 0) > 1:
+        return sync_parallel(start=start, days=days, options=options)
+
+    # Create initial connection to database
+    conn = connect(options)
+    try:
+        # Get the date range from the input, the last sync or the unfinished sync.
+        # If none are provided, now() is returned.
+        start, end, last_id = get_range(start=start, days=days, cursor=conn.cursor())
+
+        update = options['update']
+        if last_id:
+            logger.info(f"Resuming after thread {last_id}")
+
+        logger.info(f"Start\t{start.date()}")
+        logger.info(f"End\t{end.date()}")
+
+        begin = time.time()
+        total = 0
+
+        # Each chunk is synced and checkpointed before the next one is read.
+        for data in retrieve(conn=conn, start=start, end=end, last_id=last_id, size=options.get('chunk')):
+            last_id = data['threads']['rows'][-1][0]
+
+            with transaction.atomic():
+                sync_chunk(data, update=update)
+                store_checkpoint(last_id)
+
+            total += count_rows(data)
+            rate = total / max(time.time() - begin, 0.001)
+            logger.info(f"Synced up to thread {last_id}, {total} rows, {rate:.0f} rows/sec")
+
+        # Store the last synced date into the database.
+        store_synced_date(start)
+    finally:
+        conn.close()
+
+    return total
 
 
 @timer
 def db_report(cursor, synced):
 
     # Get a count of all of the posts
-    synced = tuple(synced)
-    nposts = f"SELECT COUNT(*) FROM posts_post WHERE posts_post.id NOT IN {synced}"
+    synced = [int(uid) for uid in synced if uid.isdigit()]
+    nposts = "SELECT COUNT(*) FROM posts_post WHERE posts_post.id <> ALL(%s)"
 
-    cursor.execute(nposts)
+    cursor.execute(nposts, [synced])
     nposts = cursor.fetchone()[0]
 
     # Return the newest post date.
-    newest = f""" SELECT posts_post.creation_date FROM posts_post 
-                       WHERE posts_post.id NOT IN {synced} 
+    newest = """ SELECT posts_post.creation_date FROM posts_post 
+                       WHERE posts_post.id <> ALL(%s) 
                        ORDER BY posts_post.id DESC LIMIT 1"""
-    cursor.execute(newest)
-    newest = cursor.fetchone()[0]
+    cursor.execute(newest, [synced])
+    newest = cursor.fetchone()
+    newest = newest[0] if newest else None
 
     return nposts, newest
 
@@ -582,21 +777,27 @@ def db_report(cursor, synced):
 @timer
 def report(start=None, days=1, options=dict()):
     # Create initial connection to database
-    conn = psycopg2.connect(dbname=options['dbname'],
-                            host=options['host'],
-                            user=options['user'],
-                            password=options['password'],
-                            port=options['port'],
-                            sslmode='require')
+    conn = connect(options)
 
     # Get the cursor.
     cur = conn.cursor()
 
     # Get the start date from input or cache.
     # If none are provided, now() is returned.
-    start = start or get_start(days=days, cursor=cur)
+    start = aware(start or get_start(days=days, cursor=cur))
+    end = start + timedelta(days=days)
+    start, end = sorted([start, end])
 
-    retrieve(cursor=cur, start=start, days=days)
+    # Count the rows of the date range a chunk at a time.
+    counts = dict(threads=0, users=0, votes=0, subs=0)
+    for data in retrieve(conn=conn, start=start, end=end, size=options.get('chunk')):
+        for key in counts:
+            counts[key] += len(data[key]['rows'])
+
+    logger.info(f"Start\t{start.date()}")
+    logger.info(f"End\t{end.date()}")
+    for key, value in counts.items():
+        logger.info(f"Number of {key} \t{value}")
 
     already_synced = Post.objects.old().values_list('uid', flat=True)
 
@@ -2,7 +2,7 @@
 from biostar.accounts.tasks import create_messages
 from biostar.emailer.tasks import send_email
 import time
-from biostar.utils.decorators import spool, timer
+from biostar.utils.decorators import spool, spool_once, timer
 
 
 from django.db.models import Q
@@ -17,16 +17,21 @@ def message(msg, level=0):
     print(f"{msg}")
 
 
-@spool(pass_arguments=True)
-def spam_scoring(post):
+@spool_once(key='post_id')
+def spam_scoring(post_id):
     """
     Score the spam with a slight delay.
     """
     from biostar.forum import spam
+    from biostar.forum.models import Post
 
     # Give spammers the illusion of success with a slight delay
     time.sleep(1)
 
+    post = Post.objects.filter(pk=post_id).first()
+    if not post:
+        return
+
     try:
         # Give this post a spam score and quarantine it if necessary.
         spam.score(post=post)
@@ -47,14 +52,21 @@ def tpatt(tag):
     return patt
 
 
-@spool(pass_arguments=True)
-def notify_watched_tags(post, extra_context):
+@spool_once(key='post_id')
+def notify_watched_tags(post_id):
     """
     Notify users watching a given tag found in post.
     """
     from biostar.accounts.models import User
+    from biostar.forum.models import Post
     from django.conf import settings
 
+    post = Post.objects.filter(pk=post_id).select_related('root', 'author__profile').first()
+    if not post:
+        return
+
+    extra_context = dict(post=post)
+
     users = [User.objects.filter(profile__watched_tags__iregex=tpatt(tag.name)).distinct()
              for tag in post.root.tags.all()]
 
@@ -73,17 +85,20 @@ def notify_watched_tags(post, extra_context):
     return
 
 
-@spool(pass_arguments=True)
-def update_spam_index(post):
+@spool_once(key='post_id')
+def update_spam_index(post_id):
     """
     Update spam index with this post.
     """
     from biostar.forum import spam
+    from biostar.forum.models import Post
+
+    post = Post.objects.filter(pk=post_id).first()
 
     # Index posts explicitly marked as SPAM or NOT_SPAM
     # indexing SPAM increases true positives.
     # indexing NOT_SPAM decreases false positives.
-    if not (post.is_spam or post.not_spam):
+    if not post or not (post.is_spam or post.not_spam):
         return
 
     # Update the spam index with most recent spam posts
@@ -93,6 +108,55 @@ def update_spam_index(post):
         message(exc)
 
 
+@spool(pass_arguments=True)
+def verify_crawler(ip):
+    """
+    Verify that the ip belongs to a whitelisted domain and cache the answer.
+    """
+    from django.conf import settings
+    from django.core.cache import caches
+    from biostar.forum import const
+    from biostar.forum.middleware import domain_is_whitelisted
+
+    shared = caches['shared']
+    key = f"{const.CRAWLER_CACHE_KEY}-{ip}"
+    try:
+        verified = domain_is_whitelisted(ip)
+        ttl = settings.CRAWLER_CACHE_SECONDS if verified else settings.CRAWLER_RETRY_SECONDS
+        shared.set(key, verified, ttl)
+    finally:
+        # Allows the next request to verify the ip again once the answer expires.
+        shared.delete(f"{key}-PENDING")
+
+
+@spool_once(key='post_id')
+def resolve_embeds(post_id):
+    """
+    Fetch the embeds the post is waiting for then render the post again.
+    """
+    from biostar.forum.models import Post, EmbedCache
+    from biostar.forum import markdown
+
+    post = Post.objects.filter(pk=post_id).first()
+    if not post:
+        return
+
+    urls = markdown.pending_embeds(post.html)
+    if not urls:
+        return
+
+    # Skip the links another task has already fetched.
+    fresh = [e.url for e in EmbedCache.objects.filter(url__in=urls) if e.is_fresh]
+
+    for url in set(urls) - set(fresh):
+        markdown.fetch_embed(url)
+
+    html = markdown.parse(post.content, post=post, clean=True, escape=False)
+
+    # Updating avoids the post save signals.
+    Post.objects.filter(pk=post.pk).update(html=html)
+
+
 @spool(pass_arguments=True)
 def created_post(pid):
     message(f"Created post={pid}")
@@ -138,46 +202,59 @@ def created_post(pid):
 
 @spool(pass_arguments=True)
 def create_user_awards(user_id):
+    """
+    Check the awards queued for the user.
+    """
+    from biostar.forum import awards
 
-    from biostar.accounts.models import User
-    from biostar.forum.models import Award, Badge, Post
-    from biostar.forum.awards import ALL_AWARDS
+    # Profile edits send no events, check them on login.
+    awards.enqueue(users=[user_id], event=awards.PROFILE)
 
-    user = User.objects.filter(id=user_id).first()
+    for award in awards.process_queue(users=[user_id]):
+        message("award %s created for %s" % (award.badge.name, award.user.email))
 
-    # debugging
-    # Award.objects.all().delete()
 
-    for award in ALL_AWARDS:
-        # Valid award targets the user has earned
-        targets = award.validate(user)
+@timer(secs=3600)
+def update_stats(*args):
+    """
+    Store the daily statistics of the days that have ended
+    and refresh the tag counts of the current and previous month.
+    """
+    from biostar.forum import api
 
-        for target in targets:
-            date = user.profile.last_login
-            post = target if isinstance(target, Post) else None
-            badge = Badge.objects.filter(name=award.name).first()
+    api.update_stats()
+    api.rollup_tags(months=2)
 
-            # Do not award a post multiple times.
-            already_awarded = Award.objects.filter(user=user, badge=badge, post=post).exists()
-            if post and already_awarded:
-                continue
 
-            # Create an award for each target.
-            Award.objects.create(user=user, badge=badge, date=date, post=post)
+@timer(secs=60)
+def check_awards(*args):
+    """
+    Check the award rules queued by the events of all users.
+    """
+    from biostar.forum import awards
 
-            message("award %s created for %s" % (badge.name, user.email))
+    awards.process_queue()
 
 
-@spool(pass_arguments=True)
-def mailing_list(users, post, extra_context={}):
+@spool_once(key='post_id')
+def mailing_list(post_id):
     """
     Generate notification for mailing list users.
     """
     from django.conf import settings
+    from biostar.accounts.models import Profile, User
+    from biostar.forum.models import Post
+
+    post = Post.objects.filter(pk=post_id).select_related('author__profile').first()
+    if not post:
+        return
+
+    users = User.objects.filter(profile__digest_prefs=Profile.ALL_MESSAGES)
+    extra_context = dict(post=post)
 
     # Prepare the templates and emails
     email_template = "messages/mailing_list.html"
-    emails = [user.email for user in users]
+    emails = list(users.values_list('email', flat=True))
     author = post.author.profile.name
     from_email = settings.DEFAULT_NOREPLY_EMAIL
 
@@ -189,47 +266,44 @@ def mailing_list(users, post, extra_context={}):
                mass=True)
 
 
-@spool(pass_arguments=True)
-def notify_followers(subs, author, extra_context={}):
+@spool_once(key=('post_id', 'created'))
+def notify_followers(post_id, created=False):
     """
-    Generate notification to users subscribed to a post, excluding author, a message/email.
+    Queue the notifications to the users subscribed to a post, excluding author.
+    Edits only notify the users subscribed since the last edit.
+    The new posts of a thread are sent together by flush_notifications.
     """
-    from biostar.forum.models import Subscription
-    from biostar.accounts.models import Profile
     from django.conf import settings
+    from biostar.forum import outbox
+    from biostar.forum.models import Post, Subscription
+
+    post = Post.objects.filter(pk=post_id).first()
+    if not post:
+        return
 
-    # Template used to send local messages
-    local_template = "messages/subscription_message.md"
+    subs = Subscription.objects.filter(post_id=post.root_id)
+    if not created:
+        subs = subs.filter(date__gte=post.lastedit_date)
 
-    # Template used to send emails with
-    email_template = "messages/subscription_email.html"
+    # Exclude current authors from receiving messages from themselves
+    subs = subs.exclude(Q(type=Subscription.NO_MESSAGES) | Q(user_id=post.author_id))
 
     # Does not have subscriptions.
-    if not subs:
+    if not subs.exists():
         return
 
-    users = [sub.user for sub in subs]
-    # Every subscribed user gets local messages with any subscription type.
-    create_messages(template=local_template,
-                    extra_context=extra_context,
-                    rec_list=users,
-                    sender=author)
+    outbox.enqueue(subs=subs, post=post)
 
-    # Select users with email subscriptions.
-    # Exclude mailing list users to avoid duplicate emails.
-    email_subs = subs.filter(type=Subscription.EMAIL_MESSAGE)
-    email_subs = email_subs.exclude(user__profile__digest_prefs=Profile.ALL_MESSAGES)
+    # Send right away when the posts are not coalesced.
+    if not settings.NOTIFY_WINDOW_SECONDS:
+        outbox.flush(window=0)
 
-    # No email subscriptions
-    if not email_subs:
-        return
 
-    recipient_list = [sub.user.email for sub in email_subs]
-    from_email = settings.DEFAULT_NOREPLY_EMAIL
+@timer(secs=60)
+def flush_notifications(*args):
+    """
+    Send the queued notifications of the threads that waited long enough.
+    """
+    from biostar.forum import outbox
 
-    send_email(template_name=email_template,
-               extra_context=extra_context,
-               name=author.profile.name,
-               from_email=from_email,
-               recipient_list=recipient_list,
-               mass=True)
+    outbox.flush()
@@ -22,8 +22,9 @@ from django.core.paginator import Paginator
 from django.core.cache import cache
 
 from biostar.forum import markdown
+from biostar.utils import identity, metrics
 from biostar.accounts.models import Profile, Message
-from biostar.forum import const, auth
+from biostar.forum import const, auth, util
 from biostar.forum.models import Post, Vote, Award, Subscription
 
 User = get_user_model()
@@ -113,6 +114,55 @@ def post_details(post, user, avatar=True):
     return dict(post=post, user=user, avatar=avatar)
 
 
+def post_row_key(post, user, avatar):
+    """
+    Cache key of a rendered post row, changes with any value displayed in the row.
+    """
+    author, editor = post.author.profile, post.lastedit_user.profile
+    is_moderator = user.is_authenticated and user.profile.is_moderator
+
+    # Scores and views are displayed in buckets, dates as the time elapsed.
+    state = (post.lastedit_date.timestamp(), post.title, post.tag_val, post.type, post.status, post.spam,
+             post.spam_score, post.get_votecount, post.reply_count, post.subs_count, bignum(post.root.view_count),
+             post.root.answer_count, post.root.accept_count,
+             time_ago(post.creation_date), time_ago(post.lastedit_date),
+             author.name, post.author.email, bignum(author.get_score()), author.state, author.role, author.low_rep,
+             editor.name, post.lastedit_user.email, bignum(editor.get_score()), editor.state, editor.role,
+             is_moderator, avatar)
+
+    digest = hashlib.md5(str(state).encode('utf-8')).hexdigest()
+
+    return f"{const.POST_ROW_CACHE_KEY}-{post.uid}-{digest}"
+
+
+@register.simple_tag
+def post_rows(posts, user, avatar=True):
+    """
+    Renders the rows of a post list, only the rows that changed are rendered again.
+    """
+    posts = list(posts)
+    keys = [post_row_key(post=post, user=user, avatar=avatar) for post in posts]
+
+    # Fetch all rendered rows at once.
+    cached = cache.get_many(keys)
+    metrics.record_cache(hit=True, count=len(cached))
+    metrics.record_cache(hit=False, count=len(keys) - len(cached))
+
+    body = template.loader.get_template('widgets/post_details.html')
+    rows, missing = [], {}
+    for key, post in zip(keys, posts):
+        html = cached.get(key)
+        if html is None:
+            html = body.render(dict(post=post, user=user, avatar=avatar))
+            missing[key] = html
+        rows.append(html)
+
+    if missing:
+        cache.set_many(missing, settings.POST_ROW_CACHE_SECONDS)
+
+    return mark_safe("\n".join(rows))
+
+
 @register.simple_tag
 def post_type_display(post_type):
     mapper = dict(Post.TYPE_CHOICES)
@@ -125,9 +175,9 @@ def now():
 
 @register.simple_tag
 def gravatar(user=None, user_uid=None, size=80):
-    hasattr(user, 'profile')
-    if user_uid and hasattr(user, 'profile'):
-        user = User.objects.filter(profile__uid=user_uid).first()
+    if user_uid and not user:
+        profile = identity.get(Profile, uid=user_uid)
+        user = profile.user if profile else None
 
     return auth.gravatar(user=user, size=size)
 
@@ -175,7 +225,7 @@ def post_user_line(context, post, avatar=False, user_info=True):
 
 @register.inclusion_tag('widgets/post_user_line.html', takes_context=True)
 def postuid_user_line(context, uid, avatar=True, user_info=True):
-    post = Post.objects.filter(uid=uid).first()
+    post = identity.get(Post, uid=uid)
 
     context.update(dict(post=post, avatar=avatar, user_info=user_info))
     return context
@@ -206,7 +256,7 @@ def post_actions(context, post, label="ADD COMMENT", author=None, lastedit_user=
 def post_tags(post=None, post_uid=None, show_views=False, tags_str='', spaced=True):
 
     if post_uid:
-        post = Post.objects.filter(uid=post_uid).first()
+        post = identity.get(Post, uid=post_uid)
 
     tags = tags_str.split(",") if tags_str else ''
     tags = post.tag_val.split(",") if post else tags
@@ -483,9 +533,10 @@ def get_post_list(target, request, show=None):
     return posts
 
 
-@register.inclusion_tag('widgets/feed_default.html')
-def default_feed(user):
-
+def feed_context():
+    """
+    The recent activity displayed in the sidebar.
+    """
     recent_votes = Vote.objects.filter(post__status=Post.OPEN,
                                        post__root__status=Post.OPEN).prefetch_related("post")
     recent_votes = recent_votes.order_by("-pk")[:settings.VOTE_FEED_COUNT]
@@ -503,12 +554,27 @@ def default_feed(user):
     recent_replies = recent_replies.order_by("-pk")[:settings.REPLIES_FEED_COUNT]
 
     context = dict(recent_votes=recent_votes, recent_awards=recent_awards, users=[],
-                   recent_locations=recent_locations, recent_replies=recent_replies,
-                   user=user)
+                   recent_locations=recent_locations, recent_replies=recent_replies)
 
     return context
 
 
+@register.simple_tag
+def default_feed(user=None):
+    """
+    Renders the sidebar activity feed. The feed is the same for all users,
+    it is cached and refreshed by a single request once it expires.
+    """
+
+    def render():
+        tmpl = template.loader.get_template('widgets/feed_default.html')
+        return tmpl.render(feed_context())
+
+    html = util.refresh_cache(key=const.FEED_CACHE_KEY, func=render, ttl=settings.FEED_CACHE_SECONDS)
+
+    return mark_safe(html)
+
+
 @register.simple_tag
 def planet_gravatar(planet_author):
 
@@ -6,7 +6,8 @@ from django.core import management
 from django.urls import reverse
 from django.test import TestCase, override_settings
 from django.conf import settings
-from biostar.forum import models, api
+from django.utils import timezone
+from biostar.forum import models, api, util
 from biostar.utils.helpers import fake_request
 from biostar.accounts.models import User
 
@@ -60,3 +61,93 @@ class PostAPITest(TestCase):
         #self.process_response(response=response)
 
 
+
+    def test_daily_stats(self):
+        """
+        Test that the backfilled and the incremental statistics agree.
+        """
+        now = util.now()
+        for days in (3, 2, 2):
+            post = models.Post.objects.create(title="Test", author=self.owner, content="Test",
+                                              type=models.Post.QUESTION)
+            models.Post.objects.filter(pk=post.pk).update(creation_date=now - datetime.timedelta(days=days))
+        models.Post.objects.filter(pk=self.post.pk).update(creation_date=now - datetime.timedelta(days=3))
+
+        count = api.backfill()
+        self.assertGreaterEqual(count, 3)
+        backfilled = {s.date: s.as_dict() for s in models.DailyStats.objects.all()}
+
+        # Rebuild the last days from the running totals.
+        models.DailyStats.objects.filter(date__gte=min(backfilled) + datetime.timedelta(days=1)).delete()
+        api.update_stats()
+        incremental = {s.date: s.as_dict() for s in models.DailyStats.objects.all()}
+
+        self.assertEqual(backfilled, incremental)
+
+        # Totals keep adding up.
+        last = incremental[max(incremental)]
+        self.assertEqual(last['questions'], 4)
+        self.assertEqual(len(incremental[min(incremental)]['new_posts']), 2)
+
+        # The api reads a single row.
+        date = now - datetime.timedelta(days=2)
+        with self.assertNumQueries(1):
+            stats = api.compute_stats(date)
+        self.assertEqual(len(stats['new_posts']), 2)
+
+    def test_backfill_missing_days(self):
+        """
+        Test that the history is backfilled when the api stored a recent day first.
+        """
+        now = util.now()
+        models.Post.objects.filter(pk=self.post.pk).update(creation_date=now - datetime.timedelta(days=4))
+
+        yesterday = api.today() - datetime.timedelta(days=1)
+        api.add_day(yesterday)
+
+        api.update_stats()
+        dates = list(models.DailyStats.objects.order_by('date').values_list('date', flat=True))
+
+        self.assertEqual(len(dates), (yesterday - dates[0]).days + 1)
+        self.assertLessEqual(dates[0], yesterday - datetime.timedelta(days=3))
+
+    def test_tags_list(self):
+        """
+        Test that the tag counts are grouped in one query and agree with the monthly counts.
+        """
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        question = models.Post.objects.create(title="Tags", author=self.owner, content="Test",
+                                              tag_val="bwa,samtools", type=models.Post.QUESTION)
+        answer = models.Post.objects.create(title="Answer", author=self.owner, content="Test", parent=question,
+                                            type=models.Post.ANSWER)
+        # Only top level posts are tagged when saved.
+        answer.tags.add(*question.tags.filter(name="bwa"))
+        models.Post.objects.create(title="Other", author=self.owner, content="Test",
+                                   tag_val="bwa", type=models.Post.QUESTION)
+
+        def post_tags(**data):
+            tags = SimpleUploadedFile("tags.txt", b"BWA\nsamtools\n\nmissing\n")
+            response = self.client.post(reverse('api_tags_list'), dict(tags=tags, **data))
+            self.assertEqual(response.status_code, 200)
+            return response.json()
+
+        with self.assertNumQueries(1):
+            data = post_tags(months='1.5')
+
+        self.assertEqual(data['bwa'], dict(total=3, answer_count=1, comment_count=0))
+        self.assertEqual(data['samtools'], dict(total=1, answer_count=0, comment_count=0))
+        self.assertEqual(data['missing'], dict(total=0, answer_count=0, comment_count=0))
+
+        api.rollup_tags(months=1)
+        self.assertEqual(post_tags(rollup='1'), data)
+
+        # Posts edited after their month has been rolled up are not counted again.
+        created = util.now() - datetime.timedelta(days=95)
+        models.Post.objects.filter(pk=question.pk).update(creation_date=created)
+        api.rollup_tags(months=None)
+        api.rollup_tags(months=2)
+
+        counts = models.TagMonthlyCount.objects.filter(name="samtools")
+        self.assertEqual(list(counts.values_list('month', 'total')),
+                         [(timezone.localtime(created).date().replace(day=1), 1)])
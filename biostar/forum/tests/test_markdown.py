@@ -1,8 +1,11 @@
+import json
 import logging
 import os
-from django.test import TestCase
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from django.test import TestCase, override_settings
 from django.conf import settings
-from biostar.forum import models, markdown
+from biostar.forum import models, markdown, tasks
 from biostar.accounts.models import User
 
 logger = logging.getLogger('engine')
@@ -21,8 +24,8 @@ TEST_CASES = [
     # User profile url pattern
     (f"{settings.PROTOCOL}://{SITE_URL}/accounts/profile/5", f'<p><a href="{settings.PROTOCOL}://{SITE_URL}/accounts/profile/5">USER: tested2</a></p>'),
 
-    # Twitter link
-    ("https://twitter.com/Linux/status/2311234267", '<p><blockquote class="twitter-tweet"><p lang="en" dir="ltr">w00t! 10,000 followers!</p>&mdash; Linux (@Linux) <a href="https://twitter.com/Linux/status/2311234267?ref_src=twsrc%5Etfw">June 24, 2009</a></blockquote><script async src="https://platform.twitter.com/widgets.js" charset="utf-8"></script></p>'),
+    # Twitter link, a placeholder until the embed is fetched.
+    ("https://twitter.com/Linux/status/2311234267", '<p><a href="https://twitter.com/Linux/status/2311234267" data-embed="https://twitter.com/Linux/status/2311234267">https://twitter.com/Linux/status/2311234267</a></p>'),
 
     # Youtube link
     ("https://www.youtube.com/watch?v=dQw4w9WgXcQ", '<p><iframe width="420" height="315" src="//www.youtube.com/embed/dQw4w9WgXcQ" frameborder="0" allowfullscreen></iframe></p>'),
@@ -91,4 +94,185 @@ class MarkdownTest(TestCase):
 
             html = markdown.parse(given, clean=True, escape=False)
             html = html.replace("\n", "")
-            self.assertEqual(html, expected, f"Error with markdown parsing. input={given}, expected={expected}, html={html}")
\ No newline at end of file
+            self.assertEqual(html, expected, f"Error with markdown parsing. input={given}, expected={expected}, html={html}")
+
+    def test_batched_links(self):
+        """
+        Test that links are resolved with one query per model.
+        """
+        from django.core.cache import cache
+        cache.clear()
+
+        text = "\n\n".join([
+            f"{settings.PROTOCOL}://{SITE_URL}/p/1/",
+            f"{settings.PROTOCOL}://{SITE_URL}/p/1/#2",
+            f"{settings.PROTOCOL}://{SITE_URL}/p/3/",
+            f"{settings.PROTOCOL}://{SITE_URL}/accounts/profile/5",
+            "@test",
+        ])
+
+        with self.assertNumQueries(3):
+            html = markdown.parse(text, clean=True, escape=False)
+
+        self.assertIn('>Test</a>', html)
+        self.assertIn('Invalid post uid: 3', html)
+        self.assertIn('USER: tested2', html)
+
+        # Unchanged text is served from the cache.
+        self.assertEqual(markdown.parse(text, clean=True, escape=False), html)
+
+        # Changing a link target renders the text again.
+        models.Post.objects.filter(uid="1").update(title="Changed")
+        html = markdown.parse(text, clean=True, escape=False)
+        self.assertIn('>Changed</a>', html)
+
+
+TWEET_HTML = '<blockquote class="twitter-tweet">w00t!</blockquote>'
+
+
+class OEmbedHandler(BaseHTTPRequestHandler):
+    """
+    Stands in for the oEmbed endpoint, tweets ending in 0 are not found.
+    """
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        if self.path.endswith('0'):
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = json.dumps(dict(html=TWEET_HTML)).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class EmbedTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = HTTPServer(('127.0.0.1', 0), OEmbedHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.endpoint = f"http://127.0.0.1:{cls.server.server_port}/oembed"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        logger.setLevel(logging.WARNING)
+        OEmbedHandler.requests.clear()
+        self.owner = User.objects.create(username="test", email="tested2@tested.com", password="tested")
+
+    def create_post(self, content):
+        post = models.Post.objects.create(title="Test", author=self.owner, content=content,
+                                          type=models.Post.QUESTION)
+        return post
+
+    def test_embed(self):
+        """
+        Test that tweets are fetched out of band and the posts rendered again.
+        """
+        url = "https://twitter.com/Linux/status/2311234267"
+
+        with override_settings(TWITTER_OEMBED_URL=self.endpoint, DISABLE_TASKS=True):
+            post = self.create_post(content=url)
+            other = self.create_post(content=f"Also {url}")
+
+        # Saving the post does not touch the network.
+        self.assertEqual(OEmbedHandler.requests, [])
+        self.assertEqual(markdown.pending_embeds(post.html), [url])
+
+        with override_settings(TWITTER_OEMBED_URL=self.endpoint):
+            tasks.resolve_embeds(post_id=post.pk)
+
+        post.refresh_from_db()
+        self.assertIn(TWEET_HTML, post.html)
+        self.assertEqual(markdown.pending_embeds(post.html), [])
+
+        # Only the given post is rendered again, the other one waits for its own task.
+        other.refresh_from_db()
+        self.assertEqual(markdown.pending_embeds(other.html), [url])
+
+        with override_settings(TWITTER_OEMBED_URL=self.endpoint):
+            tasks.resolve_embeds(post_id=other.pk)
+
+        # The embed is fetched once.
+        self.assertEqual(len(OEmbedHandler.requests), 1)
+        other.refresh_from_db()
+        self.assertIn(TWEET_HTML, other.html)
+
+        # Later saves use the stored embed.
+        post.save()
+        self.assertIn(TWEET_HTML, post.html)
+        self.assertEqual(len(OEmbedHandler.requests), 1)
+
+    def test_missing_embed(self):
+        """
+        Test that failed fetches are cached and shown as links.
+        """
+        url = "https://twitter.com/Linux/status/2311234260"
+
+        with override_settings(TWITTER_OEMBED_URL=self.endpoint):
+            post = self.create_post(content=url)
+            tasks.resolve_embeds(post_id=post.pk)
+
+        self.assertEqual(len(OEmbedHandler.requests), 1)
+        self.assertEqual(models.EmbedCache.objects.get(url=url).html, '')
+
+        post.refresh_from_db()
+        self.assertIn(f'<a href="{url}">{url}</a>', post.html)
+        self.assertEqual(markdown.pending_embeds(post.html), [])
+
+
+class RerenderTest(TestCase):
+
+    def setUp(self):
+        logger.setLevel(logging.WARNING)
+        self.owner = User.objects.create(username="test", email="tested2@tested.com", password="tested")
+        self.posts = [models.Post.objects.create(title="Test", author=self.owner, content=f"**Post {i}**",
+                                                 type=models.Post.QUESTION) for i in range(3)]
+        self.checkpoint = os.path.join(settings.MEDIA_ROOT, 'test-rerender.checkpoint')
+        self.addCleanup(lambda: os.path.isfile(self.checkpoint) and os.remove(self.checkpoint))
+
+    def test_rerender(self):
+        """
+        Test that the html is rendered again and the checkpoint is honored.
+        """
+        from django.core import management
+
+        from django.core.cache import cache
+
+        models.Post.objects.update(html="stale")
+
+        # The html cached by an older renderer is not reused.
+        text = self.posts[1].content
+        key = markdown.html_key(text, None, markdown.resolve_targets(text), clean=True, escape=False,
+                                allow_rewrite=False)
+        cache.set(key, "stale")
+
+        dates = list(models.Post.objects.order_by('pk').values_list('lastedit_date', flat=True))
+
+        # Resume after the first post.
+        with open(self.checkpoint, 'w') as fp:
+            fp.write(str(self.posts[0].pk))
+
+        management.call_command('rerender', workers=1, batch=2, checkpoint=self.checkpoint, resume=True)
+
+        html = list(models.Post.objects.order_by('pk').values_list('html', flat=True))
+        self.assertEqual(html[0], "stale")
+        self.assertEqual(html[1:], ["<p><strong>Post 1</strong></p>\n", "<p><strong>Post 2</strong></p>\n"])
+
+        # Saves were bypassed.
+        self.assertEqual(list(models.Post.objects.order_by('pk').values_list('lastedit_date', flat=True)), dates)
+
+        with open(self.checkpoint) as fp:
+            self.assertEqual(int(fp.read()), self.posts[-1].pk)
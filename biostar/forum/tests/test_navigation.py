@@ -1,5 +1,5 @@
 import logging, os
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.test import Client
 from django.core import management
 from biostar.forum import auth, models
@@ -83,3 +83,261 @@ class ForumNavigation(TestCase):
 
 
 
+
+class AnonymousCache(TestCase):
+
+    def setUp(self):
+        logger.setLevel(logging.WARNING)
+
+        self.owner = User.objects.create(username=f"tested{get_uuid(10)}", email="tested@tested.com")
+        self.owner.set_password("tested")
+        self.owner.save()
+        self.post = models.Post.objects.create(title="Test", author=self.owner, content="Test",
+                                               type=models.Post.QUESTION)
+
+    def test_cookieless_pages(self):
+        "Anonymous pages set no cookies and are cacheable"
+
+        urls = [
+            reverse("post_list"),
+            reverse('tags_list'),
+            reverse('post_view', kwargs=dict(uid=self.post.uid)),
+            reverse('latest_feed'),
+        ]
+        c = Client()
+        for url in urls:
+            resp = c.get(url)
+            self.assertEqual(resp.status_code, 200)
+            self.assertFalse(resp.cookies, f"Cookies set on anonymous page: {url}")
+            self.assertIn('public', resp['Cache-Control'])
+            self.assertIn('Cookie', resp['Vary'])
+
+    def test_user_pages(self):
+        "Authenticated pages are not shared"
+
+        c = Client()
+        c.login(username=self.owner.username, password='tested')
+        resp = c.get(reverse("post_list"))
+        self.assertNotIn('public', resp.get('Cache-Control', ''))
+        self.assertIn('csrftoken', resp.cookies)
+
+    def test_csrf_token(self):
+        "The token is handed out over ajax"
+
+        c = Client()
+        resp = c.get(reverse("ajax_csrf"))
+        self.assertEqual(resp.json()['status'], 'success')
+        self.assertIn('csrftoken', resp.cookies)
+
+
+class FragmentCache(TestCase):
+
+    def setUp(self):
+        logger.setLevel(logging.WARNING)
+        self.owner = User.objects.create(username=f"tested{get_uuid(10)}", email="tested@tested.com")
+        self.post = models.Post.objects.create(title="Test", author=self.owner, content="Test",
+                                               type=models.Post.QUESTION)
+
+    def test_row_key(self):
+        "Row keys change with the displayed values"
+        from datetime import timedelta
+        from django.contrib.auth.models import AnonymousUser
+        from biostar.forum.templatetags import forum_tags
+
+        user = AnonymousUser()
+        post = models.Post.objects.get(pk=self.post.pk)
+        key = forum_tags.post_row_key(post=post, user=user, avatar=True)
+        html = forum_tags.post_rows(posts=[post], user=user)
+
+        # Rendering again reuses the cached row.
+        self.assertEqual(html, forum_tags.post_rows(posts=[post], user=user))
+        self.assertEqual(key, forum_tags.post_row_key(post=post, user=user, avatar=True))
+
+        post.thread_votecount += 1
+        self.assertNotEqual(key, forum_tags.post_row_key(post=post, user=user, avatar=True))
+
+        # Rescored posts and authors changing rep are styled differently.
+        key = forum_tags.post_row_key(post=post, user=user, avatar=True)
+        post.spam_score += 1
+        self.assertNotEqual(key, forum_tags.post_row_key(post=post, user=user, avatar=True))
+
+        key = forum_tags.post_row_key(post=post, user=user, avatar=True)
+        post.author.profile.score = 0 if post.author.profile.low_rep is False else 10 ** 6
+        self.assertNotEqual(key, forum_tags.post_row_key(post=post, user=user, avatar=True))
+
+        # Renamed authors, new avatars and older dates are displayed.
+        for change in (lambda: setattr(post.author.profile, "name", "Renamed"),
+                       lambda: setattr(post.author, "email", "renamed@tested.com"),
+                       lambda: setattr(post, "creation_date", post.creation_date - timedelta(days=2))):
+            key = forum_tags.post_row_key(post=post, user=user, avatar=True)
+            change()
+            self.assertNotEqual(key, forum_tags.post_row_key(post=post, user=user, avatar=True))
+
+    def test_default_feed(self):
+        "The sidebar is served from the cache"
+        from django.core.cache import cache
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from biostar.forum.templatetags import forum_tags
+
+        cache.clear()
+        html = forum_tags.default_feed()
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(html, forum_tags.default_feed())
+
+        self.assertEqual(len(queries), 0)
+
+
+class IdentityCache(TestCase):
+
+    def setUp(self):
+        logger.setLevel(logging.WARNING)
+        self.owner = User.objects.create(username=f"tested{get_uuid(10)}", email="tested@tested.com")
+        self.post = models.Post.objects.create(title="Test", author=self.owner, content="Test",
+                                               type=models.Post.QUESTION)
+
+    def test_lookups(self):
+        "Repeated lookups do not hit the database"
+        from django.core.signals import request_started, request_finished
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from biostar.utils import identity
+
+        request_started.send(sender=self.__class__)
+        identity.get(models.Post, fresh=True, uid=self.post.uid)
+
+        with CaptureQueriesContext(connection) as queries:
+            identity.get(models.Post, uid=self.post.uid)
+            identity.get(models.Post, fresh=True, uid=self.post.uid)
+
+        self.assertEqual(len(queries), 0)
+        request_finished.send(sender=self.__class__)
+
+        # Saving drops the cached copy.
+        self.post.title = "Changed"
+        self.post.save()
+        post = identity.get(models.Post, uid=self.post.uid)
+        self.assertEqual(post.title, "Changed")
+
+
+@override_settings(METRICS_FLUSH_SECONDS=0)
+class RequestTimings(TestCase):
+
+    def setUp(self):
+        logger.setLevel(logging.WARNING)
+
+        self.owner = User.objects.create(username=f"tested{get_uuid(10)}", email="tested@tested.com",
+                                         is_staff=True)
+        self.owner.set_password("tested")
+        self.owner.save()
+
+    def test_metrics(self):
+        """
+        Test that requests are timed per view and exposed to staff only.
+        """
+        from io import StringIO
+        from django.core.cache import caches
+        from biostar.utils import metrics
+
+        self.client.get(reverse('post_list'))
+
+        counts = metrics.collect()['post_list']
+        self.assertGreaterEqual(counts['count'], 1)
+        self.assertGreater(counts['queries'], 0)
+
+        # The counts are kept where the other processes see them.
+        stored = caches['shared'].get(metrics.COUNTS_KEY)
+        self.assertEqual(stored['post_list']['count'], counts['count'])
+
+        response = self.client.get(reverse('api_metrics'))
+        self.assertEqual(response.status_code, 403)
+
+        self.client.login(username=self.owner.username, password="tested")
+        response = self.client.get(reverse('api_metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('biostar_request_duration_seconds_bucket{view="post_list",le="+Inf"}', response.content.decode())
+
+        out = StringIO()
+        management.call_command('timings', stdout=out)
+        self.assertIn('post_list', out.getvalue())
+
+    def test_percentile(self):
+        """
+        Test the percentile estimates from the buckets.
+        """
+        from biostar.utils import metrics
+
+        counts = dict.fromkeys(metrics.bucket_names(), 0)
+        counts['le10'], counts['le25'] = 50, 50
+
+        self.assertEqual(metrics.percentile(counts, 0.5), 10)
+        self.assertAlmostEqual(metrics.percentile(counts, 0.99), 24.7)
+
+
+@override_settings(MAX_VISITS=2)
+class BanIp(TestCase):
+
+    def setUp(self):
+        from django.core.cache import cache
+        logger.setLevel(logging.WARNING)
+        cache.clear()
+
+    def visits(self, ip, n=3):
+        url = reverse('post_list')
+        return [self.client.get(url, REMOTE_ADDR=ip).status_code for i in range(n)]
+
+    def test_ban(self):
+        """
+        Test that frequent visitors are banned unless verified as crawlers.
+        """
+        from django.core.cache import caches
+        from biostar.forum import const
+
+        caches['shared'].set(f"{const.CRAWLER_CACHE_KEY}-10.0.0.5", False)
+        caches['shared'].set(f"{const.CRAWLER_CACHE_KEY}-10.0.1.5", True)
+
+        self.assertEqual(self.visits("10.0.0.5"), [200, 200, 302])
+        self.assertEqual(self.visits("10.0.1.5"), [200, 200, 200])
+
+        # Clients are banned while the lookup is pending.
+        with override_settings(DISABLE_TASKS=True):
+            self.assertEqual(self.visits("10.0.2.5"), [200, 200, 302])
+
+    def test_verify_crawler(self):
+        """
+        Test that a finished lookup allows the ip to be verified again.
+        """
+        from unittest import mock
+        from django.core.cache import caches
+        from biostar.forum import const, middleware
+
+        cache = caches['shared']
+        key = f"{const.CRAWLER_CACHE_KEY}-10.0.3.5"
+
+        with mock.patch.object(middleware, "domain_is_whitelisted", return_value=False):
+            self.assertFalse(middleware.is_crawler("10.0.3.5"))
+
+        self.assertIs(cache.get(key), False)
+        self.assertIsNone(cache.get(f"{key}-PENDING"))
+
+        cache.delete(key)
+        with mock.patch.object(middleware, "domain_is_whitelisted", return_value=True):
+            self.assertTrue(middleware.is_crawler("10.0.3.5"))
+
+    def test_ban_log(self):
+        """
+        Test that the ban log is written in batches.
+        """
+        import tempfile
+        from biostar.forum.middleware import BufferedAppender
+
+        fname = os.path.join(tempfile.mkdtemp(), "banned.txt")
+        log = BufferedAppender(fname, size=2, secs=60)
+
+        log.write("first\n")
+        self.assertFalse(os.path.isfile(fname))
+
+        log.write("second\n")
+        with open(fname) as fp:
+            self.assertEqual(fp.read(), "first\nsecond\n")
@@ -3,7 +3,7 @@ import os
 import shutil
 from django.core import management
 from django.urls import reverse
-from django.test import TestCase, override_settings
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.conf import settings
 from biostar.forum import models, views, search, tasks
 from biostar.utils.helpers import fake_request
@@ -60,6 +60,178 @@ class PostTest(TestCase):
         self.owner.profile.save()
         tasks.create_user_awards(self.owner.id)
 
+        self.assertTrue(models.Award.objects.filter(user=self.owner, badge__name="Autobiographer").exists())
+
+    def test_batch_awards(self):
+        """
+        Test that awards are given once to all users in one pass.
+        """
+        from biostar.forum import awards
+
+        models.Post.objects.filter(pk=self.post.pk).update(vote_count=6, view_count=6000)
+
+        first = awards.give_awards()
+        names = sorted(award.badge.name for award in first)
+        self.assertEqual(names, ["Appreciated", "Good Question", "Great Question", "Popular Question", "Student"])
+
+        # Awards are not given again.
+        self.assertEqual(awards.give_awards(), [])
+        self.assertEqual(models.Award.objects.filter(user=self.owner).count(), 5)
+
+    def test_award_events(self):
+        """
+        Test that votes queue only the awards that depend on them.
+        """
+        from biostar.forum import awards, auth
+
+        answer = models.Post.objects.create(title="Answer", author=self.owner, content="Answer",
+                                            type=models.Post.ANSWER, parent=self.post)
+        models.AwardCheck.objects.all().delete()
+
+        auth.apply_vote(post=answer, user=self.staff_user, vote_type=models.Vote.ACCEPT)
+
+        queued = set(models.AwardCheck.objects.values_list('user_id', 'rule'))
+        self.assertIn((self.owner.id, awards.SCHOLAR.name), queued)
+        self.assertIn((self.staff_user.id, awards.VOTER.name), queued)
+        self.assertNotIn((self.owner.id, awards.CENTURION.name), queued)
+
+        created = awards.process_queue()
+        self.assertEqual([award.badge.name for award in created], [awards.SCHOLAR.name])
+        self.assertFalse(models.AwardCheck.objects.exists())
+
+    def test_view_milestone(self):
+        """
+        Test that the view awards are given when other views moved the count past a milestone.
+        """
+        from django.test import RequestFactory
+        from biostar.forum import awards, auth
+
+        self.post.view_count = 999
+        models.Post.objects.filter(pk=self.post.pk).update(view_count=1000)
+        models.AwardCheck.objects.all().delete()
+
+        request = RequestFactory().get('/', REMOTE_ADDR="10.0.0.1")
+        auth.update_post_views(post=self.post, request=request)
+
+        self.assertEqual(self.post.view_count, 1001)
+        rules = set(models.AwardCheck.objects.values_list('rule', flat=True))
+        self.assertEqual(rules, {rule.name for rule in awards.EVENT_AWARDS[awards.VIEWS]})
+
+        given = [(award.user, award.badge.name) for award in awards.process_queue()]
+        self.assertIn((self.owner, awards.POPULAR.name), given)
+
+
+    @override_settings(SEND_MAIL=True)
+    def test_digest(self):
+        """
+        Test that digests are personalized by the tags of each user and sent in batches.
+        """
+        from django.core import mail
+        from biostar.forum.management.commands import digest
+
+        models.Post.objects.create(title="Aligner", author=self.owner, content="Test", tag_val="bwa",
+                                   type=models.Post.QUESTION)
+        models.Post.objects.create(title="Variants", author=self.owner, content="Test", tag_val="gatk",
+                                   type=models.Post.QUESTION)
+
+        for index in range(3):
+            user = User.objects.create(username=f"digest{index}", email=f"digest{index}@tested.com")
+            models.Profile.objects.filter(user=user).update(digest_prefs=models.Profile.DAILY_DIGEST,
+                                                            watched_tags="BWA" if index else "")
+        # Banned users get no digest.
+        models.Profile.objects.filter(user=user).update(state=models.Profile.BANNED)
+
+        count = digest.send_digests(days=1, subject="Daily digest", prefs=models.Profile.DAILY_DIGEST, size=1)
+
+        emails = {msg.to[0]: msg for msg in mail.outbox}
+        self.assertEqual(count, 2)
+        self.assertEqual(set(emails), {"digest0@tested.com", "digest1@tested.com"})
+        self.assertNotIn("tags you follow", emails["digest0@tested.com"].body)
+        self.assertIn("tags you follow:\n", emails["digest1@tested.com"].body)
+        self.assertIn("Aligner", emails["digest1@tested.com"].alternatives[0][0])
+
+        # Only the users with matching tags get the watched tags digest.
+        mail.outbox = []
+        count = digest.send_digests(days=7, tags_only=True)
+        self.assertEqual(count, 1)
+        self.assertNotIn("Variants", mail.outbox[0].body)
+
+    def test_merged_updates(self):
+        """
+        Test that creating an answer updates the root once.
+        """
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as context:
+            answer = models.Post.objects.create(title="Answer", author=self.owner, content="Answer",
+                                                parent=self.post, type=models.Post.ANSWER)
+
+        updates = [query['sql'] for query in context.captured_queries if query['sql'].startswith('UPDATE "forum_post"')]
+
+        # Saving the answer, the root fields and the answer index flag.
+        self.assertEqual(len(updates), 3)
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.answer_count, 1)
+        self.assertEqual(self.post.lastedit_date, answer.lastedit_date)
+        self.assertGreater(self.post.rank, answer.rank)
+        self.assertEqual(self.post.subs_count, 1)
+
+    def test_merged_tasks(self):
+        """
+        Test that the calls of a task for the same post are spooled once, keeping the flags.
+        """
+        from unittest import mock
+        from biostar.forum import effects
+
+        batch = effects.Batch()
+        batch.spool(tasks.notify_followers, post_id=self.post.pk, created=False)
+        batch.spool(tasks.notify_followers, post_id=self.post.pk, created=True)
+        batch.spool(tasks.notify_followers, post_id=self.post.pk, created=False)
+        batch.spool(tasks.notify_followers, post_id=0, created=False)
+
+        with mock.patch.object(tasks.notify_followers, "spool") as spool:
+            batch.run()
+
+        self.assertEqual(spool.call_args_list, [mock.call(post_id=self.post.pk, created=True),
+                                                mock.call(post_id=0, created=False)])
+
+    def test_get_tags(self):
+        """
+        Test that the missing tags are created together.
+        """
+        from biostar.forum import auth
+
+        tags = auth.get_tags(["rna-seq", "new", "rna seq", "new"])
+        self.assertEqual([tag.name for tag in tags], ["rna-seq", "new", "rna seq"])
+        self.assertEqual(len({tag.slug for tag in tags}), 3)
+
+    def test_mention_subscription(self):
+        """
+        Test that mentioned users are subscribed when the html comes from the cache.
+        """
+        self.staff_user.refresh_from_db()
+        content = f"Thanks @{self.staff_user.username}"
+
+        # The first answer renders and caches the html.
+        models.Post.objects.create(title="Test", author=self.owner, content=content,
+                                   type=models.Post.ANSWER, root=self.post, parent=self.post)
+        models.Subscription.objects.filter(user=self.staff_user).delete()
+
+        models.Post.objects.create(title="Test", author=self.owner, content=content,
+                                   type=models.Post.ANSWER, root=self.post, parent=self.post)
+
+        self.assertTrue(models.Subscription.objects.filter(user=self.staff_user, post=self.post).exists())
+
+        # Handles written in code are not mentions.
+        models.Subscription.objects.filter(user=self.staff_user).delete()
+        handle = f"@{self.staff_user.username}"
+        content = f"Run `ssh {handle}` or\n\n```\n{handle}\n```\n\n    {handle}\n"
+        models.Post.objects.create(title="Test", author=self.owner, content=content,
+                                   type=models.Post.ANSWER, root=self.post, parent=self.post)
+
+        self.assertFalse(models.Subscription.objects.filter(user=self.staff_user).exists())
 
     def test_comment_traversal(self):
         """Test comment rendering pages"""
@@ -181,4 +353,103 @@ class PostSearchTest(TestCase):
 
         search.print_info()
         # TODO: put back in
-        #self.assertTrue(len(whoosh_search), f"Whoosh search returned no results. At least {self.limit} expected")
\ No newline at end of file
+        #self.assertTrue(len(whoosh_search), f"Whoosh search returned no results. At least {self.limit} expected")
+
+class NotificationTest(TransactionTestCase):
+    """
+    The tasks of a post are spooled once the transaction commits.
+    """
+
+    def setUp(self):
+        logger.setLevel(logging.WARNING)
+        self.owner = User.objects.create(username="notified", email="notified@tested.com")
+        self.post = models.Post.objects.create(title="Test", author=self.owner, content="Test",
+                                               type=models.Post.QUESTION)
+
+    @override_settings(SEND_MAIL=True, NOTIFY_WINDOW_SECONDS=300)
+    def test_coalesced_notifications(self):
+        """
+        Test that the new posts of a thread are sent to each follower as a single message and email.
+        """
+        from django.core import mail
+        from biostar.accounts.models import Message
+        from biostar.forum import outbox
+
+        follower = User.objects.create(username="follower", email="follower@tested.com")
+        models.Subscription.objects.create(user=follower, post=self.post, type=models.Subscription.EMAIL_MESSAGE)
+
+        for index in range(3):
+            models.Post.objects.create(title="Answer", author=self.owner, content=f"Answer {index}",
+                                       parent=self.post, type=models.Post.ANSWER)
+
+        self.assertEqual(models.Notification.objects.filter(user=follower).count(), 3)
+
+        # Nothing is sent before the window has passed.
+        self.assertEqual(outbox.flush(), 0)
+
+        mail.outbox = []
+        self.assertEqual(outbox.flush(window=0), 3)
+
+        msgs = Message.objects.filter(recipient=follower, sender=self.owner)
+        self.assertEqual(msgs.count(), 1)
+        self.assertIn("3 new posts", msgs.first().body.body)
+        self.assertEqual([msg.to for msg in mail.outbox], [["follower@tested.com"]])
+        self.assertFalse(models.Notification.objects.exists())
+
+    def test_overlapping_flush(self):
+        """
+        Test that a flush started while another one is sending skips the claimed posts.
+        """
+        from datetime import timedelta
+        from unittest import mock
+        from biostar.forum import outbox, util
+
+        follower = User.objects.create(username="follower", email="follower@tested.com")
+        models.Subscription.objects.create(user=follower, post=self.post, type=models.Subscription.LOCAL_MESSAGE)
+        for index in range(2):
+            models.Post.objects.create(title="Answer", author=self.owner, content=f"Answer {index}",
+                                       parent=self.post, type=models.Post.ANSWER)
+
+        sent, overlapping = [], []
+
+        def send(posts, users, emails):
+            sent.append(posts)
+            if len(sent) == 1:
+                overlapping.append(outbox.flush(window=0))
+
+        with mock.patch.object(outbox, "send", side_effect=send):
+            self.assertEqual(outbox.flush(window=0), 2)
+
+        self.assertEqual((len(sent), overlapping), (1, [0]))
+        self.assertFalse(models.Notification.objects.exists())
+
+        # Posts claimed by a flush that stopped are sent later.
+        models.Post.objects.create(title="Answer", author=self.owner, content="Answer 3",
+                                   parent=self.post, type=models.Post.ANSWER)
+        models.Notification.objects.update(claim="stopped", claimed=util.now() - timedelta(hours=1))
+
+        with mock.patch.object(outbox, "send", side_effect=send):
+            self.assertEqual(outbox.flush(window=0), 1)
+
+    @override_settings(MULTI_THREAD=True, NOTIFY_WINDOW_SECONDS=300)
+    def test_queued_notifications(self):
+        """
+        Test that the followers are notified of a new answer when the tasks wait in the queue.
+        """
+        from biostar.utils import executor
+
+        pool = executor.Executor(workers=0, size=100, timeout=0)
+        pool.started = True
+        self.addCleanup(setattr, executor, "_executor", executor._executor)
+        executor._executor = pool
+
+        follower = User.objects.create(username="follower", email="follower@tested.com")
+        models.Subscription.objects.create(user=follower, post=self.post, type=models.Subscription.LOCAL_MESSAGE)
+
+        models.Post.objects.create(title="Answer", author=self.owner, content="Answer",
+                                   parent=self.post, type=models.Post.ANSWER)
+
+        while not pool.tasks.empty():
+            pool.run(pool.tasks.get())
+
+        self.assertEqual(models.Notification.objects.filter(user=follower).count(), 1)
@@ -0,0 +1,173 @@
+import logging
+from datetime import timedelta
+
+from django.test import TestCase
+
+from biostar.accounts.models import Profile, User
+from biostar.forum import models, sync, util
+
+logger = logging.getLogger('engine')
+
+USER_COLS = ['id', 'email', 'password', 'is_active', 'is_staff', 'is_admin', 'name', 'user_id', 'info',
+             'digest_prefs', 'watched_tags', 'twitter_id', 'message_prefs', 'type', 'last_login', 'date_joined',
+             'location', 'website', 'scholar', 'score', 'my_tags', 'new_messages']
+
+POST_COLS = ['id', 'root_id', 'parent_id', 'author_id', 'lastedit_user_id', 'rank', 'status', 'type',
+             'creation_date', 'lastedit_date', 'title', 'tag_val', 'content', 'html', 'view_count',
+             'vote_count', 'book_count', 'has_accepted', 'thread_score']
+
+VOTE_COLS = ['id', 'author_id', 'post_id', 'type', 'date']
+
+SUB_COLS = ['id', 'user_id', 'post_id', 'type', 'date']
+
+
+def user_row(uid, score=0):
+    now = util.now()
+    return (uid, f"remote{uid}@tested.com", "", True, False, False, f"Remote {uid}", uid, "info",
+            Profile.NO_DIGEST, "", "", Profile.DEFAULT_MESSAGES, Profile.READER, now, now,
+            "", "", "", score, "", 0)
+
+
+def post_row(uid, root, parent, author, ptype):
+    now = util.now()
+    return (uid, root, parent, author, author, 0, models.Post.OPEN, ptype, now, now, "Remote", "tag1",
+            "Remote post", "<p>Remote post</p>", 0, 0, 0, False, 0)
+
+
+def chunk(threads, users, votes=(), subs=()):
+    return dict(threads=dict(column=POST_COLS, rows=list(threads)),
+                users=dict(column=USER_COLS, rows=list(users)),
+                votes=dict(column=VOTE_COLS, rows=list(votes)),
+                subs=dict(column=SUB_COLS, rows=list(subs)))
+
+
+class SyncTest(TestCase):
+
+    def setUp(self):
+        logger.setLevel(logging.WARNING)
+
+    def test_sync_chunks(self):
+        """
+        Test that the posts of a thread synced in separate chunks are linked and counted.
+        """
+        first = chunk(threads=[post_row(10, 10, 10, author=1, ptype=models.Post.QUESTION)],
+                      users=[user_row(1)])
+        second = chunk(threads=[post_row(11, 10, 10, author=2, ptype=models.Post.ANSWER)],
+                       users=[user_row(1), user_row(2)],
+                       votes=[(5, 1, 11, models.Vote.UP, util.now())],
+                       subs=[(7, 2, 10, models.Subscription.LOCAL_MESSAGE, util.now())])
+
+        sync.sync_chunk(first)
+        sync.sync_chunk(second)
+
+        self.assertEqual(sync.count_rows(second), 5)
+        self.assertEqual(User.objects.filter(email__startswith="remote").count(), 2)
+        self.assertEqual(Profile.objects.get(uid="2").name, "Remote 2")
+
+        root = models.Post.objects.get(uid="10")
+        answer = models.Post.objects.get(uid="11")
+        self.assertEqual(answer.root, root)
+        self.assertEqual(root.answer_count, 1)
+        self.assertEqual(models.Vote.objects.filter(post=answer).count(), 1)
+        self.assertEqual(models.Subscription.objects.filter(post=root).count(), 1)
+
+    def test_update_users(self):
+        """
+        Test that the users synced before are updated, not created again.
+        """
+        sync.sync_users(dict(column=USER_COLS, rows=[user_row(1)]))
+        users = sync.sync_users(dict(column=USER_COLS, rows=[user_row(1, score=5), user_row(2)]))
+
+        self.assertEqual(set(users), {1, 2})
+        self.assertEqual(User.objects.filter(email__startswith="remote").count(), 2)
+        self.assertEqual(Profile.objects.get(uid="1").score, 5)
+
+    def test_shared_email(self):
+        """
+        Test that remote users sharing an email are all mapped to the local user.
+        """
+        first, second = user_row(1), list(user_row(2))
+        second[1] = first[1]
+
+        users = sync.sync_users(dict(column=USER_COLS, rows=[first, tuple(second)]))
+
+        self.assertEqual(set(users), {1, 2})
+        self.assertEqual(users[1], users[2])
+        self.assertEqual(User.objects.filter(email=first[1]).count(), 1)
+
+    def test_resume(self):
+        """
+        Test that an interrupted sync resumes after the last thread stored.
+        """
+        date = util.now() - timedelta(days=10)
+        start, end, last_id = sync.get_range(start=date, days=-2, cursor=None)
+        self.assertEqual((end - start, last_id), (timedelta(days=2), 0))
+
+        sync.store_checkpoint(42)
+
+        # The unfinished range is picked up again.
+        self.assertEqual(sync.get_range(start=None, days=-2, cursor=None), (start, end, 42))
+        self.assertEqual(sync.get_range(start=date, days=-2, cursor=None), (start, end, 42))
+
+        # Another range starts over.
+        self.assertEqual(sync.get_range(start=date, days=1, cursor=None)[2], 0)
+
+        sync.store_synced_date(start)
+        self.assertEqual(models.Sync.objects.get(pk=1).last_id, 0)
+
+    def test_merge_shards(self):
+        """
+        Test that a thread retrieved by several shards is stored once, in shard order.
+        """
+        start = util.now()
+        shards = sync.split_range(start, start + timedelta(days=8), parts=4)
+        self.assertEqual(len(shards), 4)
+        self.assertEqual(shards[1], (start + timedelta(days=2), start + timedelta(days=4)))
+
+        question = post_row(10, 10, 10, author=1, ptype=models.Post.QUESTION)
+        answer = post_row(11, 10, 10, author=1, ptype=models.Post.ANSWER)
+        other = post_row(12, 12, 12, author=1, ptype=models.Post.QUESTION)
+        vote = (5, 1, 11, models.Vote.UP, util.now())
+
+        results = [[chunk(threads=[question, answer], users=[user_row(1)], votes=[vote])],
+                   [chunk(threads=[question, answer], users=[user_row(1)], votes=[vote]),
+                    chunk(threads=[other], users=[user_row(1)])]]
+
+        merged = list(sync.merge(results))
+        self.assertEqual([[row[0] for row in data['threads']['rows']] for data in merged], [[10, 11], [12]])
+        self.assertEqual(sum(len(data['votes']['rows']) for data in merged), 1)
+
+        for data in merged:
+            sync.sync_chunk(data)
+
+        self.assertEqual(models.Post.objects.get(uid="11").root.uid, "10")
+        self.assertEqual(models.Vote.objects.count(), 1)
+
+    def test_shard_checkpoint(self):
+        """
+        Test that the shards stored by an interrupted parallel sync are kept, and spooled chunks read back.
+        """
+        import os
+        import pickle
+        import tempfile
+
+        date = util.now() - timedelta(days=10)
+        start, end, last_id = sync.get_range(start=date, days=4, cursor=None)
+        sync.store_shard(start + timedelta(days=2))
+
+        # The range is resumed, with the stored shards.
+        self.assertEqual(sync.get_range(start=None, days=4, cursor=None), (start, end, 0))
+        self.assertEqual(models.Sync.objects.get(pk=1).done, start + timedelta(days=2))
+
+        sync.store_synced_date(start)
+        self.assertIsNone(models.Sync.objects.get(pk=1).done)
+
+        chunks = [chunk(threads=[post_row(uid, uid, uid, author=1, ptype=models.Post.QUESTION)], users=[user_row(1)])
+                  for uid in (10, 11)]
+        fd, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, 'wb') as fp:
+            for data in chunks:
+                pickle.dump(data, fp)
+
+        self.assertEqual(list(sync.read_spool(path)), chunks)
@@ -36,6 +36,7 @@ forum_patterns = [
     # Ajax calls
     path('ajax/digest/', ajax.ajax_digest, name='ajax_digest'),
     path('ajax/vote/', ajax.ajax_vote, name='vote'),
+    path('ajax/csrf/', ajax.csrf_token, name='ajax_csrf'),
     path('ajax/test/', ajax.ajax_test, name='ajax_test'),
     path('ajax/subscribe/', ajax.ajax_subs, name='ajax_sub'),
     path('ajax/delete/', ajax.ajax_delete, name='ajax_delete'),
@@ -59,6 +60,7 @@ forum_patterns = [
 
     # Api calls
     path(r'api/traffic/', api.traffic, name='api_traffic'),
+    path(r'api/metrics/', api.metrics, name='api_metrics'),
     path(r'api/user/<str:uid>/', api.user_details, name='api_user'),
     path(r'api/tags/list/', api.tags_list, name='api_tags_list'),
     path(r'api/post/<str:uid>/', api.post_details, name='api_post'),
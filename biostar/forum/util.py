@@ -7,6 +7,8 @@ from itertools import islice, count
 from datetime import datetime
 from calendar import timegm
 from django.utils.timezone import utc
+from django.core.cache import cache
+from biostar.utils import metrics
 
 
 def fixcase(name):
@@ -62,6 +64,33 @@ def pluralize(value, word):
         return "%d %s" % (value, word)
 
 
+def refresh_cache(key, func, ttl):
+    """
+    Returns the cached result of func(). Once it expires a single caller
+    recomputes it while the others keep getting the previous value.
+    """
+    lock = f"{key}-LOCK"
+    stored = cache.get(key)
+
+    if stored is not None:
+        value, expires = stored
+        # The value is fresh or another caller is already refreshing it.
+        if time.time() < expires or not cache.add(lock, 1, ttl):
+            metrics.record_cache(hit=True)
+            return value
+
+    metrics.record_cache(hit=False)
+
+    try:
+        value = func()
+        # Stale values outlive the expiration to be served during a refresh.
+        cache.set(key, (value, time.time() + ttl), ttl * 10)
+    finally:
+        cache.delete(lock)
+
+    return value
+
+
 def timer_func():
     """
     Prints progress on inserting elements.
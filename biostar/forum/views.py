@@ -17,6 +17,7 @@ from ratelimit.decorators import ratelimit
 from taggit.models import Tag
 
 from biostar.accounts.models import Profile
+from biostar.utils import identity
 from biostar.forum import forms, auth, tasks, util, search
 from biostar.forum.const import *
 from biostar.forum.models import Post, Vote, Badge, Subscription
@@ -54,7 +55,7 @@ def post_exists(func):
     @wraps(func)
     def _wrapper_(request, **kwargs):
         uid = kwargs.get('uid')
-        post = Post.objects.filter(uid=uid).exists()
+        post = identity.get(Post, uid=uid)
         if not post:
             messages.error(request, "Post does not exist.")
             return redirect(reverse("post_list"))
@@ -62,6 +63,21 @@ def post_exists(func):
     return _wrapper_
 
 
+def user_csrf_cookie(func):
+    """
+    Sets the CSRF cookie for authenticated users only.
+    Anonymous pages stay cookie-less, forms fetch the token when opened.
+    """
+    csrf_func = ensure_csrf_cookie(func)
+
+    @wraps(func)
+    def _wrapper_(request, *args, **kwargs):
+        if request.user.is_anonymous:
+            return func(request, *args, **kwargs)
+        return csrf_func(request, *args, **kwargs)
+    return _wrapper_
+
+
 class CachedPaginator(Paginator):
     """
     Paginator that caches the count call.
@@ -194,7 +210,7 @@ def pages(request, fname):
     return render(request, 'pages.html', context=context)
 
 
-@ensure_csrf_cookie
+@user_csrf_cookie
 def post_list(request, topic=None, cache_key='', extra_context=dict()):
     """
     Post listing. Filters, orders and paginates posts based on GET parameters.
@@ -390,12 +406,12 @@ def badge_view(request, uid):
     return render(request, "badge_view.html", context=context)
 
 
-@ensure_csrf_cookie
+@user_csrf_cookie
 def post_view(request, uid):
     "Return a detailed view for specific post"
 
     # Get the post.
-    post = Post.objects.filter(uid=uid).select_related('root').first()
+    post = identity.get(Post, fresh=True, uid=uid)
 
     if not post:
         messages.error(request, "Post does not exist.")
@@ -468,7 +484,7 @@ def post_moderate(request, uid):
     """Used to make display post moderate form given a post request."""
 
     user = request.user
-    post = Post.objects.filter(uid=uid).first()
+    post = identity.get(Post, fresh=True, uid=uid)
 
     if request.method == "POST":
         form = forms.PostModForm(post=post, data=request.POST, user=user, request=request)
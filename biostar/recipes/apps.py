@@ -13,5 +13,14 @@ class EngineConfig(AppConfig):
 
     def ready(self):
         from . import signals
+        from biostar.utils import identity
+        from .models import Project, Data, Analysis, Job
+
+        # Objects checked for access are reused by the view.
+        identity.register(Project, 'uid')
+        identity.register(Data, 'uid', related=('project',))
+        identity.register(Analysis, 'uid', related=('project',))
+        identity.register(Job, 'uid', related=('project',))
+
         # Triggered upon app initialization.
         post_migrate.connect(init_app, sender=self)
@@ -7,6 +7,7 @@ from django.http import HttpResponse
 from django.http import QueryDict
 
 from biostar.accounts.models import User
+from biostar.utils import identity
 from . import models, auth
 
 # Share the logger with models
@@ -38,7 +39,7 @@ class read_access:
             user = request.user
 
             # Fetches the object that will be checked for permissions.
-            instance = self.type.objects.filter(uid=uid).first()
+            instance = identity.get(self.type, fresh=True, uid=uid)
 
             # Object does not exist.
             if not instance:
@@ -110,7 +111,7 @@ class write_access:
             user = request.user
 
             # Fetches the object that will be checked for permissions.
-            instance = self.type.objects.filter(uid=uid).first()
+            instance = identity.get(self.type, fresh=True, uid=uid)
             if not instance:
                 messages.error(request, f"Object id {uid} does not exist.")
                 return redirect(reverse("project_list"))
@@ -17,7 +17,7 @@ def send_emails(*args ,**kwargs):
     Sends  queued emails
     """
     try:
-        from mailer.engine import send_all
+        from biostar.emailer.tasks import send_all
         send_all()
         logger.info("send_all()")
 
@@ -26,6 +26,7 @@ from django.core.cache import cache
 from ratelimit.decorators import ratelimit
 from sendfile import sendfile
 from biostar.accounts.models import User
+from biostar.utils import identity
 from biostar.recipes import tasks, auth, forms, const, search, util
 from biostar.recipes.decorators import read_access, write_access
 from biostar.recipes.models import Project, Data, Analysis, Job, Access
@@ -121,7 +122,7 @@ def recycle_bin(request):
 
 @write_access(type=Project, fallback_view="project_view")
 def project_delete(request, uid):
-    project = Project.objects.filter(uid=uid).first()
+    project = identity.get(Project, fresh=True, uid=uid)
     project.deleted = not project.deleted
     project.save()
 
@@ -157,7 +158,7 @@ def project_users(request, uid):
     """
     Manage project users page
     """
-    project = Project.objects.filter(uid=uid).first()
+    project = identity.get(Project, fresh=True, uid=uid)
     # Get users that already have access to project.
     have_access = project.access_set.exclude(access=Access.NO_ACCESS).order_by('-date')
 
@@ -184,7 +185,7 @@ def project_users(request, uid):
 def project_info(request, uid):
     user = request.user
 
-    project = Project.objects.filter(uid=uid).first()
+    project = identity.get(Project, fresh=True, uid=uid)
 
     # Show counts for the project.
     counts = get_counts(project)
@@ -285,7 +286,7 @@ def project_view(request, uid, template_name="project_info.html", active='info',
     user = request.user
 
     # The project that is viewed.
-    project = Project.objects.filter(uid=uid).first()
+    project = identity.get(Project, fresh=True, uid=uid)
 
     # Select all the data in the project.
     data_list = project.data_set.filter(deleted=False).order_by("-lastedit_date", "rank", "-date").all()
@@ -338,7 +339,7 @@ def project_view(request, uid, template_name="project_info.html", active='info',
 def project_edit(request, uid):
     "Edit meta-data associated with a project."
 
-    project = Project.objects.filter(uid=uid).first()
+    project = identity.get(Project, fresh=True, uid=uid)
     form = forms.ProjectForm(instance=project, request=request)
     if request.method == "POST":
         form = forms.ProjectForm(data=request.POST, files=request.FILES, instance=project, request=request)
@@ -376,7 +377,7 @@ def project_create(request):
 def data_view(request, uid):
     "Show information specific to each data."
 
-    data = Data.objects.filter(uid=uid).first()
+    data = identity.get(Data, fresh=True, uid=uid)
     project = data.project
     paths = auth.listing(root=data.get_data_dir())
 
@@ -393,7 +394,7 @@ def data_edit(request, uid):
     """
     Edit meta-data associated with Data.
     """
-    data = Data.objects.filter(uid=uid).first()
+    data = identity.get(Data, fresh=True, uid=uid)
     form = forms.DataEditForm(instance=data, initial=dict(type=data.type), user=request.user)
 
     if request.method == "POST":
@@ -413,7 +414,7 @@ def data_upload(request, uid):
     "Data upload view routed through auth.create_data."
 
     owner = request.user
-    project = Project.objects.filter(uid=uid).first()
+    project = identity.get(Project, fresh=True, uid=uid)
     form = forms.DataUploadForm(user=owner, project=project)
 
     if request.method == "POST":
@@ -446,7 +447,7 @@ def recipe_code_download(request, uid, fname):
     Download the raw recipe template as a file
     """
 
-    recipe = Analysis.objects.filter(uid=uid).first()
+    recipe = identity.get(Analysis, fresh=True, uid=uid)
 
     script = auth.render_script(recipe=recipe)
 
@@ -464,7 +465,7 @@ def recipe_run(request, uid):
     View used to execute recipes and start a 'Queued' job.
     """
 
-    recipe = Analysis.objects.filter(uid=uid).first()
+    recipe = identity.get(Analysis, fresh=True, uid=uid)
 
     # Form submission.
     if request.method == "POST":
@@ -489,7 +490,7 @@ def recipe_run(request, uid):
 @read_access(type=Job)
 def job_rerun(request, uid):
     # Get the job.
-    job = Job.objects.filter(uid=uid).first()
+    job = identity.get(Job, fresh=True, uid=uid)
     next = request.GET.get('next')
     # Get the recipe
     recipe = job.analysis
@@ -624,7 +625,7 @@ def recipe_view(request, uid):
 @read_access(type=Project, strict=True)
 def recipe_create(request, uid):
     # Get the project
-    project = Project.objects.filter(uid=uid).first()
+    project = identity.get(Project, fresh=True, uid=uid)
     recipe = auth.create_analysis(project=project, name="Recipe", template="echo 'Hello World!'")
 
     # Ensure recipe names are distinguishable from one another.
@@ -640,7 +641,7 @@ def recipe_create(request, uid):
 def job_edit(request, uid):
     "Edit meta-data associated with a job."
 
-    job = Job.objects.filter(uid=uid).first()
+    job = identity.get(Job, fresh=True, uid=uid)
     project = job.project
     form = forms.JobEditForm(instance=job, user=request.user)
 
@@ -658,7 +659,7 @@ def job_edit(request, uid):
 
 @write_access(type=Analysis, fallback_view="recipe_view")
 def recipe_delete(request, uid):
-    recipe = Analysis.objects.filter(uid=uid).first()
+    recipe = identity.get(Analysis, fresh=True, uid=uid)
     user = request.user
 
     auth.delete_recipe(recipe=recipe, user=user)
@@ -673,7 +674,7 @@ def recipe_delete(request, uid):
 
 @write_access(type=Job, fallback_view="job_view")
 def job_delete(request, uid):
-    job = Job.objects.filter(uid=uid).first()
+    job = identity.get(Job, fresh=True, uid=uid)
 
     running_job = job.state == Job.RUNNING and not job.deleted
 
@@ -690,7 +691,7 @@ def job_delete(request, uid):
 
 @write_access(type=Data, fallback_view="data_view")
 def data_delete(request, uid):
-    data = Data.objects.filter(uid=uid).first()
+    data = identity.get(Data, fresh=True, uid=uid)
 
     auth.delete_object(obj=data, request=request)
     msg = f"Deleted <b>{data.name}</b>." if data.deleted else f"Restored <b>{data.name}</b>."
@@ -704,7 +705,7 @@ def job_view(request, uid):
     '''
     Views the state of a single job.
     '''
-    job = Job.objects.filter(uid=uid).first()
+    job = identity.get(Job, fresh=True, uid=uid)
     project = job.project
 
     stdout = job.stdout_log
@@ -771,7 +772,7 @@ def data_serve(request, uid, path):
     """
     Serves files from a data directory.
     """
-    obj = Data.objects.filter(uid=uid).first()
+    obj = identity.get(Data, fresh=True, uid=uid)
     return file_serve(request=request, path=path, obj=obj)
 
 
@@ -780,7 +781,7 @@ def data_download(request, uid):
     """
     Download a given data object.
     """
-    obj = Data.objects.filter(uid=uid).first()
+    obj = identity.get(Data, fresh=True, uid=uid)
     files = obj.get_files()
     # Get first file in data directory.
     path = files[0]
@@ -792,7 +793,7 @@ def job_serve(request, uid, path):
     """
     Serves files from a job directory.
     """
-    obj = Job.objects.filter(uid=uid).first()
+    obj = identity.get(Job, fresh=True, uid=uid)
 
     if obj:
         return file_serve(request=request, path=path, obj=obj)
@@ -8,4 +8,7 @@ CLASSIFY_SPAM = False
 
 
 # Turn the emailing tasks off for tests
-SEND_MAIL = False
\ No newline at end of file
+SEND_MAIL = False
+
+# The transfer tests copy between the tables of the test database.
+INSTALLED_APPS = INSTALLED_APPS + ["biostar.transfer"]
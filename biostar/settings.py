@@ -23,6 +23,39 @@ MULTI_THREAD = True
 # A setting to disable tasks altoghether.
 DISABLE_TASKS = False
 
+# Threads running the tasks and tasks waiting in the queue, without uwsgi.
+TASK_WORKERS = 4
+TASK_QUEUE_SIZE = 1000
+
+# Seconds a task waits for room in a full queue before the caller runs it.
+TASK_QUEUE_TIMEOUT = 5
+
+# SQLite file that keeps the queued tasks across restarts, None keeps them in memory only.
+TASK_QUEUE_FILE = None
+
+# Seconds the tasks of a process are kept from the other processes after its last renewal.
+TASK_LEASE_SECONDS = 60
+
+# Seconds a pending task absorbs the submissions with the same key.
+TASK_KEY_SECONDS = 60
+
+# The default cache is local to each process, the shared cache is seen by all of them.
+# The keys of the pending tasks, the request timings and the crawler checks are kept there.
+# The database cache needs its table: python manage.py createcachetable
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'biostar_cache',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
+# How often each process adds its request and task timings to the shared cache, in seconds.
+METRICS_FLUSH_SECONDS = 10
+
 # Pagedown
 PAGEDOWN_IMAGE_UPLOAD_ENABLED = False
 
@@ -168,6 +201,13 @@ DATABASE_DIR = os.path.join(BASE_DIR, 'export', 'db')
 
 os.makedirs(DATABASE_DIR, exist_ok=True)
 
+# Lock files that elect the process running each timer on this host, without uwsgi,
+# next to the status of the last run of each timer.
+TIMER_LOCK_DIR = os.path.join(BASE_DIR, 'export', 'locks')
+
+# Timer runs are delayed by up to this fraction of their interval.
+TIMER_JITTER = 0.1
+
 # DATABASE_NAME = os.environ.setdefault("DATABASE_NAME", "database.db")
 # Ensure database is inside database directory.
 # DATABASE_NAME = os.path.join(DATABASE_DIR, DATABASE_NAME)
@@ -250,6 +290,33 @@ LOGGER_NAME = "biostar"
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
+# Email templates parsed when the site starts.
+EMAIL_TEMPLATES = [
+    "messages/subscription_email.html",
+    "messages/subscription_summary.html",
+    "messages/watched_tags.html",
+    "messages/mailing_list.html",
+    "messages/digest.html",
+    "accounts/email_verify.html",
+]
+
+# Check the email template files for changes before each use.
+EMAIL_TEMPLATE_RELOAD = False
+
+# Open connections and messages sent over each connection at a time by the delivery worker.
+EMAIL_POOL_SIZE = 4
+EMAIL_BATCH_SIZE = 100
+
+# Messages per second, 0 for no limit.
+EMAIL_RATE_LIMIT = 0
+
+# Attempts after a failure, waiting backoff * 2^attempt seconds in between.
+EMAIL_RETRIES = 3
+EMAIL_RETRY_BACKOFF = 1
+
+# How long objects looked up by uid or username are cached, in seconds.
+IDENTITY_CACHE_SECONDS = 300
+
 # Session engine.
 SESSION_ENGINE = "django.contrib.sessions.backends.db"
 
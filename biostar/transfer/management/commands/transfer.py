@@ -1,148 +1,223 @@
+import json
 import logging
-import time
-import re
 import os
-from itertools import count, islice
-import html2text
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 
 from django.template.defaultfilters import slugify
 from django.core.management.base import BaseCommand
 from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count, F
 
 from taggit.models import Tag
 
 from biostar.accounts.models import User, Profile
-from biostar.forum import util, markdown
+from biostar.forum import util, auth
 from biostar.forum.models import Post, Vote, Subscription, Badge, Award
-from biostar.transfer.models import UsersUser, PostsPost, PostsVote, PostsSubscription, BadgesAward, UsersProfile
+from biostar.transfer.models import UsersUser, PostsPost, PostsVote, PostsSubscription, BadgesAward, UsersProfile, \
+    BadgesBadge
 
 logger = logging.getLogger("engine")
 
 LIMIT = None
 
-def timer_func():
+
+class Progress(object):
     """
-    Prints progress on inserting elements.
+    Reports the rows copied of a table, the rate and the estimated time left.
     """
 
-    last = time.time()
+    def __init__(self, name, total, done=0):
+        self.name = name
+        self.total = total
+        self.done = done
+        self.count = 0
+        self.start = time.time()
 
-    def elapsed(msg):
-        nonlocal last
-        now = time.time()
-        sec = round(now - last, 1)
-        last = now
-        print(f"{msg} in {sec} seconds")
+    def add(self, count):
+        self.count += count
+        self.done += count
 
-    def progress(index, step=5000, msg=""):
-        nonlocal last
-        if index % step == 0:
-            elapsed(f"... {index} {msg}")
+        rate = self.count / max(time.time() - self.start, 0.001)
+        left = max(self.total - self.done, 0)
+        eta = timedelta(seconds=int(left / rate)) if rate else "?"
+        percent = self.done / self.total if self.total else 1
 
-    return elapsed, progress
+        logger.info(f"{self.name}: {self.done}/{self.total} ({percent:.0%}) {rate:.0f} rows/sec, eta {eta}")
 
 
-def uid_from_context(context):
+class Checkpoint(object):
     """
-    Parse post.uid from a link
+    The last source id copied by each step, kept in a json file to resume the transfer.
     """
-    # id pattern found in link
-    pattern = r"[0-9]+"
-    uid = re.search(pattern, context)
-    uid = uid.group(0) if uid else ""
-    return uid
 
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.data = {}
+        if os.path.isfile(path):
+            with open(path) as fp:
+                self.data = json.load(fp)
 
-def bulk_copy_users(limit):
+    def last(self, name):
+        return self.data.get(name, {}).get("last", 0)
 
-    current = dict()
-    old_users = UsersUser.objects.order_by("id")
+    def is_done(self, name):
+        return self.data.get(name, {}).get("done", False)
 
-    def gen_users():
+    def save(self):
+        # Replace the file in one step.
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w') as fp:
+            json.dump(self.data, fp)
+        os.replace(tmp, self.path)
 
-        logger.info(f"Transferring users")
+    def update(self, name, **kwargs):
+        with self.lock:
+            self.data.setdefault(name, {}).update(kwargs)
+            self.save()
 
-        elapsed, progress = timer_func()
+    def reset(self, name):
+        with self.lock:
+            self.data.pop(name, None)
+            self.save()
 
-        # Allow limiting the input
-        stream = islice(zip(count(1), old_users), limit)
-        for index, user in stream:
-            progress(index=index,  msg="users")
 
-            #TODO: slugify
-            username = f"{slugify(user.name)}-{user.id}"
+class IdMap(object):
+    """
+    Maps the ids of the source rows to the primary keys of the copied rows, kept in SQLite.
+    """
 
-            # Create user
-            new_user = User(username=username, email=user.email, password=user.password,
-                            is_active=user.is_active, is_superuser=user.is_admin, is_staff=user.is_staff)
+    def __init__(self, path, name):
+        self.path = path
+        self.name = name
+        self.local = threading.local()
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS {name} (old INTEGER PRIMARY KEY, new INTEGER)")
+        self.conn.commit()
+
+    @property
+    def conn(self):
+        # Each thread uses its own connection.
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = sqlite3.connect(self.path, timeout=60)
+        return conn
+
+    def update(self, pairs):
+        self.conn.executemany(f"INSERT OR REPLACE INTO {self.name} VALUES (?, ?)", pairs)
+        self.conn.commit()
+
+    def get_many(self, keys, size=500):
+        keys = list({key for key in keys if key is not None})
+        found = {}
+        for start in range(0, len(keys), size):
+            part = keys[start:start + size]
+            marks = ",".join("?" * len(part))
+            found.update(self.conn.execute(f"SELECT old, new FROM {self.name} WHERE old IN ({marks})", part))
+        return found
+
+
+def copy_table(name, source, copy, state, chunk, limit=None):
+    """
+    Copies the source rows in primary key chunks, resuming after the last id copied.
+    Each chunk is stored in a transaction by copy(rows), then checkpointed.
+    """
+    if state.is_done(name):
+        logger.info(f"{name}: already transferred")
+        return
 
-            current[user.email] = new_user
+    last = state.last(name)
+    total = source.count()
+    total = min(total, limit) if limit else total
+    done = source.filter(pk__lte=last).count() if last else 0
 
-            yield new_user
+    progress = Progress(name, total=total, done=done)
+    logger.info(f"{name}: transferring {total - done} rows")
 
-    def gen_profile():
-        logger.info(f"Transferring profiles")
+    copied = 0
+    while True:
+        size = min(chunk, limit - copied) if limit else chunk
+        rows = list(source.filter(pk__gt=last).order_by("pk")[:size]) if size > 0 else []
+        if not rows:
+            break
 
-        elapsed, progress = timer_func()
+        with transaction.atomic():
+            copy(rows)
 
-        # Allow limiting the input
-        stream = islice(zip(count(1), old_users), limit)
-        for index, user in stream:
-            progress(index, msg="profiles")
-            text = util.strip_tags(user.profile.info)
+        last = rows[-1].pk
+        copied += len(rows)
+        state.update(name, last=last)
+        progress.add(len(rows))
 
-            # The incoming users have weekly digest prefs as a default.
-            profile = Profile(uid=user.id, user=current.get(user.email), name=user.name,
-                              message_prefs=user.profile.message_prefs, state=user.status,
-                              role=user.type, last_login=user.last_login, html=user.profile.info,
-                              date_joined=user.profile.date_joined, location=user.profile.location,
-                              website=user.profile.website, scholar=user.profile.scholar, text=text,
-                              watched_tags=user.profile.watched_tags,score=user.score,
-                              twitter=user.profile.twitter_id, my_tags=user.profile.my_tags,
-                              digest_prefs=user.profile.digest_prefs, new_messages=user.new_messages)
+    # Limited runs may continue later.
+    if not limit:
+        state.update(name, done=True)
 
-            yield profile
 
-    # Bulk create the users, then profile.
-    elapsed, progress = timer_func()
+def uid_from_context(context):
+    """
+    Parse post.uid from a link
+    """
+    # id pattern found in link
+    pattern = r"[0-9]+"
+    uid = re.search(pattern, context)
+    uid = uid.group(0) if uid else ""
+    return uid
 
-    User.objects.bulk_create(objs=gen_users(), batch_size=10000)
-    ucount = User.objects.all().count()
-    elapsed(f"transferred {ucount} users")
 
-    Profile.objects.bulk_create(objs=gen_profile(), batch_size=10000)
-    pcount = Profile.objects.all().count()
-    elapsed(f"transferred {pcount} profiles")
+def copy_users(rows, users):
+    """
+    Copies a chunk of users together with their profiles.
+    """
+    profiles = {profile.user_id: profile for profile in UsersProfile.objects.filter(user_id__in=[u.id for u in rows])}
 
+    # Users without a profile are incomplete.
+    rows = [user for user in rows if user.id in profiles]
 
-def bulk_copy_votes(limit):
-    posts = PostsVote.objects.all()
-    posts_map = {post.uid: post for post in Post.objects.all()}
-    users_map = {user.email: user for user in User.objects.all()}
+    # Rows copied before an interruption are skipped.
+    User.objects.bulk_create([User(username=f"{slugify(user.name)}-{user.id}", email=user.email,
+                                   password=user.password, is_active=user.is_active,
+                                   is_superuser=user.is_admin, is_staff=user.is_staff)
+                              for user in rows], batch_size=1000, ignore_conflicts=True)
 
-    def gen_votes():
-        logger.info("Transferring Votes")
+    pks = dict(User.objects.filter(email__in=[user.email for user in rows]).values_list("email", "pk"))
 
-        stream = zip(count(1), posts)
-        stream = islice(stream, limit)
+    new_profiles = []
+    for user in rows:
+        profile = profiles[user.id]
+        text = util.strip_tags(profile.info)
 
-        elapsed, progress = timer_func()
-        for index, vote in stream:
-            progress(index, msg="votes")
-            post = posts_map.get(str(vote.post_id))
-            author = users_map.get(vote.author.email)
-            # Skip existing votes and incomplete post/author information.
-            if not (post and author) or not post.root:
-                continue
+        # The incoming users have weekly digest prefs as a default.
+        new_profiles.append(Profile(uid=user.id, user_id=pks[user.email], name=user.name,
+                                    message_prefs=profile.message_prefs, state=user.status,
+                                    role=user.type, last_login=user.last_login, html=profile.info,
+                                    date_joined=profile.date_joined, location=profile.location,
+                                    website=profile.website, scholar=profile.scholar, text=text,
+                                    watched_tags=profile.watched_tags, score=user.score,
+                                    twitter=profile.twitter_id, my_tags=profile.my_tags,
+                                    digest_prefs=profile.digest_prefs, new_messages=user.new_messages))
+
+    Profile.objects.bulk_create(new_profiles, batch_size=1000, ignore_conflicts=True)
+
+    users.update([(user.id, pks[user.email]) for user in rows if user.email in pks])
 
-            vote = Vote(post=post, author=author, type=vote.type, uid=vote.id,
-                        date=vote.date)
-            yield vote
-    # Bulk create the users, then profile.
-    elapsed, progress = timer_func()
-    Vote.objects.bulk_create(objs=gen_votes(), batch_size=1000)
-    vcount = Vote.objects.all().count()
-    elapsed(f"transferred {vcount} votes")
+
+def copy_votes(rows, users, posts):
+    authors = users.get_many(vote.author_id for vote in rows)
+    pks = posts.get_many(vote.post_id for vote in rows)
+
+    # Skip incomplete post/author information.
+    votes = [Vote(post_id=pks[vote.post_id], author_id=authors[vote.author_id], type=vote.type,
+                  uid=vote.id, date=vote.date)
+             for vote in rows if vote.post_id in pks and vote.author_id in authors]
+
+    Vote.objects.bulk_create(votes, batch_size=1000, ignore_conflicts=True)
 
 
 def decode(s):
@@ -152,193 +227,213 @@ def decode(s):
     return s.replace('\x00', '').replace('\0', '').replace('\000', '')
 
 
-def add_tags(delete=False):
+def copy_tags(rows):
+    """
+    Adds the tags of a chunk of posts, the missing tags are created together.
+    """
+    names = {post.pk: [t.strip() for t in post.parse_tags()] for post in rows}
+    tags = {tag.name: tag for tag in auth.get_tags(name for values in names.values() for name in values)}
+
+    for post in rows:
+        post.tags.add(*[tags[name] for name in names[post.pk] if name in tags])
+
+
+def add_tags(delete=False, state=None, chunk=None):
     logger.info("Transferring tags")
 
     if delete:
         # Delete tags before going forward.
         Tag.objects.all().delete()
+        state.reset("tags")
 
-    for post in Post.objects.iterator():
-        tags = [t.strip() for t in post.parse_tags()]
-        tags = [Tag.objects.get_or_create(name=name)[0] for name in tags]
-        post.tags.remove(*tags)
-        post.tags.add(*tags)
+    copy_table("tags", source=Post.objects.all(), copy=copy_tags, state=state, chunk=chunk)
 
 
-def bulk_copy_posts(limit):
-    relations = {}
-    all_users = User.objects.order_by("id")
-    users_set = {user.profile.uid: user for user in all_users}
+def copy_posts(rows, users, posts):
+    authors = users.get_many(uid for post in rows for uid in (post.author_id, post.lastedit_user_id))
 
-    def gen_posts():
-        logger.info("Transferring posts")
+    new_posts = []
+    for post in rows:
+        author = authors.get(post.author_id)
+        lastedit_user = authors.get(post.lastedit_user_id)
+        # Incomplete author information loaded.
+        if not (author and lastedit_user):
+            continue
 
-        posts = PostsPost.objects.order_by("id")
-        elapsed, progress = timer_func()
-        stream = zip(count(1), posts)
-        stream = islice(stream, limit)
+        is_toplevel = post.type in Post.TOP_LEVEL
 
-        for index, post in stream:
-            progress(index, msg="posts")
+        rank = post.lastedit_date.timestamp()
 
-            author = users_set.get(str(post.author_id))
-            lastedit_user = users_set.get(str(post.lastedit_user_id))
-            # Incomplete author information loaded or existing posts.
-            if not (author and lastedit_user):
-                continue
+        new_posts.append(Post(uid=post.id, html=decode(post.html), type=post.type, is_toplevel=is_toplevel,
+                              lastedit_user_id=lastedit_user, thread_votecount=post.thread_score,
+                              author_id=author, status=post.status, rank=rank, accept_count=int(post.has_accepted),
+                              lastedit_date=post.lastedit_date, book_count=post.book_count,
+                              content=decode(post.content), title=decode(post.title), vote_count=post.vote_count,
+                              creation_date=post.creation_date, tag_val=decode(post.tag_val),
+                              view_count=post.view_count))
 
-            is_toplevel = post.type in Post.TOP_LEVEL
-
-            rank = post.lastedit_date.timestamp()
-            content = post.content
-            html = post.html
-
-            new_post = Post(uid=post.id, html=decode(html), type=post.type, is_toplevel=is_toplevel,
-                            lastedit_user=lastedit_user, thread_votecount=post.thread_score,
-                            author=author, status=post.status, rank=rank, accept_count=int(post.has_accepted),
-                            lastedit_date=post.lastedit_date, book_count=post.book_count,
-                            content=decode(content), title=decode(post.title), vote_count=post.vote_count,
-                            creation_date=post.creation_date, tag_val=decode(post.tag_val),
-                            view_count=post.view_count)
-
-            # Store parent and root for every post.
-            relations[str(new_post.uid)] = [str(post.root_id), str(post.parent_id)]
-            yield new_post
-
-    def set_counts():
-        logger.info("Setting post counts")
-        descendants = lambda p: Post.objects.filter(root=p) if p.is_toplevel else Post.objects.filter(parent=p)
-        posts = {post: (descendants(post).exclude(id=post.id).filter(type=Post.ANSWER).count(),
-                        descendants(post).exclude(id=post.id).filter(type=Post.COMMENT).count())
-                 for post in Post.objects.all()}
-
-        for post in posts:
-            answer_count, comment_count = posts[post][0], posts[post][1]
-            post.reply_count = answer_count + comment_count
-            post.answer_count = answer_count
-            post.comment_count = comment_count
-            yield post
-
-    def gen_updates():
-        logger.info("Updating post relations")
-        posts = {post.uid: post for post in Post.objects.all()}
-        for pid in relations:
-            root_uid, parent_uid = relations[pid][0], relations[pid][1]
-            post = posts[pid]
-            root = posts.get(root_uid)
-            parent = posts.get(parent_uid)
-            if not (root and parent):
-                continue
-            post.root = root
-            post.parent = parent
-            yield post
-
-    def update_threadusers():
-        logger.info("Updating thread users.")
-        roots = Post.objects.filter(type__in=Post.TOP_LEVEL)
-        # Get all authors belonging to descendants of root
-        get_authors = lambda root: Post.objects.filter(root=root).values_list("author")
-        # Create dict key by root and its contributors
-        roots = {root: User.objects.filter(pk__in=get_authors(root=root)) for root in roots}
-        for post in roots:
-            users = roots[post]
-            if post.root.thread_users.filter(pk__in=users):
-                continue
+    # Posts copied before an interruption are skipped.
+    Post.objects.bulk_create(new_posts, batch_size=1000, ignore_conflicts=True)
 
-            post.thread_users.add(*users)
-
-    def gen_awards():
-        logger.info("Transferring awards.")
-        # Query the badges
-        badges = {badge.name: badge for badge in Badge.objects.all()}
-        awards = BadgesAward.objects.all()
-
-        stream = zip(count(1), awards)
-        stream = islice(stream, limit)
-        elapsed, progress = timer_func()
-        for index, award in stream:
-            progress(index, msg="awards")
-            badge = badges[award.badge.name]
-            user = users_set.get(str(award.user_id))
-            # Get post uid from context
-            post_uid = uid_from_context(award.context)
-            post = Post.objects.filter(uid=post_uid).first()
-            # Bail when a user or post do not exist
-            if not user or (post_uid and not post):
-                continue
-            award = Award(date=award.date, post=post, badge=badge, user=user, uid=award.id)
+    pks = Post.objects.filter(uid__in=[str(post.id) for post in rows]).values_list("uid", "pk")
+    posts.update([(int(uid), pk) for uid, pk in pks])
+
+
+def copy_relations(rows, posts):
+    """
+    Sets the root and parent of a chunk of posts.
+    """
+    pks = posts.get_many(uid for post in rows for uid in (post.id, post.root_id, post.parent_id))
 
-            yield award
+    updates = [Post(pk=pks[post.id], root_id=pks[post.root_id], parent_id=pks[post.parent_id])
+               for post in rows if post.id in pks and post.root_id in pks and post.parent_id in pks]
 
-    elapsed, progress = timer_func()
-    Post.objects.bulk_create(objs=gen_posts(), batch_size=1000)
-    pcount = Post.objects.all().count()
-    elapsed(f"transferred {pcount} posts")
+    Post.objects.bulk_update(updates, fields=["root", "parent"], batch_size=1000)
 
-    Post.objects.bulk_update(objs=gen_updates(), fields=["root", "parent"],
-                             batch_size=1000)
 
-    Post.objects.bulk_update(objs=set_counts(), fields=["reply_count", "comment_count", "answer_count"],
-                             batch_size=1000)
-    elapsed(f"Set {pcount} post counts.")
-    #update_threadusers()
-    add_tags()
+def copy_counts(rows):
+    """
+    Sets the reply counts of a chunk of posts. Top level posts count the whole thread.
+    """
+    roots = [post.pk for post in rows if post.is_toplevel]
+    others = [post.pk for post in rows if not post.is_toplevel]
 
-    elapsed(f"Updated {pcount} post threads and added tags.")
+    counts = defaultdict(Counter)
+    threads = Post.objects.filter(root_id__in=roots).exclude(pk=F("root_id"))
+    threads = threads.order_by().values("root_id", "type").annotate(n=Count("id"))
+    children = Post.objects.filter(parent_id__in=others).exclude(pk=F("parent_id"))
+    children = children.order_by().values("parent_id", "type").annotate(n=Count("id"))
 
-    Award.objects.bulk_create(objs=gen_awards(), batch_size=10000)
-    acount = Award.objects.all().count()
-    elapsed(f"transferred {acount} awards")
+    for row in threads:
+        counts[row["root_id"]][row["type"]] = row["n"]
+    for row in children:
+        counts[row["parent_id"]][row["type"]] = row["n"]
 
+    for post in rows:
+        post.answer_count = counts[post.pk][Post.ANSWER]
+        post.comment_count = counts[post.pk][Post.COMMENT]
+        post.reply_count = post.answer_count + post.comment_count
 
-def bulk_copy_subs(limit):
+    Post.objects.bulk_update(rows, fields=["reply_count", "comment_count", "answer_count"], batch_size=1000)
 
-    users = {user.profile.uid: user for user in User.objects.all()}
-    posts = {post.uid: post for post in Post.objects.all()}
 
-    def generate():
-        subs = PostsSubscription.objects.order_by('-date')
-        logger.info("Copying subscriptions")
-        elapsed, progress = timer_func()
-        stream = zip(count(1), subs)
-        stream = islice(stream, limit)
+def copy_awards(rows, users, posts, badges):
+    # Get post uid from context
+    contexts = {award.pk: uid_from_context(award.context) for award in rows}
+    pks = posts.get_many(int(uid) for uid in contexts.values() if uid)
+    owners = users.get_many(award.user_id for award in rows)
 
-        for index, sub in stream:
-            progress(index, msg="subscriptions")
-            user = users.get(str(sub.user_id))
-            post = posts.get(str(sub.post_id))
+    awards = []
+    for award in rows:
+        badge = badges.get(award.badge_id)
+        user = owners.get(award.user_id)
+        post_uid = contexts[award.pk]
+        post = pks.get(int(post_uid)) if post_uid else None
 
-            # Skip incomplete data or subs already made
-            if not (user and post):
-                continue
+        # Bail when a badge, user or post do not exist
+        if not (badge and user) or (post_uid and not post):
+            continue
 
-            sub = Subscription(uid=sub.id, type=sub.type, user=user, post=post, date=sub.date)
+        awards.append(Award(date=award.date, post_id=post, badge=badge, user_id=user, uid=award.id))
 
-            yield sub
+    Award.objects.bulk_create(awards, batch_size=1000, ignore_conflicts=True)
 
-    def update_counts():
-        logger.info("Updating post subs_count")
-        # Recompute subs_count for
-        posts_map = ((post, len(post.subs.exclude(user=post.author))) for post in Post.objects.all())
 
-        for post, value in posts_map:
-            post.subs_count = value
-            yield post
+def copy_subs(rows, users, posts):
+    owners = users.get_many(sub.user_id for sub in rows)
+    pks = posts.get_many(sub.post_id for sub in rows)
 
-    elapsed, progress = timer_func()
-    Subscription.objects.bulk_create(objs=generate(), batch_size=10000)
-    scount = Subscription.objects.all().count()
-    elapsed(f"transferred {scount} subscriptions")
+    # Skip incomplete data.
+    subs = [Subscription(uid=sub.id, type=sub.type, user_id=owners[sub.user_id], post_id=pks[sub.post_id],
+                         date=sub.date)
+            for sub in rows if sub.user_id in owners and sub.post_id in pks]
 
-    Post.objects.bulk_update(objs=update_counts(), fields=["subs_count"], batch_size=10000)
-    elapsed(f"Updated {scount} subscription counts")
+    Subscription.objects.bulk_create(subs, batch_size=1000, ignore_conflicts=True)
 
-    #dcount = Digest.objects.all().count()
-    #Digest.objects.bulk_create_posts(objs=gen_digests(), batch_size=10000)
-    #elapsed(f"Updated {dcount} user digests")
 
-    return
+def copy_subs_counts(rows):
+    """
+    Recompute subs_count for a chunk of posts, the author is not counted.
+    """
+    subs = Subscription.objects.filter(post_id__in=[post.pk for post in rows]).exclude(user_id=F("post__author_id"))
+    counts = dict(subs.order_by().values("post_id").annotate(n=Count("id")).values_list("post_id", "n"))
+
+    for post in rows:
+        post.subs_count = counts.get(post.pk, 0)
+
+    Post.objects.bulk_update(rows, fields=["subs_count"], batch_size=1000)
+
+
+class Transfer(object):
+    """
+    The steps of the transfer, sharing the checkpoint and the id maps.
+    """
+
+    def __init__(self, state_dir, chunk, limit=None):
+        os.makedirs(state_dir, exist_ok=True)
+        self.state = Checkpoint(os.path.join(state_dir, "checkpoint.json"))
+        self.users = IdMap(os.path.join(state_dir, "ids.db"), "users")
+        self.posts = IdMap(os.path.join(state_dir, "ids.db"), "posts")
+        self.chunk = chunk
+        self.limit = limit
+
+    def copy(self, name, source, copy, limit=None):
+        copy_table(name, source=source, copy=copy, state=self.state, chunk=self.chunk, limit=limit)
+
+    def users_step(self):
+        self.copy("users", UsersUser.objects.all(), lambda rows: copy_users(rows, users=self.users), limit=self.limit)
+
+    def posts_step(self):
+        self.copy("posts", PostsPost.objects.all(),
+                  lambda rows: copy_posts(rows, users=self.users, posts=self.posts), limit=self.limit)
+
+        self.copy("relations", PostsPost.objects.only("id", "root_id", "parent_id"),
+                  lambda rows: copy_relations(rows, posts=self.posts), limit=self.limit)
+
+    def counts_step(self):
+        self.copy("counts", Post.objects.only("pk", "is_toplevel"), copy_counts)
+
+    def tags_step(self, delete=False):
+        add_tags(delete=delete, state=self.state, chunk=self.chunk)
+
+    def votes_step(self):
+        self.copy("votes", PostsVote.objects.all(),
+                  lambda rows: copy_votes(rows, users=self.users, posts=self.posts), limit=self.limit)
+
+    def subs_step(self):
+        self.copy("subs", PostsSubscription.objects.all(),
+                  lambda rows: copy_subs(rows, users=self.users, posts=self.posts), limit=self.limit)
+
+    def subs_counts_step(self):
+        self.copy("subs_counts", Post.objects.only("pk"), copy_subs_counts)
+
+    def awards_step(self):
+        # Badges are matched by name.
+        local = {badge.name: badge for badge in Badge.objects.all()}
+        badges = {badge.id: local.get(badge.name) for badge in BadgesBadge.objects.all()}
+
+        self.copy("awards", BadgesAward.objects.all(),
+                  lambda rows: copy_awards(rows, users=self.users, posts=self.posts, badges=badges),
+                  limit=self.limit)
+
+
+def run_step(step):
+    try:
+        step()
+    finally:
+        # Each thread opened its own database connections.
+        connections.close_all()
+
+
+def run_parallel(steps, workers):
+    """
+    Runs the independent steps in a pool of threads, each with its own connections.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_step, step) for step in steps]
+        for future in futures:
+            future.result()
+
 
 def test():
 
@@ -380,8 +475,16 @@ class Command(BaseCommand):
         parser.add_argument('--users', action="store_true", help="Transfer users from source database to target.")
         parser.add_argument('--votes', action="store_true", help="Transfer votes from source database to target.")
         parser.add_argument('--subs', action="store_true", help="Transfer subs from source database to target.")
+        parser.add_argument('--awards', action="store_true", help="Transfer awards from source database to target.")
         parser.add_argument('--limit', '-n', type=int, help="Transfer subs from source database to target.")
         parser.add_argument('--tags', action="store_true", help="Add the tags to database ")
+        parser.add_argument('--chunk', type=int, default=settings.TRANSFER_CHUNK_SIZE,
+                            help="Rows copied at a time.")
+        parser.add_argument('--workers', type=int, default=settings.TRANSFER_WORKERS,
+                            help="Threads copying the independent tables.")
+        parser.add_argument('--state', default=settings.TRANSFER_STATE_DIR,
+                            help="Directory of the checkpoint and id maps used to resume the transfer.")
+        parser.add_argument('--reset', action="store_true", help="Start over, dropping the checkpoint and id maps.")
 
     def handle(self, *args, **options):
 
@@ -389,40 +492,56 @@ class Command(BaseCommand):
         load_users = options["users"]
         load_votes = options["votes"]
         load_subs = options["subs"]
+        load_awards = options["awards"]
         load_tags = options['tags']
         limit = options.get("limit") or LIMIT
+        state_dir = options['state']
 
         print(f"OLD_DATABASE (source): {settings.OLD_DATABASE}")
         print(f"NEW_DATABASE (target): {settings.NEW_DATABASE}")
 
-        #test()
-        #return
+        if options['reset']:
+            for name in ("checkpoint.json", "ids.db"):
+                path = os.path.join(state_dir, name)
+                if os.path.isfile(path):
+                    os.remove(path)
+
+        transfer = Transfer(state_dir=state_dir, chunk=options['chunk'], limit=limit)
 
+        # Single tables need the id maps of the users and posts transferred before.
         if load_posts:
-            bulk_copy_posts(limit=limit)
+            transfer.posts_step()
+            transfer.counts_step()
             return
         if load_votes:
-            bulk_copy_votes(limit=limit)
+            transfer.votes_step()
             return
         if load_users:
-            bulk_copy_users(limit=limit)
+            transfer.users_step()
             return
         if load_subs:
-            bulk_copy_subs(limit=limit)
+            transfer.subs_step()
+            transfer.subs_counts_step()
+            return
+        if load_awards:
+            transfer.awards_step()
             return
 
         if load_tags:
-            add_tags(delete=True)
+            transfer.tags_step(delete=True)
             return
 
+        # Copy everything, the posts need the users.
+        transfer.users_step()
 
-        # Copy everything
-        bulk_copy_users(limit=limit)
-
-        bulk_copy_posts(limit=limit)
+        transfer.posts_step()
 
-        bulk_copy_votes(limit=limit)
+        # The remaining tables only depend on the users and posts.
+        steps = [transfer.tags_step, transfer.votes_step, transfer.subs_step, transfer.awards_step]
+        run_parallel(steps, workers=options['workers'])
 
-        bulk_copy_subs(limit=limit)
+        # The counts update the same posts, running them one after the other avoids lock waits.
+        transfer.counts_step()
+        transfer.subs_counts_step()
 
         return
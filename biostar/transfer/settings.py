@@ -16,6 +16,13 @@ OLD_DATABASE = os.environ.setdefault("OLD_DATABASE", "old_biostar_db")
 
 # The new database where the data will be copied into.
 NEW_DATABASE = os.environ.setdefault("NEW_DATABASE", "database.db")
+
+# Rows copied at a time and threads copying the independent tables.
+TRANSFER_CHUNK_SIZE = 5000
+TRANSFER_WORKERS = 4
+
+# The checkpoint and id maps used to resume an interrupted transfer.
+TRANSFER_STATE_DIR = os.path.join(BASE_DIR, 'export', 'transfer')
 POSTGRES_HOST = os.environ.setdefault("POSTGRES_HOST", "")
 
 print(f'NEW_DATABASE={NEW_DATABASE}, OLD_DATABASE={OLD_DATABASE}')
@@ -0,0 +1,78 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from django.test import TestCase
+from biostar.accounts.models import User
+from biostar.forum import models
+from biostar.transfer.management.commands import transfer
+
+logger = logging.getLogger('engine')
+
+
+class TransferTest(TestCase):
+
+    def setUp(self):
+        logger.setLevel(logging.WARNING)
+        self.state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.state_dir)
+
+        owner = User.objects.create(username="transfer", email="transfer@tested.com")
+        self.posts = [models.Post.objects.create(title=f"Post {index}", author=owner, content="Test",
+                                                 type=models.Post.QUESTION) for index in range(5)]
+
+    def test_id_map(self):
+        """
+        Test that the ids copied are mapped, in every thread.
+        """
+        path = os.path.join(self.state_dir, "ids.db")
+        posts = transfer.IdMap(path, "posts")
+        posts.update([(10, 1), (11, 2)])
+        posts.update([(11, 3)])
+
+        self.assertEqual(posts.get_many([10, 11, 12, None, 10], size=1), {10: 1, 11: 3})
+
+        # The maps of a resumed transfer are read from the same file.
+        found = []
+        thread = threading.Thread(target=lambda: found.append(transfer.IdMap(path, "posts").get_many([10])))
+        thread.start()
+        thread.join()
+        self.assertEqual(found, [{10: 1}])
+        self.assertEqual(transfer.IdMap(path, "users").get_many([10]), {})
+
+    def test_copy_table_resume(self):
+        """
+        Test that an interrupted copy resumes after the last chunk stored.
+        """
+        path = os.path.join(self.state_dir, "checkpoint.json")
+        source = models.Post.objects.all()
+        pks = [post.pk for post in self.posts]
+        copied = []
+
+        def store(rows):
+            copied.extend(row.pk for row in rows)
+
+        def interrupted(rows):
+            if rows[0].pk == pks[2]:
+                raise ValueError("interrupted")
+            store(rows)
+
+        with self.assertRaises(ValueError):
+            transfer.copy_table("posts", source=source, copy=interrupted, state=transfer.Checkpoint(path), chunk=2)
+
+        state = transfer.Checkpoint(path)
+        self.assertEqual((state.last("posts"), state.is_done("posts")), (pks[1], False))
+
+        # Limited runs are not marked as done.
+        transfer.copy_table("posts", source=source, copy=store, state=state, chunk=2, limit=1)
+        self.assertFalse(state.is_done("posts"))
+
+        transfer.copy_table("posts", source=source, copy=store, state=transfer.Checkpoint(path), chunk=2)
+
+        self.assertTrue(transfer.Checkpoint(path).is_done("posts"))
+        self.assertEqual(copied, pks)
+
+        # A finished table is not copied again.
+        transfer.copy_table("posts", source=source, copy=interrupted, state=transfer.Checkpoint(path), chunk=2)
+        self.assertEqual(copied, pks)
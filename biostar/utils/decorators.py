@@ -1,7 +1,7 @@
 import logging, functools
 from django.conf import settings
+from django.core.cache import caches
 logger = logging.getLogger('biostar')
-import threading
 
 try:
     # When run with uwsgi the tasks will be spooled via uwsgi.
@@ -14,18 +14,20 @@ except Exception as exc:
     #
     logger.warning("uwsgi module not found, tasks will run in threads")
 
+    from biostar.utils import executor, timers
+
     # Create a threaded version of the spooler
     def spool(pass_arguments=True):
         def outer(func):
+            name = executor.register(func)
+
             @functools.wraps(func)
             def inner(*args, **kwargs):
                 if settings.DISABLE_TASKS:
                     return
                 if settings.MULTI_THREAD:
-                    # Run process in separate thread.
-                    logger.info(f"new thread for function f{func} {args} {kwargs}")
-                    t = threading.Thread(target=func, args=args, kwargs=kwargs, daemon=True)
-                    t.start()
+                    # Queue the task for the pool of worker threads.
+                    executor.get_executor().submit(name, args, kwargs)
                 else:
                     func(*args, **kwargs)
             inner.spool = inner
@@ -36,22 +38,17 @@ except Exception as exc:
     # Create a threaded version of the timer
     def timer(secs, **kwargs):
         def outer(func):
+            name = executor.register(func)
+            timers.register(name, secs, func)
+
             @functools.wraps(func)
             def inner(*args, **kwargs):
                 if settings.DISABLE_TASKS:
                     return
 
-                # The loop repeats the timer.
-                def loop():
-                    ticker = threading.Event()
-                    while not ticker.wait(secs):
-                        func(*args, **kwargs)
-
                 if settings.MULTI_THREAD:
-                    # Run process in separate thread, once.
-                    logger.info(f"new time thread for function f{func} {args} {kwargs}")
-                    t = threading.Thread(target=loop, daemon=True)
-                    t.start()
+                    # Start the loop once, it runs in the leading process only.
+                    timers.start(name, secs, func, args, kwargs)
                 else:
                     func(*args, **kwargs)
 
@@ -59,3 +56,49 @@ except Exception as exc:
             return inner
         # Gains an attribute called timer that will run the function periodically.
         return outer
+
+
+def task_key(name, value):
+    return f"TASK-{name}:{value}"
+
+
+def spool_once(key):
+    """
+    Spools the task unless one with the same key is still pending, e.g. update_spam_index:<post_id>.
+    The key is the task name and the values of the key arguments, a name or a tuple of names.
+    Tasks spooled this way take primary keys and load the latest data when they run.
+    The keys are kept in the shared cache, the process running the task clears them.
+    """
+    names = (key,) if isinstance(key, str) else tuple(key)
+
+    def value(kwargs):
+        return ":".join(str(kwargs.get(name)) for name in names)
+
+    def outer(func):
+
+        @functools.wraps(func)
+        def task(**kwargs):
+            # Submissions made once the task started are spooled again.
+            caches['shared'].delete(task_key(func.__name__, value(kwargs)))
+            return func(**kwargs)
+
+        spooled = spool(pass_arguments=True)(task)
+
+        @functools.wraps(func)
+        def submit(**kwargs):
+            name = task_key(func.__name__, value(kwargs))
+
+            # The pending task absorbs the submission. The key expires in case the task is lost.
+            if not caches['shared'].add(name, 1, settings.TASK_KEY_SECONDS):
+                return
+
+            try:
+                spooled.spool(**kwargs)
+            except Exception:
+                caches['shared'].delete(name)
+                raise
+
+        submit.spool = submit
+        return submit
+    # Gains an attribute called spool that runs the function in the background, once per key.
+    return outer
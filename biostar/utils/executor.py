@@ -0,0 +1,231 @@
+"""
+Runs the spooled tasks in a fixed pool of threads when uwsgi is not available.
+
+Tasks wait in a bounded queue. When the queue is full the caller waits for a while,
+then runs the task itself. Model instances are passed by primary key and loaded again
+when the task runs. With TASK_QUEUE_FILE set the queue is also kept in a SQLite file.
+Each process holds a lease on its tasks and keeps renewing it, the tasks whose lease
+has expired are taken over by another process.
+"""
+import importlib
+import logging
+import pickle
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+from django.apps import apps
+from django.conf import settings
+from django.db import close_old_connections, models
+
+from biostar.utils import metrics
+
+logger = logging.getLogger('biostar')
+
+# A model instance passed to a task.
+ModelRef = namedtuple('ModelRef', 'label pk')
+
+# The functions that may be spooled, by name.
+REGISTRY = {}
+
+
+def register(func):
+    name = f"{func.__module__}.{func.__qualname__}"
+    REGISTRY[name] = func
+    return name
+
+
+def lookup(name):
+    if name not in REGISTRY:
+        # Registered when the module of the task is imported.
+        importlib.import_module(name.rsplit(".", 1)[0])
+    return REGISTRY[name]
+
+
+def pack(value):
+    """
+    Replaces the saved model instances in the arguments by references.
+    """
+    if isinstance(value, models.Model) and value.pk is not None:
+        return ModelRef(value._meta.label, value.pk)
+    if isinstance(value, dict):
+        return {key: pack(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(pack(item) for item in value)
+    return value
+
+
+def unpack(value):
+    """
+    Loads the referenced model instances, one query per model in a list.
+    Lists skip the deleted instances, single references become None.
+    """
+    if isinstance(value, ModelRef):
+        return apps.get_model(value.label).objects.filter(pk=value.pk).first()
+    if isinstance(value, dict):
+        return {key: unpack(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        refs = [item for item in value if isinstance(item, ModelRef)]
+        if refs and len(refs) == len(value):
+            found = {}
+            for label in {ref.label for ref in refs}:
+                pks = [ref.pk for ref in refs if ref.label == label]
+                found.update(((label, pk), obj) for pk, obj in apps.get_model(label).objects.in_bulk(pks).items())
+            return type(value)(found[ref] for ref in refs if ref in found)
+        return type(value)(unpack(item) for item in value)
+    return value
+
+
+class Store(object):
+    """
+    Keeps the queued tasks in a SQLite file until they have run.
+    """
+
+    def __init__(self, path, lease=None):
+        self.lock = threading.Lock()
+        self.lease = lease or settings.TASK_LEASE_SECONDS
+        # Process ids are reused, the owner of the tasks is unique to this store.
+        self.owner = f"{uuid.uuid4().hex}-{int(time.time())}"
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS tasks "
+                          "(id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, payload BLOB, owner TEXT, expires REAL)")
+
+    def add(self, name, args, kwargs):
+        payload = pickle.dumps((args, kwargs))
+        with self.lock:
+            cursor = self.conn.execute("INSERT INTO tasks (name, payload, owner, expires) VALUES (?, ?, ?, ?)",
+                                       (name, payload, self.owner, time.time() + self.lease))
+        return cursor.lastrowid
+
+    def remove(self, rowid):
+        with self.lock:
+            self.conn.execute("DELETE FROM tasks WHERE id = ?", (rowid,))
+
+    def renew(self):
+        """
+        Extends the lease on the tasks of this store.
+        """
+        with self.lock:
+            self.conn.execute("UPDATE tasks SET expires = ? WHERE owner = ?", (time.time() + self.lease, self.owner))
+
+    def claim(self):
+        """
+        Takes over the tasks whose lease has expired.
+        """
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self.conn.execute("SELECT id, name, payload FROM tasks WHERE owner != ? AND expires < ? "
+                                         "ORDER BY id", (self.owner, time.time())).fetchall()
+                self.conn.executemany("UPDATE tasks SET owner = ?, expires = ? WHERE id = ?",
+                                      [(self.owner, time.time() + self.lease, row[0]) for row in rows])
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+        return [(rowid, name) + pickle.loads(payload) for rowid, name, payload in rows]
+
+
+class Executor(object):
+    """
+    A fixed number of threads running the tasks of a bounded queue.
+    """
+
+    def __init__(self, workers, size, timeout, path=None):
+        self.tasks = queue.Queue(maxsize=size)
+        self.workers = workers
+        self.timeout = timeout
+        self.store = Store(path) if path else None
+        self.lock = threading.Lock()
+        self.started = False
+
+    def start(self):
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+
+        for num in range(self.workers):
+            threading.Thread(target=self.work, name=f"task-{num}", daemon=True).start()
+
+        if self.store:
+            threading.Thread(target=self.recover, daemon=True).start()
+
+    def recover(self):
+        # Renew the lease on the queued tasks well before it expires.
+        while True:
+            try:
+                self.store.renew()
+                for rowid, name, args, kwargs in self.store.claim():
+                    logger.info(f"recovered task {name}")
+                    self.put((name, args, kwargs, time.time(), rowid))
+            except Exception as exc:
+                logger.error(f"task store error: {exc}")
+            time.sleep(self.store.lease / 3)
+
+    def submit(self, name, args, kwargs):
+        self.start()
+
+        # Models are passed by primary key.
+        args, kwargs = pack(args), pack(kwargs)
+        rowid = self.store.add(name, args, kwargs) if self.store else None
+
+        self.put((name, args, kwargs, time.time(), rowid))
+
+    def put(self, item):
+        try:
+            self.tasks.put(item, timeout=self.timeout)
+        except queue.Full:
+            # Slow down the producer by running the task in its thread.
+            logger.warning(f"task queue is full, running {item[0]} in the caller")
+            self.run(item)
+
+    def work(self):
+        while True:
+            item = self.tasks.get()
+            try:
+                self.run(item)
+            finally:
+                self.tasks.task_done()
+                # Worker threads have no requests that would recycle their connections.
+                close_old_connections()
+
+    def run(self, item):
+        name, args, kwargs, queued, rowid = item
+        start = time.time()
+        errors = 0
+        try:
+            func = lookup(name)
+            func(*unpack(args), **unpack(kwargs))
+        except Exception as exc:
+            errors = 1
+            logger.error(f"task {name} failed: {exc}")
+        finally:
+            if rowid:
+                self.store.remove(rowid)
+            metrics.observe(view=f"task:{name}", elapsed=time.time() - start,
+                            wait=int((start - queued) * 1E6), errors=errors)
+
+    def join(self):
+        """
+        Waits until the queued tasks have run.
+        """
+        self.tasks.join()
+
+
+_executor = None
+_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = Executor(workers=settings.TASK_WORKERS, size=settings.TASK_QUEUE_SIZE,
+                                 timeout=settings.TASK_QUEUE_TIMEOUT, path=settings.TASK_QUEUE_FILE)
+    return _executor
@@ -0,0 +1,112 @@
+"""
+Read-through cache for objects looked up by a unique field, such as a uid or a username.
+
+Lookups are memoized for the duration of a request and shared between processes
+via the django cache. Saving or deleting an object drops all of its cached copies.
+"""
+import hashlib
+import logging
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import request_started, request_finished
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from biostar.utils import metrics
+
+logger = logging.getLogger('engine')
+
+# The unique fields of each model that objects may be looked up by,
+# mapped to the relations fetched together with the object.
+FIELDS = {}
+
+# Holds the objects already looked up in the current request.
+_local = threading.local()
+
+
+def register(model, field, related=()):
+    """
+    Allows objects of the model to be looked up by the unique field.
+    """
+    FIELDS.setdefault(model, {})[field] = tuple(related)
+
+
+def cache_key(model, field, value):
+    digest = hashlib.md5(str(value).encode('utf-8')).hexdigest()
+    return f"IDENTITY-{model._meta.label_lower}-{field}-{digest}"
+
+
+def get(model, fresh=False, **kwargs):
+    """
+    Returns the object matching a single field lookup or None.
+
+    Cached copies do not see the changes made with queryset updates,
+    pass fresh=True to read the database (once per request) instead.
+    """
+    (field, value), = kwargs.items()
+
+    related = FIELDS[model][field]
+    key = cache_key(model, field, value)
+
+    # The memo only exists while a request is processed.
+    memo = getattr(_local, 'memo', None)
+
+    if memo is not None:
+        obj = memo.get((key, True)) or (None if fresh else memo.get((key, False)))
+        if obj is not None:
+            return obj
+
+    obj = None if fresh else cache.get(key)
+    current = obj is None
+
+    if not fresh:
+        metrics.record_cache(hit=not current)
+
+    if current:
+        obj = model.objects.filter(**kwargs).select_related(*related).first()
+        if obj is not None:
+            cache.set(key, obj, settings.IDENTITY_CACHE_SECONDS)
+
+    if memo is not None and obj is not None:
+        memo[(key, current)] = obj
+
+    return obj
+
+
+def forget(obj):
+    """
+    Drops the cached copies of an object.
+    Needs to be called after queryset updates that change what is displayed.
+    """
+    fields = FIELDS.get(type(obj), {})
+    keys = [cache_key(type(obj), field, getattr(obj, field)) for field in fields]
+
+    if not keys:
+        return
+
+    cache.delete_many(keys)
+
+    memo = getattr(_local, 'memo', None)
+    if memo is not None:
+        for key in keys:
+            memo.pop((key, True), None)
+            memo.pop((key, False), None)
+
+
+@receiver(request_started)
+def start_memo(sender, **kwargs):
+    _local.memo = {}
+
+
+@receiver(request_finished)
+def clear_memo(sender, **kwargs):
+    _local.memo = None
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate(sender, instance, **kwargs):
+    if sender in FIELDS:
+        forget(instance)
@@ -0,0 +1,200 @@
+"""
+Request timings per view, aggregated into fixed bucket histograms.
+Tasks run without uwsgi are counted the same way, as task:<name> views.
+
+Each process counts in memory and adds its counts to the shared cache every few seconds,
+where the counts of every process are kept together.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+# Upper bounds of the latency buckets in milliseconds, the last bucket is unbounded.
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Totals kept for each view, times are in microseconds.
+# Tasks add the time spent waiting in the queue and the number of failures.
+TOTALS = ('count', 'time', 'queries', 'db_time', 'cache_hits', 'cache_misses', 'wait', 'errors')
+
+# The counts of all the views, {view: {name: value}}, and the lock held while adding to them.
+COUNTS_KEY = "METRICS-COUNTS"
+LOCK_KEY = "METRICS-LOCK"
+
+# Counts of the current request.
+_local = threading.local()
+
+# Counts not yet added to the cache.
+_lock = threading.Lock()
+_pending = {}
+_flushed = time.time()
+
+
+def merge(data, counts):
+    """
+    Adds the counts to the data, both are {view: {name: value}}
+    """
+    for view, values in counts.items():
+        target = data.setdefault(view, {})
+        for name, value in values.items():
+            target[name] = target.get(name, 0) + value
+    return data
+
+
+def bucket_names():
+    return [f"le{b}" for b in BUCKETS] + ["inf"]
+
+
+def start():
+    """
+    Starts counting the queries and cache lookups of the current thread.
+    """
+    _local.current = dict(queries=0, db_time=0, cache_hits=0, cache_misses=0)
+
+
+def stop():
+    """
+    Stops counting and returns the counts.
+    """
+    current = getattr(_local, 'current', None) or {}
+    _local.current = None
+    return current
+
+
+def record_cache(hit=True, count=1):
+    """
+    Counts cache lookups made while a request is processed.
+    """
+    current = getattr(_local, 'current', None)
+    if current is not None:
+        current['cache_hits' if hit else 'cache_misses'] += count
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper that counts and times the queries.
+    """
+    start = time.time()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        current = getattr(_local, 'current', None)
+        if current is not None:
+            current['queries'] += 1
+            current['db_time'] += int((time.time() - start) * 1E6)
+
+
+def observe(view, elapsed, queries=0, db_time=0, cache_hits=0, cache_misses=0, wait=0, errors=0):
+    """
+    Adds a request that took elapsed seconds to the counts of the view.
+    """
+    global _flushed
+
+    millis = elapsed * 1000
+    bucket = next((f"le{b}" for b in BUCKETS if millis <= b), "inf")
+    values = dict(count=1, time=int(elapsed * 1E6), queries=queries, db_time=db_time,
+                  cache_hits=cache_hits, cache_misses=cache_misses, wait=wait, errors=errors)
+    values[bucket] = 1
+
+    with _lock:
+        merge(_pending, {view: values})
+        due = time.time() - _flushed >= settings.METRICS_FLUSH_SECONDS
+
+    if due:
+        flush()
+
+
+def flush():
+    """
+    Adds the counts of this process to the cache.
+    """
+    global _pending, _flushed
+
+    with _lock:
+        pending, _pending = _pending, {}
+        _flushed = time.time()
+
+    if not pending:
+        return
+
+    cache = caches['shared']
+
+    # One process adds its counts at a time, the others keep theirs for the next flush.
+    if not cache.add(LOCK_KEY, 1, settings.METRICS_FLUSH_SECONDS):
+        with _lock:
+            merge(_pending, pending)
+        return
+
+    try:
+        cache.set(COUNTS_KEY, merge(cache.get(COUNTS_KEY) or {}, pending), None)
+    finally:
+        cache.delete(LOCK_KEY)
+
+
+def collect():
+    """
+    Returns the counts of every view: {view: {name: value}}
+    """
+    flush()
+
+    names = TOTALS + tuple(bucket_names())
+    stored = caches['shared'].get(COUNTS_KEY) or {}
+
+    return {view: {name: stored[view].get(name, 0) for name in names} for view in sorted(stored)}
+
+
+def percentile(counts, q):
+    """
+    Estimates the q-th percentile in milliseconds from the bucket counts of a view.
+    """
+    counts = [counts[name] for name in bucket_names()]
+    total = sum(counts)
+    if not total:
+        return 0
+
+    rank, seen, lower = q * total, 0, 0
+    for bound, count in zip(BUCKETS + (None,), counts):
+        if count and seen + count >= rank:
+            # Requests past the last bound are reported at the last bound.
+            if bound is None:
+                return lower
+            return lower + (bound - lower) * (rank - seen) / count
+        seen += count
+        lower = bound if bound is not None else lower
+
+    return lower
+
+
+def prometheus():
+    """
+    Returns the counts in the Prometheus text exposition format.
+    """
+    lines = [
+        "# TYPE biostar_request_duration_seconds histogram",
+    ]
+    data = collect()
+
+    for view, counts in data.items():
+        cumulative = 0
+        for bound, name in zip(BUCKETS + (None,), bucket_names()):
+            cumulative += counts[name]
+            le = "+Inf" if bound is None else f"{bound / 1000:g}"
+            lines.append(f'biostar_request_duration_seconds_bucket{{view="{view}",le="{le}"}} {cumulative}')
+        lines.append(f'biostar_request_duration_seconds_sum{{view="{view}"}} {counts["time"] / 1E6}')
+        lines.append(f'biostar_request_duration_seconds_count{{view="{view}"}} {counts["count"]}')
+
+    totals = [
+        ("biostar_db_queries_total", lambda c: c['queries']),
+        ("biostar_db_duration_seconds_total", lambda c: c['db_time'] / 1E6),
+        ("biostar_cache_hits_total", lambda c: c['cache_hits']),
+        ("biostar_cache_misses_total", lambda c: c['cache_misses']),
+        ("biostar_queue_wait_seconds_total", lambda c: c['wait'] / 1E6),
+        ("biostar_errors_total", lambda c: c['errors']),
+    ]
+    for metric, value in totals:
+        lines.append(f"# TYPE {metric} counter")
+        for view, counts in data.items():
+            lines.append(f'{metric}{{view="{view}"}} {value(counts)}')
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,141 @@
+"""
+Runs the periodic tasks when uwsgi is not available.
+
+Each timer runs in a single process per host, the one holding the lock file of the timer.
+The other processes try to take over the lock at every interval. Runs are spread out by
+a random jitter and a run that lasts past the next one skips it. The last run time and
+duration of each timer are kept in a JSON file next to its lock file.
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from django.conf import settings
+
+from biostar.utils import metrics
+
+try:
+    import fcntl
+except ImportError:
+    # Every process leads where there are no file locks.
+    fcntl = None
+
+logger = logging.getLogger('biostar')
+
+# The interval and function of each timer, by name.
+REGISTRY = {}
+
+# Timers started in this process.
+_started = set()
+_lock = threading.Lock()
+
+
+def status_path(name):
+    return os.path.join(settings.TIMER_LOCK_DIR, f"{name}.json")
+
+
+def register(name, secs, func):
+    REGISTRY[name] = (secs, func)
+
+
+def acquire(name):
+    """
+    Returns the locked file when this process leads the timer, None otherwise.
+    The lock is released when the process exits.
+    """
+    if fcntl is None:
+        return True
+
+    os.makedirs(settings.TIMER_LOCK_DIR, exist_ok=True)
+    fp = open(os.path.join(settings.TIMER_LOCK_DIR, f"{name}.lock"), 'a')
+    try:
+        fcntl.flock(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        fp.close()
+        return None
+
+    return fp
+
+
+def report(name, start, duration, errors):
+    data = dict(last_run=start, duration=duration, errors=errors, pid=os.getpid())
+
+    # Readers never see a partially written file.
+    os.makedirs(settings.TIMER_LOCK_DIR, exist_ok=True)
+    path = status_path(name)
+    temp = f"{path}.{os.getpid()}.tmp"
+    with open(temp, 'w') as fp:
+        json.dump(data, fp)
+    os.replace(temp, path)
+
+
+def status():
+    """
+    Returns the last run of every timer: {name: {last_run, duration, errors, pid}}
+    """
+    if not os.path.isdir(settings.TIMER_LOCK_DIR):
+        return {}
+
+    data = {}
+    for fname in sorted(os.listdir(settings.TIMER_LOCK_DIR)):
+        if not fname.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(settings.TIMER_LOCK_DIR, fname)) as fp:
+                data[fname[:-len(".json")]] = json.load(fp)
+        except (OSError, ValueError) as exc:
+            logger.warning(f"timer status {fname} not read: {exc}")
+
+    return data
+
+
+def run(name, func, args=(), kwargs={}):
+    start = time.time()
+    errors = 0
+    try:
+        func(*args, **kwargs)
+    except Exception as exc:
+        errors = 1
+        logger.error(f"timer {name} failed: {exc}")
+    finally:
+        duration = time.time() - start
+        report(name, start=start, duration=duration, errors=errors)
+        metrics.observe(view=f"timer:{name}", elapsed=duration, errors=errors)
+
+
+def loop(name, secs, func, args, kwargs):
+    lock = None
+    due = time.monotonic() + secs
+
+    while True:
+        # The jitter keeps the timers of many hosts from running together.
+        time.sleep(max(0.0, due - time.monotonic()) + random.uniform(0, secs * settings.TIMER_JITTER))
+
+        lock = lock or acquire(name)
+        if lock:
+            run(name, func, args, kwargs)
+
+        due += secs
+        skipped = 0
+        while due <= time.monotonic():
+            due += secs
+            skipped += 1
+        if skipped:
+            logger.warning(f"timer {name} skipped {skipped} runs")
+
+
+def start(name, secs, func, args=(), kwargs={}):
+    """
+    Starts the loop of the timer in this process, once.
+    """
+    with _lock:
+        if name in _started:
+            return False
+        _started.add(name)
+
+    threading.Thread(target=loop, args=(name, secs, func, args, kwargs), name=f"timer-{name}", daemon=True).start()
+
+    return True
@@ -20,5 +20,8 @@ export POSTGRES_HOST=/var/run/postgresql
 # Migrate the server.
 python manage.py migrate
 
+# Create the table of the shared cache.
+python manage.py createcachetable
+
 # Collect static files
 python manage.py collectstatic --noinput